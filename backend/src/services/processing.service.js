@@ -3,6 +3,7 @@ import { randomUUID } from "crypto";
 import { ApiResponse } from "../utils/ApiResponse.js";
 import { logError, logInfo } from "../utils/CustomLogger.js";
 import { createDirectory, deleteDirectory, getFile, uploadFile } from "./s3.service.js";
+import { getStoredSummary } from "./summary.service.js";
 import { ApiError } from "../utils/ApiError.js";
 import fs from "fs";
 const createVisit = async (req, res) => {
@@ -259,12 +260,13 @@ const fetchReport = async (req, res) => {
     
     {
       /**
-            get the visit analysis from S3 and then return it
+            get the visit analysis from the database, or from S3 if it was not ingested, and then return it
         */
     }
-    const file = await getFile(visit.uniqueID)
+    const stored = await getStoredSummary(visit.uniqueID);
+    const file = stored || await getFile(visit.uniqueID)
     if (file) {
-      logInfo("Successfully fetched file from S3 for " + visit.uniqueID);
+      logInfo(`Successfully fetched file from ${stored ? "the database" : "S3"} for ` + visit.uniqueID);
       return res.status(200).json({
         success: true,
         message: "File fetched successfully",
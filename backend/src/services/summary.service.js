@@ -0,0 +1,49 @@
+import { QueryTypes } from "sequelize";
+import { db } from "../db/db.js";
+import { logError } from "../utils/CustomLogger.js";
+
+// The output Lambda parses each visit's summary.json into these tables once
+// its job completes; visits ingested before that are still read from S3.
+const getStoredSummary = async (uniqueID) => {
+    try {
+        const select = (sql) => db.query(sql, { replacements: [uniqueID], type: QueryTypes.SELECT });
+
+        const sections = await select(
+            "SELECT sectionIndex, sectionName FROM VisitSections WHERE uniqueID = ? ORDER BY sectionIndex"
+        );
+        if (sections.length === 0) {
+            return null;
+        }
+        const [segments, links] = await Promise.all([
+            select(
+                "SELECT sectionIndex, segmentIndex, summarizedSegment FROM VisitSummarySegments " +
+                "WHERE uniqueID = ? ORDER BY sectionIndex, segmentIndex"
+            ),
+            select(
+                "SELECT sectionIndex, segmentIndex, segmentId FROM VisitEvidenceLinks " +
+                "WHERE uniqueID = ? ORDER BY sectionIndex, segmentIndex, linkIndex"
+            )
+        ]);
+
+        // Rebuild the summary.json shape the dashboard renders
+        const bySection = new Map(sections.map(({ sectionIndex, sectionName }) =>
+            [sectionIndex, { SectionName: sectionName, Summary: [] }]
+        ));
+        const bySegment = new Map();
+        for (const { sectionIndex, segmentIndex, summarizedSegment } of segments) {
+            const segment = { EvidenceLinks: [], SummarizedSegment: summarizedSegment };
+            bySection.get(sectionIndex)?.Summary.push(segment);
+            bySegment.set(`${sectionIndex}/${segmentIndex}`, segment);
+        }
+        for (const { sectionIndex, segmentIndex, segmentId } of links) {
+            bySegment.get(`${sectionIndex}/${segmentIndex}`)?.EvidenceLinks.push({ SegmentId: segmentId });
+        }
+        return { ClinicalDocumentation: { Sections: [...bySection.values()] } };
+    } catch (error) {
+        // Tables not created yet, or the database is unavailable: fall back to S3
+        logError("Error reading stored summary:", error);
+        return null;
+    }
+}
+
+export { getStoredSummary };
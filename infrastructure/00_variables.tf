@@ -74,4 +74,10 @@ variable "db_password" {
   type = string
   default = "admin!vaibhav"
   
-}
\ No newline at end of file
+}
+#HealthScribe admission control, shared by every input lambda
+variable "healthscribe_max_concurrent_jobs" {
+  type = number
+  default = 0
+  description = "Concurrent HealthScribe jobs allowed by the account quota; 0 turns admission control off"
+}
@@ -84,6 +84,14 @@ resource "aws_security_group" "database" {
     protocol  = "tcp"
     security_groups = [aws_security_group.output_lambda_function.id]
   }
+
+  # STATE_STORE tables of the input Lambdas
+  ingress {
+    from_port = 3306
+    to_port   = 3306
+    protocol  = "tcp"
+    security_groups = [aws_security_group.input_lambda_function.id]
+  }
   
     
     egress {
@@ -186,6 +194,25 @@ resource "aws_security_group" "backend-load_balancer" {
    
     
   
+    egress {
+        from_port   = 0
+        to_port     = 0
+        protocol    = "-1"
+        cidr_blocks = ["0.0.0.0/0"]
+    }
+}
+
+
+# Input Lambdas reach the database for their state store, and S3 and
+# HealthScribe through the NAT gateway
+resource "aws_security_group" "input_lambda_function" {
+    name = "input-lambda-sg"
+    description = "Outbound traffic of the HealthScribe Lambdas"
+    vpc_id = aws_vpc.vpc.id
+    tags = {
+        Name = "input-lambda-sg"
+    }
+
     egress {
         from_port   = 0
         to_port     = 0
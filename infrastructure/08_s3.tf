@@ -51,6 +51,8 @@ resource "aws_s3_bucket_notification" "s3_to_sqs" {
     events    = ["s3:ObjectCreated:*"]
 
     filter_prefix = ""
+    # summary.json marks a job's outputs as complete; other objects need no status update
+    filter_suffix = "summary.json"
   }
 
   depends_on = [aws_sqs_queue_policy.output_processing_policy]
@@ -1,3 +1,29 @@
+# Deployment package built from every module in input_lambda/
+data "archive_file" "input_lambda_package" {
+  type        = "zip"
+  source_dir  = "${path.module}/input_lambda"
+  output_path = "${path.module}/input_lambda/lambda.zip"
+  excludes    = ["lambda.zip", "__pycache__", "benchmarks", "backfill.py", "tests"]
+}
+
+# Environment shared by the processor, completion and scheduler functions.
+# Admission settings must match: the processor takes quota slots, the other
+# two hand them back and drain the backlog
+locals {
+  input_lambda_environment = {
+    # Ledger, admission, checkpoint and visit stage tables in the application database
+    STATE_STORE = "mysql",
+    db_string = aws_db_instance.medi_sync_ai_db.address,
+    db_user = aws_db_instance.medi_sync_ai_db.username,
+    db_password = aws_db_instance.medi_sync_ai_db.password,
+    db_name = aws_db_instance.medi_sync_ai_db.db_name,
+    HEALTHSCRIBE_ROLE_ARN = aws_iam_role.healthscribe_service_role.arn,
+    OUTPUT_BUCKET_NAME = aws_s3_bucket.output-bucket.bucket,
+    # Concurrent HealthScribe jobs allowed by the account quota; 0 turns admission control off
+    HEALTHSCRIBE_MAX_CONCURRENT_JOBS = tostring(var.healthscribe_max_concurrent_jobs)
+  }
+}
+
 # Lambda function for AWS HealthScribe processing
 resource "aws_lambda_function" "healthscribe_processor" {
   function_name = "medisync_healthscribe_processor"
@@ -8,23 +34,157 @@ resource "aws_lambda_function" "healthscribe_processor" {
   handler       = "lambda_function.lambda_handler"
   
   # Create a deployment package from the code
-  filename      = "${path.module}/input_lambda/lambda.zip"
-  source_code_hash = filebase64sha256("${path.module}/input_lambda/lambda.zip")
+  filename      = data.archive_file.input_lambda_package.output_path
+  source_code_hash = data.archive_file.input_lambda_package.output_base64sha256
+  # Shared modules such as lambda_log
+  layers = [aws_lambda_layer_version.shared.arn]
   
   # Set timeout to allow HealthScribe jobs to complete
   timeout       = 900  # 15 minutes
   memory_size   = 256
   
+  # Private subnets with a NAT route, so the state store in the database is reachable
+  vpc_config {
+    security_group_ids = [aws_security_group.input_lambda_function.id]
+    subnet_ids = [
+      aws_subnet.az_1private_subnet_3.id,
+      aws_subnet.az_2private_subnet_3.id
+    ]
+  }
+
   # IAM role for the Lambda function
   role          = aws_iam_role.lambda_healthscribe_role.arn
   
   # Environment variables
   environment {
-    variables = {
-      HEALTHSCRIBE_ROLE_ARN = aws_iam_role.healthscribe_service_role.arn,
-      OUTPUT_BUCKET_NAME = aws_s3_bucket.output-bucket.bucket
+    variables = merge(local.input_lambda_environment, {
+      # Submit and return; completion is handled by the job state change lambda
+      HEALTHSCRIBE_WAIT_FOR_COMPLETION = "false"
+    })
+  }
+
+  depends_on = [
+    aws_iam_role_policy_attachment.lambda_healthscribe_network_attachment
+  ]
+}
+
+# Lambda function handling HealthScribe job completion events
+resource "aws_lambda_function" "healthscribe_completion" {
+  function_name = "medisync_healthscribe_completion"
+  description   = "Handles HealthScribe job state change events"
+
+  runtime       = "python3.9"
+  handler       = "lambda_function.job_state_change_handler"
+
+  # Same deployment package as the processor
+  filename      = data.archive_file.input_lambda_package.output_path
+  source_code_hash = data.archive_file.input_lambda_package.output_base64sha256
+  # Shared modules such as lambda_log
+  layers = [aws_lambda_layer_version.shared.arn]
+
+  timeout       = 60
+  memory_size   = 256
+
+  # Private subnets with a NAT route, so the state store in the database is reachable
+  vpc_config {
+    security_group_ids = [aws_security_group.input_lambda_function.id]
+    subnet_ids = [
+      aws_subnet.az_1private_subnet_3.id,
+      aws_subnet.az_2private_subnet_3.id
+    ]
+  }
+
+  role          = aws_iam_role.lambda_healthscribe_role.arn
+
+  environment {
+    variables = local.input_lambda_environment
+  }
+
+  depends_on = [
+    aws_iam_role_policy_attachment.lambda_healthscribe_network_attachment
+  ]
+}
+
+# EventBridge rule for HealthScribe jobs reaching a terminal state
+resource "aws_cloudwatch_event_rule" "healthscribe_job_state_change" {
+  name        = "medisync_healthscribe_job_state_change"
+  description = "HealthScribe job completed or failed"
+
+  event_pattern = jsonencode({
+    source = ["aws.transcribe"],
+    detail = {
+      MedicalScribeJobStatus = ["COMPLETED", "FAILED"]
     }
+  })
+}
+
+resource "aws_cloudwatch_event_target" "healthscribe_completion_target" {
+  rule = aws_cloudwatch_event_rule.healthscribe_job_state_change.name
+  arn  = aws_lambda_function.healthscribe_completion.arn
+}
+
+resource "aws_lambda_permission" "eventbridge_invocation" {
+  statement_id  = "AllowEventBridgeInvocation"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.healthscribe_completion.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.healthscribe_job_state_change.arn
+}
+
+# Lambda function resuming checkpointed jobs and draining the admission backlog
+resource "aws_lambda_function" "healthscribe_scheduler" {
+  function_name = "medisync_healthscribe_scheduler"
+  description   = "Polls checkpointed HealthScribe jobs and submits queued ones"
+
+  runtime       = "python3.9"
+  handler       = "lambda_function.checkpoint_handler"
+
+  # Same deployment package as the processor
+  filename      = data.archive_file.input_lambda_package.output_path
+  source_code_hash = data.archive_file.input_lambda_package.output_base64sha256
+  # Shared modules such as lambda_log
+  layers = [aws_lambda_layer_version.shared.arn]
+
+  timeout       = 60
+  memory_size   = 256
+
+  # Private subnets with a NAT route, so the state store in the database is reachable
+  vpc_config {
+    security_group_ids = [aws_security_group.input_lambda_function.id]
+    subnet_ids = [
+      aws_subnet.az_1private_subnet_3.id,
+      aws_subnet.az_2private_subnet_3.id
+    ]
   }
+
+  role          = aws_iam_role.lambda_healthscribe_role.arn
+
+  environment {
+    variables = local.input_lambda_environment
+  }
+
+  depends_on = [
+    aws_iam_role_policy_attachment.lambda_healthscribe_network_attachment
+  ]
+}
+
+resource "aws_cloudwatch_event_rule" "healthscribe_scheduler" {
+  name                = "medisync_healthscribe_scheduler"
+  description         = "Resume checkpointed HealthScribe jobs and drain the job backlog"
+  schedule_expression = "rate(1 minute)"
+}
+
+resource "aws_cloudwatch_event_target" "healthscribe_scheduler_target" {
+  rule = aws_cloudwatch_event_rule.healthscribe_scheduler.name
+  arn  = aws_lambda_function.healthscribe_scheduler.arn
+}
+
+resource "aws_lambda_permission" "scheduler_invocation" {
+  statement_id  = "AllowEventBridgeScheduleInvocation"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.healthscribe_scheduler.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.healthscribe_scheduler.arn
 }
 
 # IAM role for the Lambda function
@@ -93,6 +253,28 @@ resource "aws_iam_policy" "lambda_healthscribe_policy" {
           "${aws_s3_bucket.bucket.arn}/*"
         ]
       },
+      {
+        # Chunk audio and manifests of split recordings, and trimmed derivatives
+        Action = [
+          "s3:PutObject"
+        ],
+        Effect   = "Allow",
+        Resource = [
+          "${aws_s3_bucket.bucket.arn}/*/_chunks/*",
+          "${aws_s3_bucket.bucket.arn}/*/_preprocessed/*"
+        ]
+      },
+      {
+        # Reading chunk outputs and writing the merged documents
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject"
+        ],
+        Effect   = "Allow",
+        Resource = [
+          "${aws_s3_bucket.output-bucket.arn}/*"
+        ]
+      },
       {
         Action = [
           "iam:PassRole"
@@ -104,6 +286,12 @@ resource "aws_iam_policy" "lambda_healthscribe_policy" {
   })
 }
 
+# ENI management for the functions in the VPC
+resource "aws_iam_role_policy_attachment" "lambda_healthscribe_network_attachment" {
+  role       = aws_iam_role.lambda_healthscribe_role.name
+  policy_arn = aws_iam_policy.network_interface_policy.arn
+}
+
 # Attach custom policy to Lambda role
 resource "aws_iam_role_policy_attachment" "lambda_healthscribe_attachment" {
   role       = aws_iam_role.lambda_healthscribe_role.name
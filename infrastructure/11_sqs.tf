@@ -36,7 +36,11 @@ data "aws_iam_policy_document" "sqs_s3_policy" {
 resource "aws_lambda_event_source_mapping" "sqs-output-lambda-trigger" {
     event_source_arn = aws_sqs_queue.output_status_update_queue.arn
     function_name = aws_lambda_function.output_processor.function_name
-  batch_size       = 1
+  # Status updates of a batch are applied as one UPDATE, so larger batches save round trips
+  batch_size       = 100
+  maximum_batching_window_in_seconds = 5
+  # Only the messages listed in batchItemFailures are redelivered
+  function_response_types = ["ReportBatchItemFailures"]
   enabled          = true
   
 }
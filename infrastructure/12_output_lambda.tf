@@ -1,3 +1,11 @@
+# Deployment package built from output_lambda/output_lambda; pymysql comes from the shared layer
+data "archive_file" "output_lambda_package" {
+  type        = "zip"
+  source_dir  = "${path.module}/output_lambda/output_lambda"
+  output_path = "${path.module}/output_lambda/output_lambda.zip"
+  excludes    = ["__pycache__"]
+}
+
 # Lambda function for AWS HealthScribe processing
 resource "aws_lambda_function" "output_processor" {
   function_name = "output_status_processor"
@@ -7,8 +15,10 @@ resource "aws_lambda_function" "output_processor" {
   runtime       = "python3.12"
   handler       = "lambda_function.lambda_handler"
   
-  filename      = "${path.module}/output_lambda/output_lambda.zip"
-  source_code_hash = filebase64sha256("${path.module}/output_lambda/output_lambda.zip")
+  filename      = data.archive_file.output_lambda_package.output_path
+  source_code_hash = data.archive_file.output_lambda_package.output_base64sha256
+  # Shared modules such as lambda_log
+  layers = [aws_lambda_layer_version.shared.arn]
   
   timeout       = 900  # 15 minutes
   memory_size   = 256
@@ -28,7 +38,11 @@ resource "aws_lambda_function" "output_processor" {
       db_string = aws_db_instance.medi_sync_ai_db.address,
       db_user =  aws_db_instance.medi_sync_ai_db.username,
       db_password = aws_db_instance.medi_sync_ai_db.password,
-      db_name = aws_db_instance.medi_sync_ai_db.db_name
+      db_name = aws_db_instance.medi_sync_ai_db.db_name,
+      # Parse summary.json and transcript.json into tables the web app reads
+      INGEST_DOCUMENTS = "true",
+      # Trim manifests of uploads whose transcript times are restored after the job
+      INPUT_BUCKET_NAME = aws_s3_bucket.bucket.bucket
     }
   }
 
@@ -68,3 +82,30 @@ resource "aws_iam_role_policy" "lambda_sqs_access_policy" {
     ]
   })
 }
+
+# Read the HealthScribe outputs of completed visits for ingestion into the database
+resource "aws_iam_role_policy" "lambda_output_bucket_read_policy" {
+  name = "lambda_output_bucket_read_policy"
+  role = aws_iam_role.lambda_role.name
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect = "Allow",
+        Action = [
+          "s3:GetObject"
+        ],
+        Resource = "${aws_s3_bucket.output-bucket.arn}/*"
+      },
+      {
+        # Trim manifests, to tell whether a transcript still has its times restored
+        Effect = "Allow",
+        Action = [
+          "s3:GetObject"
+        ],
+        Resource = "${aws_s3_bucket.bucket.arn}/*/_preprocessed/manifest.json"
+      }
+    ]
+  })
+}
@@ -170,9 +170,72 @@ resource "aws_cloudwatch_dashboard" "resource_utilizaiton" {
         }
       },
       {
-        type   = "text"
+        type   = "metric"
         x      = 0
         y      = 24
+        width  = 12
+        height = 6
+
+        properties = {
+          metrics = [
+            ["MediSync/Pipeline", "UploadToSubmit", "Function", "${aws_lambda_function.healthscribe_processor.function_name}", { "label": "Upload to submit" }],
+            ["MediSync/Pipeline", "JobDuration", "Function", "${aws_lambda_function.healthscribe_completion.function_name}", { "label": "HealthScribe job" }],
+            ["MediSync/Pipeline", "CompletionDetectionDelay", "Function", "${aws_lambda_function.healthscribe_completion.function_name}", { "label": "Job done to handled" }],
+            ["MediSync/Pipeline", "OutputToProcessed", "Function", "${aws_lambda_function.output_processor.function_name}", { "label": "Output to status update" }],
+            ["MediSync/Pipeline", "UploadToProcessed", "Function", "${aws_lambda_function.output_processor.function_name}", { "label": "Upload to Processed" }]
+          ]
+          period = 300
+          stat   = "p95"
+          region = var.region
+          title  = "Pipeline Stage Durations (seconds, p95)"
+          view   = "timeSeries"
+        }
+      },
+      {
+        type   = "metric"
+        x      = 12
+        y      = 24
+        width  = 12
+        height = 6
+
+        properties = {
+          metrics = [
+            ["MediSync/Pipeline", "SubmitLatency", "Function", "${aws_lambda_function.healthscribe_processor.function_name}", { "label": "StartMedicalScribeJob latency (ms)" }],
+            ["MediSync/Pipeline", "PollCallsPerJob", "Function", "${aws_lambda_function.healthscribe_processor.function_name}", { "label": "Poll calls per job" }],
+            ["MediSync/Pipeline", "StatusUpdateLatency", "Function", "${aws_lambda_function.output_processor.function_name}", { "label": "Status update latency (ms)" }]
+          ]
+          period = 300
+          stat   = "Average"
+          region = var.region
+          title  = "Pipeline Call Latencies"
+          view   = "timeSeries"
+        }
+      },
+      {
+        type   = "metric"
+        x      = 0
+        y      = 30
+        width  = 24
+        height = 6
+
+        properties = {
+          metrics = [
+            ["MediSync/Pipeline", "UploadedToSubmitted", "Function", "${aws_lambda_function.healthscribe_processor.function_name}", { "label": "Uploaded to submitted" }],
+            ["MediSync/Pipeline", "SubmittedToTranscribed", "Function", "${aws_lambda_function.healthscribe_completion.function_name}", { "label": "Submitted to transcribed" }],
+            ["MediSync/Pipeline", "TranscribedToSummarized", "Function", "${aws_lambda_function.output_processor.function_name}", { "label": "Transcribed to summarized" }],
+            ["MediSync/Pipeline", "SummarizedToIngested", "Function", "${aws_lambda_function.output_processor.function_name}", { "label": "Summarized to ingested" }]
+          ]
+          period = 300
+          stat   = "p95"
+          region = var.region
+          title  = "Visit Stage Latencies (seconds, p95)"
+          view   = "timeSeries"
+        }
+      },
+      {
+        type   = "text"
+        x      = 0
+        y      = 36
         width  = 24
         height = 2
 
@@ -0,0 +1,15 @@
+# Lambda layer with the Python modules shared by the input and output Lambdas
+data "archive_file" "shared_layer_package" {
+  type        = "zip"
+  source_dir  = "${path.module}/shared_layer"
+  output_path = "${path.module}/shared_layer.zip"
+  excludes    = ["__pycache__", "python/__pycache__"]
+}
+
+resource "aws_lambda_layer_version" "shared" {
+  layer_name          = "medisync_shared"
+  description         = "Logging, metrics, transcript modules and pymysql shared by the MediSync Lambdas"
+  filename            = data.archive_file.shared_layer_package.output_path
+  source_code_hash    = data.archive_file.shared_layer_package.output_base64sha256
+  compatible_runtimes = ["python3.9", "python3.12"]
+}
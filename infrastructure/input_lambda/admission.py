@@ -0,0 +1,326 @@
+"""
+Admission control for HealthScribe submissions.
+
+The account can only run a limited number of HealthScribe jobs at once.
+Rather than letting bursts fail with throttling errors, submissions take a
+slot from a budget kept in the state store. When no slot is free the job
+request is parked in a backlog table, and the backlog is drained in arrival
+order as running jobs finish and hand their slots back. Which queued job
+goes next is decided by the priority scheduler in scheduling.py.
+
+A slot is normally handed back when its job's completion is handled. A job
+whose completion never arrives, e.g. because the invocation timed out after
+taking the slot, would hold it forever, so slots older than the job timeout
+are expired before the backlog is drained.
+"""
+import json
+import time
+
+import lambda_log
+import lambda_metrics
+from scheduling import DEFAULT_PRIORITY, PRIORITY_CLASSES, pick_next
+from store import get_store
+
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS healthscribe_admission_budget (
+        id INT NOT NULL PRIMARY KEY,
+        running INT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS healthscribe_admission_running (
+        job_name VARCHAR(200) NOT NULL PRIMARY KEY,
+        doctor_id VARCHAR(200),
+        admitted_at DOUBLE NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS healthscribe_admission_backlog (
+        job_name VARCHAR(200) NOT NULL PRIMARY KEY,
+        request TEXT NOT NULL,
+        priority VARCHAR(20) NOT NULL,
+        doctor_id VARCHAR(200),
+        enqueued_at DOUBLE NOT NULL
+    )
+    """
+]
+
+# Submission errors that retrying the same request cannot fix; such a
+# request is dropped from the backlog instead of blocking it
+REJECTED_ERROR_CODES = ['BadRequestException', 'ConflictException', 'ValidationException']
+
+
+def _error_code(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+class AdmissionController:
+    """
+    Slot budget and backlog for HealthScribe jobs.
+
+    Args:
+        store (store.Store): Store holding the admission tables
+        quota (int): Number of jobs allowed to run at the same time
+        aging_seconds (float): Queue wait after which a job moves up one
+            priority class
+        job_timeout_seconds (float): Age after which a slot is taken back
+            from a job whose completion was never handled
+        clock (callable): Wall clock in seconds
+    """
+
+    def __init__(self, store, quota, aging_seconds=600, job_timeout_seconds=6 * 3600, clock=time.time):
+        self.store = store
+        self.quota = quota
+        self.aging_seconds = aging_seconds
+        self.job_timeout_seconds = job_timeout_seconds
+        self.clock = clock
+        self.wait_times = {}
+        for statement in CREATE_TABLES:
+            self.store.execute(statement)
+        try:
+            self.store.execute("INSERT INTO healthscribe_admission_budget (id, running) VALUES (1, 0)")
+        except self.store.IntegrityError:
+            pass
+
+    def _reserve_slot(self):
+        # A single conditional UPDATE keeps concurrent Lambdas within the quota
+        _, rowcount = self.store.execute(
+            "UPDATE healthscribe_admission_budget SET running = running + 1 WHERE id = 1 AND running < %s",
+            (self.quota,)
+        )
+        return rowcount == 1
+
+    def _return_slot(self):
+        self.store.execute(
+            "UPDATE healthscribe_admission_budget SET running = running - 1 WHERE id = 1 AND running > 0"
+        )
+
+    def _mark_running(self, job_name, doctor_id=None):
+        """
+        Record a job as holding the slot just reserved.
+
+        Returns:
+            bool: False if the job already holds a slot, e.g. a resubmission
+                of the same job; the reserved slot is handed back then
+        """
+        try:
+            self.store.execute(
+                "INSERT INTO healthscribe_admission_running (job_name, doctor_id, admitted_at) VALUES (%s, %s, %s)",
+                (job_name, doctor_id, self.clock())
+            )
+        except self.store.IntegrityError:
+            self._return_slot()
+            return False
+        return True
+
+    def admit(self, job_name, request, priority=DEFAULT_PRIORITY, doctor_id=None):
+        """
+        Take a slot for a job, or queue its request when the quota is used up.
+
+        Args:
+            job_name (str): Name of the MedicalScribe job
+            request (dict): StartMedicalScribeJob arguments
+            priority (str): Priority class of the visit
+            doctor_id (str): Doctor the visit belongs to, for fairness
+
+        Returns:
+            bool: True if the job may be submitted now, False if it was queued
+        """
+        if self._reserve_slot():
+            if self._mark_running(job_name, doctor_id):
+                return True
+            # Already admitted: wait in the backlog until that slot is released or expires
+            lambda_log.info("Job already holds a slot, queueing it", jobName=job_name)
+        self.enqueue(job_name, request, priority, doctor_id)
+        return False
+
+    def enqueue(self, job_name, request, priority=DEFAULT_PRIORITY, doctor_id=None, enqueued_at=None):
+        """
+        Park a job request in the backlog.
+        """
+        try:
+            self.store.execute(
+                "INSERT INTO healthscribe_admission_backlog (job_name, request, priority, doctor_id, enqueued_at) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                (job_name, json.dumps(request), priority, doctor_id,
+                 enqueued_at if enqueued_at is not None else self.clock())
+            )
+        except self.store.IntegrityError:
+            lambda_log.info("Job is already queued", jobName=job_name)
+
+    def requeue(self, job_name, request, priority=DEFAULT_PRIORITY, doctor_id=None):
+        """
+        Give back the slot of a job whose submission was throttled and queue
+        it again.
+        """
+        self.release(job_name)
+        self.enqueue(job_name, request, priority, doctor_id)
+
+    def release(self, job_name):
+        """
+        Hand back the slot held by a finished job. Releasing a job twice, e.g.
+        for a redelivered completion event, frees only one slot.
+
+        Returns:
+            bool: True if this call freed the job's slot
+        """
+        _, rowcount = self.store.execute(
+            "DELETE FROM healthscribe_admission_running WHERE job_name = %s",
+            (job_name,)
+        )
+        if rowcount == 1:
+            self._return_slot()
+        return rowcount == 1
+
+    def expire(self):
+        """
+        Take back the slots of jobs admitted longer than the job timeout ago.
+
+        Returns:
+            list: Names of the jobs whose slots were taken back
+        """
+        rows, _ = self.store.execute(
+            "SELECT job_name FROM healthscribe_admission_running WHERE admitted_at < %s",
+            (self.clock() - self.job_timeout_seconds,)
+        )
+        expired = []
+        for job_name, in rows:
+            # release() frees the slot only for the invocation that deletes the row
+            if self.release(job_name):
+                expired.append(job_name)
+        if expired:
+            lambda_log.warning("Took back slots of jobs past the job timeout", jobNames=expired,
+                               jobTimeoutSeconds=self.job_timeout_seconds)
+        return expired
+
+    def _running_by_doctor(self):
+        rows, _ = self.store.execute(
+            "SELECT doctor_id, COUNT(*) FROM healthscribe_admission_running GROUP BY doctor_id"
+        )
+        return dict(rows)
+
+    def _pop_next(self):
+        while True:
+            backlog, _ = self.store.execute(
+                "SELECT job_name, priority, doctor_id, enqueued_at FROM healthscribe_admission_backlog"
+            )
+            entry = pick_next(backlog, self._running_by_doctor(), self.clock(), self.aging_seconds)
+            if entry is None:
+                return None
+            job_name = entry[0]
+            rows, _ = self.store.execute(
+                "SELECT request FROM healthscribe_admission_backlog WHERE job_name = %s",
+                (job_name,)
+            )
+            # Whoever deletes the row owns it; another drainer may have won
+            _, rowcount = self.store.execute(
+                "DELETE FROM healthscribe_admission_backlog WHERE job_name = %s",
+                (job_name,)
+            )
+            if rows and rowcount == 1:
+                return entry, json.loads(rows[0][0])
+
+    def drain(self, submit):
+        """
+        Submit queued jobs in scheduler order while slots are free, after
+        expiring the slots of jobs past the job timeout.
+
+        A submission rejected with one of REJECTED_ERROR_CODES, or of a job
+        that already holds a slot, is dropped from the backlog. Any other failure, e.g. throttling, puts the job
+        back with its original queue time and stops the drain.
+
+        Args:
+            submit (callable): Called with a queued StartMedicalScribeJob
+                request; should raise if the submission failed
+
+        Returns:
+            list: Names of the jobs submitted from the backlog
+        """
+        self.expire()
+        submitted = []
+        while self._reserve_slot():
+            entry = self._pop_next()
+            if entry is None:
+                self._return_slot()
+                break
+            (job_name, priority, doctor_id, enqueued_at), request = entry
+            if not self._mark_running(job_name, doctor_id):
+                # Job names are unique, so submitting it again would only be rejected as a conflict
+                lambda_log.warning("Queued job already holds a slot, dropping it", jobName=job_name)
+                lambda_log.count('dropped')
+                continue
+            try:
+                submit(request)
+            except Exception as e:
+                self.release(job_name)
+                if _error_code(e) in REJECTED_ERROR_CODES:
+                    lambda_log.error("Queued job rejected, dropping it", jobName=job_name, error=str(e))
+                    lambda_log.count('dropped')
+                    continue
+                lambda_log.warning("Submitting queued job failed, keeping it queued", jobName=job_name, error=str(e))
+                self.enqueue(job_name, request, priority, doctor_id, enqueued_at)
+                break
+            self.wait_times.setdefault(priority, []).append(self.clock() - enqueued_at)
+            lambda_metrics.put('QueueWait', self.clock() - enqueued_at, 'Seconds')
+            submitted.append(job_name)
+        return submitted
+
+    def metrics(self):
+        """
+        Current admission state.
+
+        Returns:
+            dict: Running jobs, quota, backlog depth, age of the oldest queued
+                job, and per priority class the backlog depth and the queue
+                wait times of the jobs drained by this instance
+        """
+        running_rows, _ = self.store.execute("SELECT running FROM healthscribe_admission_budget WHERE id = 1")
+        backlog_rows, _ = self.store.execute(
+            "SELECT priority, COUNT(*), MIN(enqueued_at) FROM healthscribe_admission_backlog GROUP BY priority"
+        )
+        depth_by_priority = {priority: count for priority, count, _ in backlog_rows}
+        oldest = min((enqueued_at for _, _, enqueued_at in backlog_rows), default=None)
+        return {
+            'running': running_rows[0][0] if running_rows else 0,
+            'quota': self.quota,
+            'queueDepth': sum(depth_by_priority.values()),
+            'queueDepthByPriority': {priority: depth_by_priority.get(priority, 0) for priority in PRIORITY_CLASSES},
+            'oldestQueuedSeconds': round(self.clock() - oldest, 3) if oldest is not None else 0,
+            'queueWaitSeconds': {
+                priority: [round(wait, 3) for wait in waits] for priority, waits in self.wait_times.items()
+            }
+        }
+
+    def report(self):
+        lambda_log.info("Admission metrics", **self.metrics())
+
+
+_controller = None
+
+
+def get_admission_controller(quota, aging_seconds=600, job_timeout_seconds=6 * 3600):
+    """
+    Return the admission controller for this container.
+
+    Args:
+        quota (int): Concurrent job quota; 0 disables admission control
+        aging_seconds (float): Queue wait after which a job moves up one
+            priority class
+        job_timeout_seconds (float): Age after which a job's slot is taken back
+
+    Returns:
+        AdmissionController: The controller, or None when admission control
+            is disabled or no store is configured
+    """
+    global _controller
+    store = get_store()
+    if store is None or quota <= 0:
+        return None
+    if _controller is None or _controller.store is not store:
+        _controller = AdmissionController(store, quota, aging_seconds, job_timeout_seconds)
+    _controller.quota = quota
+    _controller.aging_seconds = aging_seconds
+    _controller.job_timeout_seconds = job_timeout_seconds
+    return _controller
@@ -0,0 +1,410 @@
+"""
+Pre-flight probe for uploaded audio.
+
+Reads only the first few KB of an object with a ranged GET (plus the tail
+for containers that keep their duration at the end) and parses the container
+header to get duration, sample rate and channel count. Files that HealthScribe
+would reject anyway are caught here before a job is paid for, and the channel
+count decides how the job's channels are set up.
+
+Supported containers: WAV, FLAC, MP3, OGG (Vorbis/Opus) and MP4/M4A.
+"""
+import struct
+from collections import namedtuple
+
+from botocore.exceptions import ClientError
+
+
+# Bytes fetched from the start of the object
+PROBE_BYTES = 64 * 1024
+
+# Largest moov box we are willing to fetch for MP4 files
+MAX_MP4_MOOV_BYTES = 4 * 1024 * 1024
+
+AudioInfo = namedtuple('AudioInfo', ['format', 'duration_seconds', 'sample_rate', 'channels'])
+
+
+class ProbeError(ValueError):
+    """
+    Raised when the object is not a readable audio container.
+    """
+
+
+class RangeReader:
+    """
+    Reads byte ranges of an S3 object, keeping the first range in memory.
+
+    Args:
+        s3 (object): boto3 S3 client
+        bucket (str): Bucket of the object
+        key (str): Key of the object
+    """
+
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.requests = 0
+        try:
+            response = self._get(f"bytes=0-{PROBE_BYTES - 1}")
+        except ClientError as e:
+            # S3 refuses any range on an empty object
+            if e.response['Error']['Code'] != 'InvalidRange':
+                raise
+            self.head = b''
+            self.size = 0
+            return
+        self.head = response['Body'].read()
+        content_range = response.get('ContentRange')
+        if content_range and '/' in content_range:
+            self.size = int(content_range.rsplit('/', 1)[1])
+        else:
+            self.size = response.get('ContentLength', len(self.head))
+
+    def _get(self, byte_range):
+        self.requests += 1
+        return self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=byte_range)
+
+    def read(self, offset, length):
+        """
+        Return up to `length` bytes starting at `offset`.
+        """
+        if offset + length <= len(self.head):
+            return self.head[offset:offset + length]
+        if offset >= self.size:
+            return b''
+        end = min(offset + length, self.size) - 1
+        return self._get(f"bytes={offset}-{end}")['Body'].read()
+
+
+class BytesReader:
+    """
+    RangeReader equivalent over bytes already in memory.
+    """
+
+    def __init__(self, data):
+        self.head = data[:PROBE_BYTES]
+        self.data = data
+        self.size = len(data)
+        self.requests = 0
+
+    def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+
+def probe(reader):
+    """
+    Identify the container and read its audio properties.
+
+    Args:
+        reader (RangeReader): Reader over the object
+
+    Returns:
+        AudioInfo: Format, duration (None if unknown), sample rate and channels
+
+    Raises:
+        ProbeError: If the header is missing, unknown or corrupt
+    """
+    head = reader.head
+    if len(head) < 12:
+        raise ProbeError("File is too small to be audio")
+
+    try:
+        if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+            return _probe_wav(reader)
+        if head[:4] == b'fLaC':
+            return _probe_flac(reader)
+        if head[:4] == b'OggS':
+            return _probe_ogg(reader)
+        if head[4:8] == b'ftyp':
+            return _probe_mp4(reader)
+        if head[:3] == b'ID3' or (head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+            return _probe_mp3(reader)
+    except (struct.error, IndexError) as e:
+        raise ProbeError(f"Corrupt audio header: {str(e)}")
+
+    raise ProbeError("Unrecognised audio container")
+
+
+def probe_object(s3, bucket, key):
+    """
+    Probe an S3 object with ranged reads.
+
+    Returns:
+        tuple: (AudioInfo, number of GET requests made)
+    """
+    reader = RangeReader(s3, bucket, key)
+    return probe(reader), reader.requests
+
+
+def _probe_wav(reader):
+    offset = 12
+    fmt = None
+    while offset + 8 <= reader.size:
+        chunk_header = reader.read(offset, 8)
+        if len(chunk_header) < 8:
+            break
+        chunk_id, chunk_size = chunk_header[:4], struct.unpack('<I', chunk_header[4:8])[0]
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', reader.read(offset + 8, 16))
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ProbeError("WAV data chunk before fmt chunk")
+            _, channels, sample_rate, byte_rate, _, _ = fmt
+            if byte_rate == 0:
+                raise ProbeError("WAV header has a zero byte rate")
+            data_size = chunk_size
+            if data_size in (0, 0xFFFFFFFF) or offset + 8 + data_size > reader.size:
+                # Streamed or truncated file: trust the object size instead
+                data_size = reader.size - offset - 8
+            return AudioInfo('wav', data_size / byte_rate, sample_rate, channels)
+        # Chunks are padded to an even size
+        offset += 8 + chunk_size + (chunk_size & 1)
+    raise ProbeError("WAV file has no data chunk")
+
+
+def _probe_flac(reader):
+    header = reader.read(4, 4)
+    if header[0] & 0x7F != 0:
+        raise ProbeError("FLAC file does not start with STREAMINFO")
+    info = reader.read(8, 34)
+    sample_rate = (info[10] << 12) | (info[11] << 4) | (info[12] >> 4)
+    channels = ((info[12] >> 1) & 0x07) + 1
+    total_samples = ((info[13] & 0x0F) << 32) | struct.unpack('>I', info[14:18])[0]
+    if sample_rate == 0:
+        raise ProbeError("FLAC STREAMINFO has a zero sample rate")
+    duration = total_samples / sample_rate if total_samples else None
+    return AudioInfo('flac', duration, sample_rate, channels)
+
+
+# MPEG audio lookup tables, indexed by version bits / layer bits
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+_MP3_BITRATES_V1_L3 = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+_MP3_BITRATES_V2_L3 = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+
+
+def _probe_mp3(reader):
+    offset = 0
+    header = reader.read(0, 10)
+    if header[:3] == b'ID3':
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        offset = 10 + size + (10 if header[5] & 0x10 else 0)
+
+    # Find the first frame sync after the tag
+    window = reader.read(offset, 4096)
+    position = 0
+    while position + 4 <= len(window):
+        if window[position] == 0xFF and window[position + 1] & 0xE0 == 0xE0:
+            break
+        position += 1
+    else:
+        raise ProbeError("No MPEG audio frame found")
+    frame_offset = offset + position
+    frame = reader.read(frame_offset, 200)
+
+    version = (frame[1] >> 3) & 0x03
+    layer = (frame[1] >> 1) & 0x03
+    bitrate_index = frame[2] >> 4
+    sample_rate_index = (frame[2] >> 2) & 0x03
+    channel_mode = frame[3] >> 6
+    if version == 1 or sample_rate_index == 3 or bitrate_index in (0, 15):
+        raise ProbeError("Invalid MPEG audio frame header")
+    if layer != 1:
+        raise ProbeError("Only MPEG layer III audio is supported")
+
+    sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+    channels = 1 if channel_mode == 3 else 2
+    samples_per_frame = 1152 if version == 3 else 576
+
+    # VBR files carry a frame count in a Xing/Info header after side info
+    if version == 3:
+        side_info = 17 if channels == 1 else 32
+    else:
+        side_info = 9 if channels == 1 else 17
+    xing = frame[4 + side_info:4 + side_info + 12]
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 0x01:
+        frames = struct.unpack('>I', xing[8:12])[0]
+        return AudioInfo('mp3', frames * samples_per_frame / sample_rate, sample_rate, channels)
+
+    bitrates = _MP3_BITRATES_V1_L3 if version == 3 else _MP3_BITRATES_V2_L3
+    bitrate = bitrates[bitrate_index] * 1000
+    duration = (reader.size - frame_offset) * 8 / bitrate
+    return AudioInfo('mp3', duration, sample_rate, channels)
+
+
+def _probe_ogg(reader):
+    head = reader.head
+    segment_count = head[26]
+    packet = head[27 + segment_count:]
+    if packet[:7] == b'\x01vorbis':
+        channels = packet[11]
+        sample_rate = struct.unpack('<I', packet[12:16])[0]
+        codec, pre_skip, granule_rate = 'vorbis', 0, sample_rate
+    elif packet[:8] == b'OpusHead':
+        channels = packet[9]
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+        sample_rate = struct.unpack('<I', packet[12:16])[0] or 48000
+        # Opus granule positions always count 48 kHz samples
+        codec, granule_rate = 'opus', 48000
+    else:
+        raise ProbeError("Unsupported OGG codec")
+    if granule_rate == 0:
+        raise ProbeError("OGG header has a zero sample rate")
+
+    # The last page's granule position is the stream length in samples
+    tail_start = max(0, reader.size - PROBE_BYTES)
+    tail = reader.read(tail_start, reader.size - tail_start)
+    last_page = tail.rfind(b'OggS')
+    duration = None
+    if last_page != -1 and last_page + 14 <= len(tail):
+        granule = struct.unpack('<q', tail[last_page + 6:last_page + 14])[0]
+        if granule > 0:
+            duration = max(0, granule - pre_skip) / granule_rate
+    return AudioInfo(f'ogg/{codec}', duration, sample_rate, channels)
+
+
+_MP4_CONTAINERS = (b'trak', b'mdia', b'minf', b'stbl')
+_MP4_AUDIO_ENTRIES = (b'mp4a', b'alac', b'Opus', b'fLaC', b'ac-3', b'ec-3')
+
+
+def _mp4_boxes(data, start=0, end=None):
+    """
+    Yield (type, payload start, box end) for the boxes in data[start:end].
+    """
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ProbeError("Corrupt MP4 box size")
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _probe_mp4(reader):
+    # Walk top-level box headers until moov, which may sit after mdat
+    offset = 0
+    moov = None
+    while offset + 8 <= reader.size:
+        header = reader.read(offset, 16)
+        size, box_type = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = reader.size - offset
+        if size < header_size:
+            raise ProbeError("Corrupt MP4 box size")
+        if box_type == b'moov':
+            if size > MAX_MP4_MOOV_BYTES:
+                raise ProbeError("MP4 moov box is too large to probe")
+            moov = reader.read(offset + header_size, size - header_size)
+            break
+        offset += size
+    if moov is None:
+        raise ProbeError("MP4 file has no moov box")
+
+    duration = None
+    sample_rate = None
+    channels = None
+    for box_type, start, end in _mp4_boxes(moov):
+        if box_type == b'mvhd':
+            if moov[start] == 1:
+                timescale, length = struct.unpack('>IQ', moov[start + 20:start + 32])
+            else:
+                timescale, length = struct.unpack('>II', moov[start + 12:start + 20])
+            if timescale:
+                duration = length / timescale
+        elif box_type == b'trak' and channels is None:
+            entry = _mp4_audio_entry(moov, start, end)
+            if entry is not None:
+                channels, sample_rate = entry
+
+    if channels is None:
+        raise ProbeError("MP4 file has no audio track")
+    return AudioInfo('mp4', duration, sample_rate, channels)
+
+
+def _mp4_audio_entry(data, start, end):
+    """
+    Find the first audio sample entry under a trak box.
+
+    Returns:
+        tuple: (channels, sample rate), or None if the track is not audio
+    """
+    for box_type, child_start, child_end in _mp4_boxes(data, start, end):
+        if box_type in _MP4_CONTAINERS:
+            entry = _mp4_audio_entry(data, child_start, child_end)
+            if entry is not None:
+                return entry
+        elif box_type == b'stsd':
+            # Skip version/flags and entry count
+            for entry_type, entry_start, _ in _mp4_boxes(data, child_start + 8, child_end):
+                if entry_type in _MP4_AUDIO_ENTRIES:
+                    channels = struct.unpack('>H', data[entry_start + 16:entry_start + 18])[0]
+                    sample_rate = struct.unpack('>I', data[entry_start + 24:entry_start + 28])[0] >> 16
+                    return channels, sample_rate
+    return None
+
+
+def check_audio(info, min_duration, min_sample_rate):
+    """
+    Decide whether a probed file is worth a HealthScribe job.
+
+    Args:
+        info (AudioInfo): Probe result
+        min_duration (float): Shortest accepted recording in seconds
+        min_sample_rate (int): Lowest accepted sample rate in Hz
+
+    Returns:
+        str: Rejection reason, or None if the file is acceptable
+    """
+    if info.channels not in (1, 2):
+        return f"Unsupported channel count: {info.channels}"
+    if info.sample_rate is not None and info.sample_rate < min_sample_rate:
+        return f"Sample rate {info.sample_rate} Hz is below {min_sample_rate} Hz"
+    if info.duration_seconds is not None and info.duration_seconds < min_duration:
+        return f"Recording is only {info.duration_seconds:.1f} s long"
+    return None
+
+
+def channel_settings(info):
+    """
+    HealthScribe Settings and ChannelDefinitions for a probed file.
+
+    Stereo recordings keep the clinician/patient channel layout; mono ones
+    fall back to speaker partitioning.
+
+    Args:
+        info (AudioInfo): Probe result, or None if the file was not probed
+
+    Returns:
+        tuple: (Settings dict, ChannelDefinitions list or None)
+    """
+    if info is not None and info.channels == 1:
+        return {
+            'ShowSpeakerLabels': True,
+            'MaxSpeakerLabels': 2,
+            'ChannelIdentification': False
+        }, None
+
+    return {
+        'ShowSpeakerLabels': False,
+        'ChannelIdentification': True
+    }, [
+        {
+            'ChannelId': 0,
+            'ParticipantRole': 'CLINICIAN'
+        },
+        {
+            'ChannelId': 1,
+            'ParticipantRole': 'PATIENT'
+        }
+    ]
@@ -0,0 +1,405 @@
+"""
+Resubmit recordings to HealthScribe after an outage.
+
+Replays S3 audio keys through the same submission path as the input Lambda
+(process_record and start_healthscribe_job), so pre-flight checks, the
+idempotency ledger, priority scheduling and admission control all apply.
+Keys come from a key list or a bucket/prefix listing. They are submitted on
+a bounded thread pool behind a rate limiter, and throttled submissions are
+retried with backoff.
+
+Recordings already in the idempotency ledger, e.g. those whose job FAILED
+during the outage, are skipped as duplicates unless --resubmit is passed.
+Resubmission drops the key's ledger claim and deletes its FAILED job, so the
+job is started again under the same name (the visit's uniqueID); keys whose
+job exists and did not fail are still skipped. Deleting jobs needs
+transcribe:DeleteMedicalScribeJob on top of the input Lambda's permissions.
+
+Every key's outcome is appended to a progress file. A rerun with the same
+progress file skips the keys already submitted, skipped or rejected and
+retries only those that failed; with --resubmit the skipped keys are retried
+too. Skipped, rejected and failed keys are also written to a separate file
+with the reason, and a throughput report is printed when the run ends.
+
+Usage (from infrastructure/input_lambda, with the input Lambda's settings
+such as OUTPUT_BUCKET_NAME and HEALTHSCRIBE_ROLE_ARN in the environment):
+    python backfill.py --bucket medisync-input --prefix 2025-04-15 --rate 10
+    python backfill.py --keys keys.txt --bucket medisync-input --progress run.jsonl
+    python backfill.py --keys failed.txt --bucket medisync-input --resubmit
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# lambda_log and lambda_metrics are deployed in the shared layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'shared_layer', 'python'))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+import clients  # noqa: E402
+import lambda_function  # noqa: E402
+import lambda_metrics  # noqa: E402
+from ledger import get_ledger  # noqa: E402
+from poller import THROTTLING_ERROR_CODES  # noqa: E402
+
+# Outcomes that finish a key; failed keys are retried by the next run
+DONE_OUTCOMES = ['submitted', 'queued', 'skipped', 'rejected']
+
+# With --resubmit, keys skipped by an earlier run, e.g. as duplicates, are retried too
+RESUBMIT_DONE_OUTCOMES = ['submitted', 'queued', 'rejected']
+
+# StartMedicalScribeJob error for a job name that is already taken
+CONFLICT_ERROR_CODE = 'ConflictException'
+
+# GetMedicalScribeJob error for a job name that is not taken
+NOT_FOUND_ERROR_CODE = 'BadRequestException'
+
+
+class RateLimiter:
+    """
+    Token bucket spacing out calls across threads.
+
+    Args:
+        rate (float): Calls per second; 0 or None for no limit
+        burst (int): Calls that may go out back to back
+        clock (callable): Monotonic clock in seconds
+        sleep (callable): Sleep function
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(self.burst)
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a call may go out.
+        """
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class ProgressFile:
+    """
+    Append-only JSON lines record of the outcome of every key.
+
+    Args:
+        path (str): Progress file; created if missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def done(self, outcomes=DONE_OUTCOMES):
+        """
+        Keys finished by earlier runs.
+
+        Returns:
+            set: (bucket, key) pairs whose last outcome is in `outcomes`
+        """
+        last = {}
+        if not self.path or not os.path.exists(self.path):
+            return set()
+        with open(self.path) as progress:
+            for line in progress:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Line cut short by an interrupted run
+                    continue
+                last[(entry['bucket'], entry['key'])] = entry['outcome']
+        return {item for item, outcome in last.items() if outcome in outcomes}
+
+    def record(self, entry):
+        if not self.path:
+            return
+        with self.lock, open(self.path, 'a') as progress:
+            progress.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+
+def listed_objects(s3, bucket, prefix=''):
+    """
+    Yield (bucket, key, etag) for every object under a prefix.
+    """
+    request = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        response = s3.list_objects_v2(**request)
+        for item in response.get('Contents', []):
+            yield bucket, item['Key'], item.get('ETag', '')
+        if not response.get('IsTruncated'):
+            return
+        request['ContinuationToken'] = response['NextContinuationToken']
+
+
+def listed_keys(path, default_bucket=None):
+    """
+    Yield (bucket, key, etag) for the keys of a key list.
+
+    Lines are either s3://bucket/key URIs or keys of `default_bucket`; blank
+    lines and lines starting with # are ignored. The ETag is looked up when
+    the key is submitted.
+    """
+    with open(path) as keys:
+        for line in keys:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('s3://'):
+                bucket, _, key = line[len('s3://'):].partition('/')
+            elif default_bucket:
+                bucket, key = default_bucket, line
+            else:
+                raise ValueError(f"Key {line!r} has no bucket; pass --bucket or use s3:// URIs")
+            yield bucket, key, None
+
+
+def s3_record(bucket, key, etag):
+    """
+    S3 event record for an existing object, shaped like a notification.
+    """
+    return {
+        'eventSource': 'aws:s3',
+        'eventName': 'ObjectCreated:Backfill',
+        's3': {
+            'bucket': {'name': bucket},
+            'object': {'key': key, 'eTag': etag.strip('"')}
+        }
+    }
+
+
+def outcome_of(result):
+    """
+    Outcome name and reason for a process_record result.
+    """
+    if result is None:
+        return 'skipped', 'Not a submittable audio file'
+    if 'skipped' in result:
+        return 'skipped', result['skipped']
+    if 'rejected' in result:
+        return 'rejected', result['rejected']
+    if result.get('jobStatus') == 'QUEUED':
+        return 'queued', None
+    return 'submitted', None
+
+
+def job_status(healthscribe, job_name):
+    """
+    Status of the HealthScribe job with the given name, or None if there is none.
+    """
+    try:
+        job = healthscribe.get_medical_scribe_job(MedicalScribeJobName=job_name)['MedicalScribeJob']
+    except ClientError as e:
+        if e.response['Error']['Code'] == NOT_FOUND_ERROR_CODE:
+            return None
+        raise
+    return job['MedicalScribeJobStatus']
+
+
+def prepare_resubmission(bucket, key, etag):
+    """
+    Clear the way for submitting a key again: drop its ledger claim and
+    delete its job if that FAILED.
+
+    Returns:
+        str: Reason to skip the key instead, when its job exists and did not
+            fail; None when the key can be submitted
+    """
+    healthscribe = clients.get_client('transcribe')
+    job_name = lambda_function.output_prefix_for_key(key).strip('-')
+    status = job_status(healthscribe, job_name)
+    if status is not None and status != 'FAILED':
+        return f"Job already exists ({status})"
+    if status == 'FAILED':
+        healthscribe.delete_medical_scribe_job(MedicalScribeJobName=job_name)
+    ledger = get_ledger(clients.get_settings()['ledger_claim_timeout_seconds'])
+    if ledger is not None:
+        ledger.release(bucket, key, etag.strip('"'))
+    return None
+
+
+def conflict_outcome(key):
+    """
+    Outcome for a key whose job name is taken. A FAILED job is not a reason
+    to skip the key: it fails, and a rerun with --resubmit replaces the job.
+    """
+    job_name = lambda_function.output_prefix_for_key(key).strip('-')
+    status = job_status(clients.get_client('transcribe'), job_name)
+    if status == 'FAILED':
+        return 'failed', f"Job {job_name} already exists and FAILED; rerun with --resubmit"
+    return 'skipped', f"Job already exists ({status})" if status else 'Job already exists'
+
+
+def submit_key(bucket, key, etag, output_bucket, limiter, max_attempts=5, sleep=time.sleep, resubmit=False):
+    """
+    Submit one key, retrying throttled submissions with backoff.
+
+    Args:
+        resubmit (bool): Submit the key again even if the ledger has it,
+            replacing its job if that FAILED
+
+    Returns:
+        dict: Progress entry with bucket, key, outcome and reason or jobName
+    """
+    entry = {'bucket': bucket, 'key': key}
+    attempt = 0
+    prepared = False
+    while True:
+        attempt += 1
+        try:
+            if etag is None:
+                etag = clients.get_client('s3').head_object(Bucket=bucket, Key=key).get('ETag', '')
+            if resubmit and not prepared:
+                reason = prepare_resubmission(bucket, key, etag)
+                if reason:
+                    entry.update(outcome='skipped', reason=reason)
+                    return entry
+                prepared = True
+            limiter.acquire()
+            result = lambda_function.process_record(s3_record(bucket, key, etag), output_bucket,
+                                                    clients.get_client('transcribe'))
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code == CONFLICT_ERROR_CODE:
+                entry['outcome'], entry['reason'] = conflict_outcome(key)
+                return entry
+            if code in THROTTLING_ERROR_CODES and attempt < max_attempts:
+                sleep(min(30.0, 2 ** attempt) * (0.5 + random.random() / 2))
+                continue
+            entry.update(outcome='failed', reason=str(e))
+            return entry
+        except Exception as e:
+            entry.update(outcome='failed', reason=str(e))
+            return entry
+        entry['outcome'], reason = outcome_of(result)
+        if reason:
+            entry['reason'] = reason
+        elif result:
+            entry['jobName'] = result['jobName']
+        return entry
+
+
+def backfill(objects, output_bucket, workers=8, rate=10.0, progress_path=None, failures_path=None,
+             report_every=100, resubmit=False):
+    """
+    Submit every listed object not finished by an earlier run.
+
+    Args:
+        objects (iterable): (bucket, key, etag or None) triples
+        output_bucket (str): S3 bucket where output should be stored
+        workers (int): Concurrent submissions
+        rate (float): Submissions per second across all workers; 0 for no limit
+        progress_path (str): Progress file to resume from and append to
+        failures_path (str): File receiving skipped, rejected and failed keys
+        report_every (int): Keys between progress lines on stderr
+        resubmit (bool): Submit keys again even if the ledger has them,
+            replacing their FAILED jobs
+
+    Returns:
+        dict: Counts by outcome, elapsed seconds and throughput
+    """
+    progress = ProgressFile(progress_path)
+    done = progress.done(RESUBMIT_DONE_OUTCOMES if resubmit else DONE_OUTCOMES)
+    limiter = RateLimiter(rate, burst=workers)
+    counts = {'resumed': 0}
+    counts_lock = threading.Lock()
+    failures = open(failures_path, 'a') if failures_path else None
+    started = time.monotonic()
+
+    def finish(entry):
+        progress.record(entry)
+        with counts_lock:
+            counts[entry['outcome']] = counts.get(entry['outcome'], 0) + 1
+            finished = sum(counts.values()) - counts['resumed']
+            if entry['outcome'] not in ('submitted', 'queued') and failures is not None:
+                failures.write(f"s3://{entry['bucket']}/{entry['key']}\t{entry['outcome']}\t{entry.get('reason', '')}\n")
+                failures.flush()
+        if report_every and finished % report_every == 0:
+            elapsed = time.monotonic() - started
+            print(f"{finished} keys in {elapsed:.0f} s ({finished / elapsed:.1f}/s)", file=sys.stderr)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of keys in flight, so long listings are not read up front
+            in_flight = set()
+            for bucket, key, etag in objects:
+                if (bucket, key) in done:
+                    counts['resumed'] += 1
+                    continue
+                if len(in_flight) >= workers * 4:
+                    _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                future = executor.submit(submit_key, bucket, key, etag, output_bucket, limiter,
+                                         resubmit=resubmit)
+                future.add_done_callback(lambda f: finish(f.result()))
+                in_flight.add(future)
+    finally:
+        if failures is not None:
+            failures.close()
+        lambda_metrics.flush('backfill')
+
+    elapsed = time.monotonic() - started
+    submitted = counts.get('submitted', 0) + counts.get('queued', 0)
+    return {
+        'outcomes': counts,
+        'elapsedSeconds': round(elapsed, 1),
+        'submissionsPerSecond': round(submitted / elapsed, 2) if elapsed else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--keys', help='File of keys or s3:// URIs to submit, one per line')
+    parser.add_argument('--bucket', help='Bucket to list, or of the keys in --keys')
+    parser.add_argument('--prefix', default='', help='Key prefix to list')
+    parser.add_argument('--output-bucket', help='Defaults to OUTPUT_BUCKET_NAME')
+    parser.add_argument('--workers', type=int, default=None, help='Defaults to MAX_CONCURRENT_SUBMISSIONS')
+    parser.add_argument('--rate', type=float, default=10.0, help='Submissions per second (0 for no limit)')
+    parser.add_argument('--progress', default='backfill-progress.jsonl', help='Resumable progress file')
+    parser.add_argument('--failures', default='backfill-failures.tsv', help='Skipped, rejected and failed keys')
+    parser.add_argument('--resubmit', action='store_true',
+                        help='Submit keys the ledger already has again, deleting their FAILED jobs')
+    args = parser.parse_args(argv)
+    if not args.keys and not args.bucket:
+        parser.error('pass --keys or --bucket')
+    # The run reports its own numbers; EMF records are only wanted when asked for
+    os.environ.setdefault('METRICS_SINK', 'off')
+
+    settings = clients.get_settings()
+    output_bucket = args.output_bucket or settings['output_bucket']
+    if not output_bucket:
+        parser.error('pass --output-bucket or set OUTPUT_BUCKET_NAME')
+    workers = args.workers or settings['max_concurrent_submissions']
+
+    if args.keys:
+        objects = listed_keys(args.keys, args.bucket)
+    else:
+        objects = listed_objects(clients.get_client('s3'), args.bucket, args.prefix)
+
+    report = backfill(objects, output_bucket, workers, args.rate, args.progress, args.failures,
+                      resubmit=args.resubmit)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Synthetic audio fixture corpus for the pre-flight probe.
+
+Each fixture is generated in memory with a valid container header and
+silent payload, so the corpus needs no binary files in the repository.
+CORPUS maps a fixture name to (bytes builder, expected outcome), where the
+outcome is either the expected channel count or the string 'reject'.
+"""
+import struct
+
+
+def wav(seconds=30, sample_rate=16000, channels=2, bits=16):
+    block_align = channels * bits // 8
+    data = bytes(int(seconds * sample_rate) * block_align)
+    fmt = struct.pack('<HHIIHH', 1, channels, sample_rate, sample_rate * block_align, block_align, bits)
+    return (
+        b'RIFF' + struct.pack('<I', 4 + 8 + len(fmt) + 8 + len(data)) + b'WAVE'
+        + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+        + b'data' + struct.pack('<I', len(data)) + data
+    )
+
+
+def flac(seconds=30, sample_rate=44100, channels=2, bits=16):
+    total_samples = int(seconds * sample_rate)
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits - 1) << 36) | total_samples
+    streaminfo = (
+        struct.pack('>HH', 4096, 4096) + (0).to_bytes(3, 'big') + (0).to_bytes(3, 'big')
+        + packed.to_bytes(8, 'big') + bytes(16)
+    )
+    # Last metadata block, type 0 (STREAMINFO), then dummy frame data
+    return b'fLaC' + bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo + bytes(4096)
+
+
+def mp3_cbr(seconds=30, channels=2):
+    # MPEG-1 layer III, 128 kbit/s, 44.1 kHz
+    channel_mode = 0x00 if channels == 2 else 0xC0
+    header = bytes([0xFF, 0xFB, 0x90, channel_mode | 0x04])
+    frame = header + bytes(417 - 4)
+    frames = int(seconds * 44100 / 1152)
+    tag = b'ID3' + bytes([3, 0, 0]) + bytes([0, 0, 0, 100]) + bytes(100)
+    return tag + frame * frames
+
+
+def mp3_vbr(seconds=30):
+    header = bytes([0xFF, 0xFB, 0x90, 0x04])
+    frames = int(seconds * 44100 / 1152)
+    xing = b'Xing' + struct.pack('>II', 0x01, frames)
+    first_frame = header + bytes(32) + xing + bytes(417 - 4 - 32 - len(xing))
+    # Padding frames of varying content stand in for VBR audio
+    return first_frame + (header + bytes(200)) * 50
+
+
+def _ogg_page(packet, granule, header_type=0, sequence=0):
+    segments = []
+    remaining = len(packet)
+    while remaining >= 255:
+        segments.append(255)
+        remaining -= 255
+    segments.append(remaining)
+    return (
+        b'OggS' + bytes([0, header_type]) + struct.pack('<qIII', granule, 1, sequence, 0)
+        + bytes([len(segments)]) + bytes(segments) + packet
+    )
+
+
+def ogg_vorbis(seconds=30, sample_rate=44100, channels=2):
+    ident = b'\x01vorbis' + struct.pack('<IBIiii', 0, channels, sample_rate, 0, 128000, 0) + bytes([0xB8, 0x01])
+    body = _ogg_page(b'\x00' * 4000, sample_rate * seconds // 2, sequence=1)
+    last = _ogg_page(b'\x00' * 4000, sample_rate * seconds, header_type=4, sequence=2)
+    return _ogg_page(ident, 0, header_type=2) + body + last
+
+
+def ogg_opus(seconds=30, channels=1):
+    pre_skip = 312
+    head = b'OpusHead' + struct.pack('<BBHIhB', 1, channels, pre_skip, 16000, 0, 0)
+    last = _ogg_page(b'\x00' * 2000, 48000 * seconds + pre_skip, header_type=4, sequence=1)
+    return _ogg_page(head, 0, header_type=2) + last
+
+
+def _box(box_type, payload):
+    return struct.pack('>I', 8 + len(payload)) + box_type + payload
+
+
+def m4a(seconds=30, sample_rate=44100, channels=2, moov_at_end=True):
+    ftyp = _box(b'ftyp', b'M4A ' + struct.pack('>I', 0) + b'M4A mp42isom')
+    mvhd = _box(b'mvhd', struct.pack('>IIIII', 0, 0, 0, 1000, seconds * 1000) + bytes(80))
+    mp4a = _box(b'mp4a', bytes(6) + struct.pack('>H', 1) + bytes(8)
+                + struct.pack('>HHHHI', channels, 16, 0, 0, sample_rate << 16))
+    stsd = _box(b'stsd', struct.pack('>II', 0, 1) + mp4a)
+    trak = _box(b'trak', _box(b'mdia', _box(b'minf', _box(b'stbl', stsd))))
+    moov = _box(b'moov', mvhd + trak)
+    mdat = _box(b'mdat', bytes(200 * 1024))
+    if moov_at_end:
+        return ftyp + mdat + moov
+    return ftyp + moov + mdat
+
+
+def corrupt():
+    return b'RIFF' + bytes(60) + b'\xde\xad\xbe\xef' * 64
+
+
+def wav_without_data():
+    fmt = struct.pack('<HHIIHH', 1, 2, 16000, 64000, 4, 16)
+    return b'RIFF' + struct.pack('<I', 4 + 8 + len(fmt)) + b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+
+
+CORPUS = {
+    'wav_stereo_16k': (lambda: wav(), 2),
+    'wav_mono_44k': (lambda: wav(sample_rate=44100, channels=1), 1),
+    'wav_too_short': (lambda: wav(seconds=2), 'reject'),
+    'wav_8k_telephony': (lambda: wav(sample_rate=8000), 'reject'),
+    'wav_six_channels': (lambda: wav(seconds=10, channels=6), 'reject'),
+    'wav_without_data': (wav_without_data, 'reject'),
+    'flac_stereo': (lambda: flac(), 2),
+    'mp3_cbr_stereo': (lambda: mp3_cbr(), 2),
+    'mp3_cbr_mono': (lambda: mp3_cbr(channels=1), 1),
+    'mp3_vbr_xing': (lambda: mp3_vbr(), 2),
+    'ogg_vorbis_stereo': (lambda: ogg_vorbis(), 2),
+    'ogg_opus_mono': (lambda: ogg_opus(), 1),
+    'm4a_moov_at_end': (lambda: m4a(), 2),
+    'm4a_moov_first': (lambda: m4a(moov_at_end=False, channels=1), 1),
+    'corrupt': (corrupt, 'reject'),
+    'empty': (lambda: b'', 'reject'),
+}
@@ -0,0 +1,50 @@
+"""
+Benchmark for the audio pre-flight probe.
+
+Probes every fixture of the synthetic corpus through FakeS3Client, checks the
+outcome against the corpus expectation and reports the time per probe and the
+number of ranged GETs it needed.
+
+Usage (from infrastructure/input_lambda):
+    python benchmarks/bench_audio_probe.py [iterations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_probe import ProbeError, check_audio, probe_object  # noqa: E402
+from benchmarks.audio_fixtures import CORPUS  # noqa: E402
+from fakes import FakeS3Client  # noqa: E402
+
+
+def run(iterations=200):
+    s3 = FakeS3Client()
+    for name, (build, _) in CORPUS.items():
+        s3.put_object(Bucket='fixtures', Key=name, Body=build())
+
+    mismatches = 0
+    print(f"{'fixture':<20} {'outcome':<48} {'GETs':>4} {'ms/probe':>9}")
+    for name, (_, expected) in CORPUS.items():
+        started = time.perf_counter()
+        for _ in range(iterations):
+            try:
+                info, requests = probe_object(s3, 'fixtures', name)
+                rejection = check_audio(info, min_duration=5, min_sample_rate=16000)
+            except ProbeError as e:
+                info, requests, rejection = None, 1, str(e)
+        elapsed_ms = (time.perf_counter() - started) * 1000 / iterations
+
+        outcome = 'reject' if rejection else info.channels
+        if outcome != expected:
+            mismatches += 1
+        summary = rejection or f"{info.format} {info.sample_rate} Hz x{info.channels} {info.duration_seconds:.1f} s"
+        flag = '' if outcome == expected else '  <-- expected ' + str(expected)
+        print(f"{name:<20} {summary[:48]:<48} {requests:>4} {elapsed_ms:>9.3f}{flag}")
+
+    return mismatches
+
+
+if __name__ == '__main__':
+    sys.exit(1 if run(int(sys.argv[1]) if len(sys.argv) > 1 else 200) else 0)
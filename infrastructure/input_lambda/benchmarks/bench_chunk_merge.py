@@ -0,0 +1,85 @@
+"""
+Offline round trip for chunked jobs using the demo HealthScribe outputs.
+
+The demo transcript is cut into overlapping chunk outputs the way chunk jobs
+would return them (times relative to the chunk start), merged back with
+chunking.merge_transcripts/merge_summaries, and compared with the original.
+
+Usage (from infrastructure/input_lambda):
+    python benchmarks/bench_chunk_merge.py [chunk seconds] [overlap seconds]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# transcript_stream and transcript_columns are deployed in the shared layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'shared_layer', 'python'))
+
+import chunking  # noqa: E402
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'demo response')
+
+
+def chunk_output(conversation, chunk):
+    """
+    What a chunk job would have produced for the chunk's slice of audio.
+    """
+    length = chunk['end'] - chunk['start']
+    segments = chunking.rebase_items(conversation['TranscriptSegments'], -chunk['start'], 0, length)
+    items = chunking.rebase_items(conversation['TranscriptItems'], -chunk['start'], 0, length)
+    segment_ids = {segment['SegmentId'] for segment in segments}
+    insights = [
+        insight for insight in conversation['ClinicalInsights']
+        if any(span['SegmentId'] in segment_ids for span in insight['Spans'])
+    ]
+    return {'Conversation': dict(conversation, TranscriptSegments=segments,
+                                 TranscriptItems=items, ClinicalInsights=insights)}
+
+
+def run(chunk_seconds=60.0, overlap_seconds=5.0):
+    with open(os.path.join(DEMO_DIR, 'transcript.json')) as transcript_file:
+        transcript = json.load(transcript_file)
+    with open(os.path.join(DEMO_DIR, 'summary.json')) as summary_file:
+        summary = json.load(summary_file)
+    conversation = transcript['Conversation']
+
+    window_seconds = 0.1
+    duration = conversation['TranscriptItems'][-1]['EndAudioTime'] + 1
+    # Flat energy: cuts land on the targets
+    chunks = chunking.plan_chunks([1.0] * int(duration / window_seconds), window_seconds,
+                                  chunk_seconds, overlap_seconds)
+    parts = [(chunk, chunk_output(conversation, chunk)) for chunk in chunks]
+
+    started = time.perf_counter()
+    merged = chunking.merge_transcripts(parts, conversation['JobName'])
+    merged_summary = chunking.merge_summaries([summary] * len(chunks), merged)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    merged_conversation = merged['Conversation']
+    problems = []
+    for field in ('TranscriptSegments', 'TranscriptItems'):
+        original = [(entry['BeginAudioTime'], entry['EndAudioTime']) for entry in conversation[field]]
+        # Merged items are ItemColumns
+        entries = merged_conversation[field]
+        rebuilt = [(entry['BeginAudioTime'], entry['EndAudioTime'])
+                   for entry in (entries.dicts() if field == 'TranscriptItems' else entries)]
+        if original != rebuilt:
+            problems.append(f"{field}: {len(rebuilt)} entries rebuilt from {len(original)}")
+    if len(merged_conversation['ClinicalInsights']) != len(conversation['ClinicalInsights']):
+        problems.append("ClinicalInsights count differs")
+
+    print(f"{len(chunks)} chunks of {chunk_seconds:.0f} s (+{overlap_seconds:.0f} s overlap) over {duration:.0f} s")
+    print(f"merged {len(merged_conversation['TranscriptSegments'])} segments, "
+          f"{len(merged_conversation['TranscriptItems'])} items, "
+          f"{len(merged_summary['ClinicalDocumentation']['Sections'])} summary sections in {elapsed_ms:.1f} ms")
+    for problem in problems:
+        print("MISMATCH", problem)
+    return len(problems)
+
+
+if __name__ == '__main__':
+    arguments = [float(argument) for argument in sys.argv[1:3]]
+    sys.exit(1 if run(*arguments) else 0)
@@ -0,0 +1,123 @@
+"""
+Simulation of a peak hour of uploads against the concurrent job quota.
+
+Visits arrive at random from a handful of doctors, one of whom uploads a
+large batch at once. Every job runs for a time proportional to its
+recording. Submissions go through the real AdmissionController, backed by an
+in-memory SQLite store and driven by a simulated clock, once with the
+priority scheduler and once with every job in the same class and for the
+same doctor, which is first-come-first-served. The p95 time-to-summary
+(upload to job finished) is reported per priority class.
+
+Usage (from infrastructure/input_lambda):
+    python benchmarks/bench_priority_scheduling.py [quota] [aging seconds] [seed]
+"""
+import heapq
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# lambda_log and lambda_metrics are deployed in the shared layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'shared_layer', 'python'))
+
+from admission import AdmissionController  # noqa: E402
+from scheduling import DEFAULT_PRIORITY, PRIORITY_CLASSES  # noqa: E402
+from store import connect  # noqa: E402
+
+# Share of visits per priority class
+PRIORITY_MIX = {'urgent': 0.1, 'standard': 0.3, 'routine': 0.6}
+
+
+def make_visits(seed, hour_seconds=3600, visits_per_hour=240, doctors=8):
+    """
+    Arrival time, priority class, doctor and job duration of every visit.
+    """
+    rng = random.Random(seed)
+    visits = []
+    for index in range(visits_per_hour):
+        priority = rng.choices(list(PRIORITY_MIX), weights=list(PRIORITY_MIX.values()))[0]
+        visits.append({
+            'name': f"visit-{index:04d}",
+            'arrival': rng.uniform(0, hour_seconds),
+            'priority': priority,
+            'doctor': f"doctor-{rng.randrange(doctors)}",
+            # Processing takes roughly a third of a 5-30 minute recording
+            'duration': rng.uniform(300, 1800) / 3
+        })
+    # One doctor uploads the morning's routine visits in one go
+    for index in range(40):
+        visits.append({
+            'name': f"batch-{index:04d}",
+            'arrival': hour_seconds / 4,
+            'priority': 'routine',
+            'doctor': 'doctor-batch',
+            'duration': rng.uniform(300, 1800) / 3
+        })
+    return sorted(visits, key=lambda visit: visit['arrival'])
+
+
+def simulate(visits, quota, aging_seconds, prioritise):
+    """
+    Run the visits through an admission controller.
+
+    Returns:
+        dict: Time-to-summary in seconds of every visit, keyed by job name
+    """
+    now = [0.0]
+    controller = AdmissionController(connect('sqlite::memory:'), quota, aging_seconds, clock=lambda: now[0])
+    by_name = {visit['name']: visit for visit in visits}
+    events = []
+    finished = {}
+
+    def submit(request):
+        visit = by_name[request['MedicalScribeJobName']]
+        heapq.heappush(events, (now[0] + visit['duration'], 1, visit['name']))
+
+    for visit in visits:
+        heapq.heappush(events, (visit['arrival'], 0, visit['name']))
+
+    while events:
+        now[0], kind, name = heapq.heappop(events)
+        visit = by_name[name]
+        if kind == 0:
+            priority = visit['priority'] if prioritise else DEFAULT_PRIORITY
+            doctor = visit['doctor'] if prioritise else None
+            request = {'MedicalScribeJobName': name}
+            if controller.admit(name, request, priority, doctor):
+                submit(request)
+        else:
+            finished[name] = now[0] - visit['arrival']
+            controller.release(name)
+            controller.drain(submit)
+    return finished
+
+
+def p95(values):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+
+
+def run(quota=25, aging_seconds=600, seed=7):
+    visits = make_visits(seed)
+    print(f"{len(visits)} visits, quota {quota}, aging {aging_seconds:.0f} s")
+    print(f"{'policy':<10}" + ''.join(f"{priority + ' p95':>16}" for priority in PRIORITY_CLASSES))
+    results = {}
+    for policy, prioritise in (('fifo', False), ('priority', True)):
+        finished = simulate(visits, quota, aging_seconds, prioritise)
+        results[policy] = {
+            priority: p95([finished[visit['name']] for visit in visits if visit['priority'] == priority])
+            for priority in PRIORITY_CLASSES
+        }
+        print(f"{policy:<10}" + ''.join(f"{results[policy][priority] / 60:>14.1f} m" for priority in PRIORITY_CLASSES))
+    return results
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:4]
+    run(int(arguments[0]) if len(arguments) > 0 else 25,
+        float(arguments[1]) if len(arguments) > 1 else 600,
+        int(arguments[2]) if len(arguments) > 2 else 7)
@@ -0,0 +1,152 @@
+"""
+Peak memory and throughput of transcript_stream on a synthetic long visit.
+
+A transcript.json of the requested size is written to a temporary file by
+repeating the demo conversation with shifted times and fresh IDs, then read
+back with transcript_stream.records: once timed, once under tracemalloc for
+the peak memory. The TranscriptItems are then loaded into
+transcript_columns.ItemColumns to report the memory they keep. The record
+counts are checked against what was written, and the run fails if the peak
+exceeds the budget, which leaves headroom in a 256 MB Lambda. --compare
+also measures json.load on the same file, and the memory its items keep.
+
+Usage (from infrastructure/input_lambda):
+    python benchmarks/bench_transcript_stream.py --size-mb 100 [--compare]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# transcript_stream is deployed in the shared layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'shared_layer', 'python'))
+
+import transcript_stream  # noqa: E402
+from transcript_columns import ItemColumns  # noqa: E402
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'demo response')
+
+LIST_FIELDS = ['ClinicalInsights', 'TranscriptItems', 'TranscriptSegments']
+
+
+def _shifted(field, entry, repeat, duration):
+    """
+    Copy of a demo list entry for the `repeat`th repetition of the conversation.
+    """
+    entry = dict(entry)
+    if 'BeginAudioTime' in entry:
+        entry['BeginAudioTime'] = round(entry['BeginAudioTime'] + repeat * duration, 3)
+        entry['EndAudioTime'] = round(entry['EndAudioTime'] + repeat * duration, 3)
+    if field == 'TranscriptSegments':
+        entry['SegmentId'] = f"{entry['SegmentId']}-{repeat}"
+    elif field == 'ClinicalInsights':
+        entry['InsightId'] = f"{entry['InsightId']}-{repeat}"
+        entry['Spans'] = [dict(span, SegmentId=f"{span['SegmentId']}-{repeat}") for span in entry['Spans']]
+    return entry
+
+
+def write_transcript(path, size_mb):
+    """
+    Write a transcript.json of about `size_mb` megabytes, one entry at a time.
+
+    Returns:
+        dict: Number of entries written per list field
+    """
+    with open(os.path.join(DEMO_DIR, 'transcript.json')) as demo_file:
+        conversation = json.load(demo_file)['Conversation']
+    duration = conversation['TranscriptItems'][-1]['EndAudioTime'] + 1
+    # Entries are written without indentation, unlike the demo file
+    demo_bytes = len(json.dumps({'Conversation': conversation}))
+    repeats = max(1, round(size_mb * 1024 * 1024 / demo_bytes))
+
+    counts = {}
+    with open(path, 'w') as out:
+        out.write('{"Conversation": {')
+        for position, field in enumerate(sorted(conversation)):
+            out.write(('' if position == 0 else ', ') + json.dumps(field) + ': ')
+            if field not in LIST_FIELDS:
+                out.write(json.dumps(conversation[field]))
+                continue
+            out.write('[')
+            counts[field] = 0
+            for repeat in range(repeats):
+                for entry in conversation[field]:
+                    out.write((', ' if counts[field] else '') + json.dumps(_shifted(field, entry, repeat, duration)))
+                    counts[field] += 1
+            out.write(']')
+        out.write('}}')
+    return counts
+
+
+def read_counts(path):
+    counts = {field: 0 for field in LIST_FIELDS}
+    with open(path, 'rb') as body:
+        for field, _ in transcript_stream.records(body):
+            counts[field] += 1
+    return counts
+
+
+def run(size_mb=100, max_peak_mb=32, compare=False):
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'transcript.json')
+        expected = write_transcript(path, size_mb)
+        actual_mb = os.path.getsize(path) / 1024 / 1024
+
+        started = time.perf_counter()
+        counts = read_counts(path)
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        read_counts(path)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mb = peak / 1024 / 1024
+
+        print(f"{actual_mb:.1f} MB transcript: " + ", ".join(f"{counts[field]} {field}" for field in LIST_FIELDS))
+        print(f"transcript_stream  {elapsed:6.2f} s  {actual_mb / elapsed:6.1f} MB/s  peak {peak_mb:7.1f} MB")
+
+        tracemalloc.start()
+        with open(path, 'rb') as body:
+            records = transcript_stream.records(body, ['TranscriptItems'])
+            columns = ItemColumns.from_records(record for _, record in records)
+        columns_bytes, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"ItemColumns        {columns_bytes / len(columns):6.1f} bytes/item  "
+              f"({len(columns.tokens)} distinct tokens)")
+        del columns
+
+        if compare:
+            started = time.perf_counter()
+            tracemalloc.start()
+            with open(path) as transcript_file:
+                items = json.load(transcript_file)['Conversation']['TranscriptItems']
+            items_bytes, load_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            load_elapsed = time.perf_counter() - started
+            print(f"json.load          {load_elapsed:6.2f} s  {actual_mb / load_elapsed:6.1f} MB/s  "
+                  f"peak {load_peak / 1024 / 1024:7.1f} MB (timed under tracemalloc)")
+            print(f"item dicts         {items_bytes / len(items):6.1f} bytes/item, "
+                  f"{items_bytes / columns_bytes:.1f}x ItemColumns")
+            del items
+
+    problems = []
+    if counts != expected:
+        problems.append(f"read {counts}, wrote {expected}")
+    if peak_mb > max_peak_mb:
+        problems.append(f"peak {peak_mb:.1f} MB over the {max_peak_mb} MB budget")
+    for problem in problems:
+        print("FAIL", problem)
+    return len(problems)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size-mb', type=float, default=100, help='Size of the synthetic transcript')
+    parser.add_argument('--max-peak-mb', type=float, default=32, help='Peak memory budget of the streaming read')
+    parser.add_argument('--compare', action='store_true', help='Also measure json.load')
+    args = parser.parse_args()
+    sys.exit(1 if run(args.size_mb, args.max_peak_mb, args.compare) else 0)
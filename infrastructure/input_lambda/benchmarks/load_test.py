@@ -0,0 +1,271 @@
+"""
+Local load test of the input Lambda against SimulatedTranscribeClient.
+
+Synthetic S3 events are replayed through lambda_handler in submit-and-return
+mode, the resulting job state change events through job_state_change_handler,
+and finally a batch of jobs is waited on with JobPoller and with the old
+one-GetMedicalScribeJob-every-30-seconds loop. Job durations and polling run
+on a simulated clock; the call latency of the fake is real, so thread pool
+sizes show up in the submission rate.
+
+Reported: submissions/s, API calls per job by operation, invocation latency
+percentiles, throttled and failed submissions, and for polling the API calls
+per job and the delay between a job finishing and the poller noticing.
+
+Settings not fixed by the harness come from the environment as usual, e.g.
+STATE_STORE=sqlite:/tmp/loadtest.db with HEALTHSCRIBE_MAX_CONCURRENT_JOBS to
+put admission control in front of --max-running.
+
+Usage (from infrastructure/input_lambda):
+    python benchmarks/load_test.py --records 2000 --batch-size 10 --workers 8
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# lambda_log and lambda_metrics are deployed in the shared layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'shared_layer', 'python'))
+
+import clients  # noqa: E402
+import lambda_function  # noqa: E402
+from fakes import FakeJobEventSource, FakeS3Client, SimulatedTranscribeClient  # noqa: E402
+from scheduling import PRIORITY_CLASSES  # noqa: E402
+from poller import JobPoller  # noqa: E402
+
+# Interval of the per-job polling loop JobPoller replaced
+LEGACY_POLL_SECONDS = 30
+
+
+class SimulatedClock:
+    """
+    Clock that only moves when told to; its sleep() advances it.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def s3_events(records, batch_size, bucket='loadtest-input', seed=0):
+    """
+    Yield S3 ObjectCreated events with `batch_size` records each.
+
+    Every record is a new visit folder holding one WAV upload, the layout
+    the backend produces.
+    """
+    rng = random.Random(seed)
+    for start in range(0, records, batch_size):
+        yield {
+            'Records': [
+                {
+                    'eventSource': 'aws:s3',
+                    'eventName': 'ObjectCreated:Put',
+                    's3': {
+                        'bucket': {'name': bucket},
+                        'object': {
+                            'key': f"loadtest_{index:06d}/visit.wav",
+                            'size': rng.randint(1, 50) * 1024 * 1024,
+                            'eTag': f"{rng.getrandbits(128):032x}"
+                        }
+                    }
+                }
+                for index in range(start, min(records, start + batch_size))
+            ]
+        }
+
+
+def percentiles(values, points=(50, 95, 99)):
+    if not values:
+        return {f"p{point}": None for point in points}
+    values = sorted(values)
+    return {
+        f"p{point}": round(values[min(len(values) - 1, int(round(point / 100 * (len(values) - 1))))], 4)
+        for point in points
+    }
+
+
+def job_duration(rng, mean_seconds):
+    return lambda: rng.expovariate(1 / mean_seconds)
+
+
+def configure(workers):
+    """
+    Point the handlers at a fresh configuration for a local run.
+    """
+    os.environ.update({
+        'OUTPUT_BUCKET_NAME': 'loadtest-output',
+        'HEALTHSCRIBE_ROLE_ARN': 'arn:aws:iam::000000000000:role/loadtest',
+        'HEALTHSCRIBE_WAIT_FOR_COMPLETION': 'false',
+        'AUDIO_PREFLIGHT': 'false',
+        'MAX_CONCURRENT_SUBMISSIONS': str(workers)
+    })
+    clients.reset()
+
+
+def run_handlers(args):
+    """
+    Submission and completion phases through the Lambda handlers.
+    """
+    configure(args.workers)
+    clock = SimulatedClock()
+    events = FakeJobEventSource()
+    healthscribe = SimulatedTranscribeClient(
+        events, job_duration(random.Random(args.seed), args.job_seconds), args.failure_rate,
+        args.throttle_rate, args.max_running, args.call_latency, clock=clock, seed=args.seed
+    )
+    clients.register_client('transcribe', healthscribe)
+    # The uploads themselves, with the metadata the priority scheduler reads
+    s3 = FakeS3Client()
+    rng = random.Random(args.seed)
+    for event in s3_events(args.records, args.batch_size, seed=args.seed):
+        for record in event['Records']:
+            s3.put_object(Bucket=record['s3']['bucket']['name'], Key=record['s3']['object']['key'], Body=b'',
+                          Metadata={'priority': rng.choice(PRIORITY_CLASSES), 'doctor-id': f"doctor-{rng.randrange(8)}"})
+    clients.register_client('s3', s3)
+
+    latencies = []
+    outcomes = {}
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for event in s3_events(args.records, args.batch_size, seed=args.seed):
+            invoked = time.perf_counter()
+            response = lambda_function.lambda_handler(event, None)
+            latencies.append(time.perf_counter() - invoked)
+            for result in json.loads(response['body']).get('results', []):
+                outcome = 'error' if 'error' in result else result.get('jobStatus', 'skipped')
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    elapsed = time.perf_counter() - started
+    submitted = len(healthscribe.jobs)
+    submit_calls = dict(healthscribe.calls)
+
+    # Let the jobs finish and feed the state change events to the handler;
+    # completions may submit queued jobs, which finish later in turn
+    completion_latencies = []
+    completion_errors = 0
+    delivered = 0
+    attempts = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        while events.pending or healthscribe.deadlines:
+            if not events.pending:
+                clock.sleep(min(healthscribe.deadlines.values()) - clock())
+                healthscribe.advance()
+                continue
+            event = events.pending.pop(0)
+            if event['id'] not in attempts:
+                delivered += 1
+            invoked = time.perf_counter()
+            try:
+                lambda_function.job_state_change_handler(event, None)
+            except Exception:
+                # Lambda retries a failed asynchronous invocation twice
+                completion_errors += 1
+                attempts[event['id']] = attempts.get(event['id'], 0) + 1
+                if attempts[event['id']] < 3:
+                    events.pending.append(event)
+            completion_latencies.append(time.perf_counter() - invoked)
+    completion_calls = {
+        operation: count - submit_calls.get(operation, 0)
+        for operation, count in healthscribe.calls.items()
+        if count - submit_calls.get(operation, 0)
+    }
+
+    return {
+        'records': args.records,
+        'invocations': len(latencies),
+        'submitted': submitted,
+        'outcomes': outcomes,
+        'submissionsPerSecond': round(submitted / elapsed, 1) if elapsed else None,
+        'submitApiCallsPerJob': {
+            operation: round(count / max(1, submitted), 3) for operation, count in submit_calls.items()
+        },
+        'throttledCalls': dict(healthscribe.throttled),
+        'invocationLatencySeconds': percentiles(latencies),
+        'completionEvents': delivered,
+        'completionErrors': completion_errors,
+        'completionApiCallsPerJob': {
+            operation: round(count / max(1, delivered), 3) for operation, count in completion_calls.items()
+        },
+        'completionLatencySeconds': percentiles(completion_latencies)
+    }
+
+
+def run_polling(args):
+    """
+    Waiting for a batch of jobs: JobPoller against the per-job loop.
+    """
+    rng = random.Random(args.seed)
+    durations = [rng.expovariate(1 / args.job_seconds) for _ in range(args.poll_jobs)]
+
+    # Per-job loop: one GetMedicalScribeJob right away and then every 30 s
+    legacy_calls = 0
+    legacy_delays = []
+    for duration in durations:
+        checks = int(duration // LEGACY_POLL_SECONDS) + 2
+        legacy_calls += checks
+        legacy_delays.append((checks - 1) * LEGACY_POLL_SECONDS - duration)
+
+    clock = SimulatedClock()
+    healthscribe = SimulatedTranscribeClient(
+        job_seconds=iter(durations).__next__, failure_rate=args.failure_rate, clock=clock, seed=args.seed
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(args.poll_jobs):
+            healthscribe.start_medical_scribe_job(
+                MedicalScribeJobName=f"poll_{index:06d}", Media={'MediaFileUri': 's3://loadtest-input/x.wav'},
+                OutputBucketName='loadtest-output', DataAccessRoleArn='role', Settings={}
+            )
+        # Only the polling calls are throttled here
+        healthscribe.throttle_rate = args.throttle_rate
+        poller = JobPoller(healthscribe, sleep=clock.sleep, clock=clock, rng=rng.random)
+        for index in range(args.poll_jobs):
+            poller.track(f"poll_{index:06d}", max_wait_seconds=None)
+        noticed = {}
+        poller.wait(lambda summary: noticed.setdefault(summary['MedicalScribeJobName'], clock()))
+    poller_delays = [noticed[name] - healthscribe.finished_at[name] for name in noticed]
+
+    return {
+        'jobs': args.poll_jobs,
+        'perJobLoop': {
+            'apiCallsPerJob': round(legacy_calls / args.poll_jobs, 2),
+            'detectionDelaySeconds': percentiles(legacy_delays)
+        },
+        'jobPoller': {
+            'apiCallsPerJob': round(poller.api_calls / args.poll_jobs, 2),
+            'detectionDelaySeconds': percentiles(poller_delays)
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--records', type=int, default=2000, help='S3 records to replay')
+    parser.add_argument('--batch-size', type=int, default=10, help='Records per S3 event')
+    parser.add_argument('--workers', type=int, default=8, help='MAX_CONCURRENT_SUBMISSIONS')
+    parser.add_argument('--job-seconds', type=float, default=300, help='Mean simulated job duration')
+    parser.add_argument('--failure-rate', type=float, default=0.02, help='Share of jobs that fail')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of calls throttled')
+    parser.add_argument('--max-running', type=int, default=None, help='Concurrent job quota of the fake')
+    parser.add_argument('--call-latency', type=float, default=0.02, help='Seconds per API call')
+    parser.add_argument('--poll-jobs', type=int, default=200, help='Jobs in the polling comparison')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    report = {'handlers': run_handlers(args), 'polling': run_polling(args)}
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Checkpoints for HealthScribe jobs that outlive the invocation waiting on them.
+
+An invocation waiting for completion can only poll for so long. Jobs still
+running when it stops are written here with their submit time and polling
+state, and checkpoint_handler, run on a schedule, carries on polling them
+from that state: one refresh per run, no waiting in between.
+"""
+import time
+
+from store import get_store
+
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS healthscribe_poll_checkpoint (
+    job_name VARCHAR(200) NOT NULL PRIMARY KEY,
+    submitted_at DOUBLE NOT NULL,
+    attempt INT NOT NULL,
+    handoffs INT NOT NULL,
+    next_poll_at DOUBLE NOT NULL,
+    checkpointed_at DOUBLE NOT NULL
+)
+"""
+
+# Jobs tracked for longer than this are given up on
+MAX_TRACKING_SECONDS = 6 * 3600
+
+
+class JobCheckpoints:
+    """
+    Checkpoint records of jobs handed off to a continuation invocation.
+
+    Args:
+        store (store.Store): Store holding the checkpoint table
+        clock (callable): Wall clock in seconds
+    """
+
+    def __init__(self, store, clock=time.time):
+        self.store = store
+        self.clock = clock
+        self.store.execute(CREATE_TABLE)
+
+    def save(self, job_name, submitted_at, attempt, next_poll_at, handoffs=0):
+        """
+        Write or update the checkpoint of a job.
+
+        Args:
+            job_name (str): Name of the MedicalScribe job
+            submitted_at (float): Submission time, epoch seconds
+            attempt (int): Poller backoff attempt reached so far
+            next_poll_at (float): When the job should next be polled, epoch seconds
+            handoffs (int): Number of invocations that handed the job on
+        """
+        _, rowcount = self.store.execute(
+            "UPDATE healthscribe_poll_checkpoint SET attempt = %s, handoffs = %s, next_poll_at = %s, "
+            "checkpointed_at = %s WHERE job_name = %s",
+            (attempt, handoffs, next_poll_at, self.clock(), job_name)
+        )
+        if rowcount == 1:
+            return
+        try:
+            self.store.execute(
+                "INSERT INTO healthscribe_poll_checkpoint "
+                "(job_name, submitted_at, attempt, handoffs, next_poll_at, checkpointed_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                (job_name, submitted_at, attempt, handoffs, next_poll_at, self.clock())
+            )
+        except self.store.IntegrityError:
+            # Written concurrently by another invocation; its record will do
+            pass
+
+    def due(self, limit=500):
+        """
+        Checkpoints whose next poll time has come, oldest submission first.
+
+        Returns:
+            list: Dicts with jobName, submittedAt, attempt and handoffs
+        """
+        rows, _ = self.store.execute(
+            "SELECT job_name, submitted_at, attempt, handoffs FROM healthscribe_poll_checkpoint "
+            "WHERE next_poll_at <= %s ORDER BY submitted_at LIMIT %s",
+            (self.clock(), limit)
+        )
+        return [
+            {'jobName': job_name, 'submittedAt': submitted_at, 'attempt': attempt, 'handoffs': handoffs}
+            for job_name, submitted_at, attempt, handoffs in rows
+        ]
+
+    def claim(self, job_name):
+        """
+        Remove the checkpoint of a finished job.
+
+        Returns:
+            bool: True for the caller that removed it, which should handle
+                the job's completion; False if another invocation got there first
+        """
+        _, rowcount = self.store.execute(
+            "DELETE FROM healthscribe_poll_checkpoint WHERE job_name = %s",
+            (job_name,)
+        )
+        return rowcount == 1
+
+
+_checkpoints = None
+
+
+def get_checkpoints():
+    """
+    Return the checkpoint table for this container.
+
+    Returns:
+        JobCheckpoints: The checkpoints, or None when no store is configured
+    """
+    global _checkpoints
+    store = get_store()
+    if store is None:
+        return None
+    if _checkpoints is None or _checkpoints.store is not store:
+        _checkpoints = JobCheckpoints(store)
+    return _checkpoints
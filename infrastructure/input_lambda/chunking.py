@@ -0,0 +1,372 @@
+"""
+Splitting of long recordings into parallel HealthScribe jobs.
+
+A long consultation submitted as one job takes time proportional to its
+length. In chunked mode the recording is cut at quiet points into
+overlapping chunks, each chunk becomes its own job, and once every chunk job
+has finished their transcript.json and summary.json outputs are merged into
+one document with times rebased onto the original recording.
+
+Splitting works on 16-bit PCM WAV files, which can be cut without a decoder.
+The upload is streamed, never stored whole: one pass finds the quiet
+points, then each chunk is fetched with a ranged GET and uploaded before
+the next is read, so local storage only ever holds one chunk.
+Merging only needs the JSON documents and can be run offline. Chunk
+transcripts are streamed in with their TranscriptItems kept as
+transcript_columns.ItemColumns, and the merged document is streamed out, so
+long recordings never hold their items as dicts.
+"""
+import json
+import os
+import re
+import tempfile
+import wave
+from array import array
+
+import transcript_stream
+from transcript_columns import ItemColumns
+
+
+# Folder, below the upload's prefix, where chunk audio and the manifest live
+CHUNK_DIR = '_chunks'
+
+CHUNK_JOB_PATTERN = re.compile(r'^(?P<base>.+)-part-(?P<index>\d{3})$')
+
+
+def chunk_job_name(base_job_name, index):
+    return f"{base_job_name}-part-{index:03d}"
+
+
+def parse_chunk_job_name(job_name):
+    """
+    Returns:
+        tuple: (base job name, chunk index), or None for ordinary jobs
+    """
+    match = CHUNK_JOB_PATTERN.match(job_name)
+    if match is None:
+        return None
+    return match.group('base'), int(match.group('index'))
+
+
+class BodyStream:
+    """
+    Read-only view of a response body, so the wave module treats it as
+    unseekable and reads it front to back.
+
+    Bytes read are counted in `position`; straight after wave.open that is
+    the offset of the first frame in the object.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.position = 0
+
+    def read(self, size=-1):
+        data = self.body.read(size)
+        self.position += len(data)
+        return data
+
+
+def window_energies(wav_file, window_seconds=0.1, stride=4):
+    """
+    Mean absolute amplitude of consecutive windows of a 16-bit WAV file.
+
+    Frames are streamed one window at a time, and only every `stride`-th
+    sample is looked at, which is plenty to find quiet stretches.
+
+    Args:
+        wav_file (wave.Wave_read): Open 16-bit PCM WAV file, positioned at
+            the start
+        window_seconds (float): Window length
+        stride (int): Sample step used for the estimate
+
+    Returns:
+        list: One energy value per window
+    """
+    frames_per_window = max(1, int(wav_file.getframerate() * window_seconds))
+    energies = []
+    while True:
+        frames = wav_file.readframes(frames_per_window)
+        if not frames:
+            break
+        samples = array('h', frames)[::stride]
+        energies.append(sum(map(abs, samples)) / max(1, len(samples)))
+    return energies
+
+
+def plan_chunks(energies, window_seconds, target_seconds, overlap_seconds, search_seconds=30):
+    """
+    Choose cut points near every `target_seconds`, at the quietest window
+    within `search_seconds` of the target.
+
+    Returns:
+        list: Chunks as dicts with 'start'/'end' (audio sent to HealthScribe,
+            including overlap) and 'keepStart'/'keepEnd' (the part of the
+            timeline this chunk is authoritative for), all in seconds
+    """
+    duration = len(energies) * window_seconds
+    cuts = [0.0]
+    target = target_seconds
+    while target < duration - target_seconds / 2:
+        # Never search back past the middle of the current chunk
+        earliest = max(target - search_seconds, cuts[-1] + target_seconds / 2)
+        low = int(earliest / window_seconds)
+        high = min(len(energies), int((target + search_seconds) / window_seconds) + 1)
+        # Quietest window, preferring the one closest to the target on ties
+        target_index = target / window_seconds
+        quietest = min(range(low, high), key=lambda index: (energies[index], abs(index - target_index)))
+        cuts.append(quietest * window_seconds)
+        target = cuts[-1] + target_seconds
+    cuts.append(duration)
+
+    chunks = []
+    for index in range(len(cuts) - 1):
+        chunks.append({
+            'index': index,
+            'start': max(0.0, cuts[index] - overlap_seconds),
+            'end': min(duration, cuts[index + 1] + overlap_seconds),
+            'keepStart': cuts[index],
+            'keepEnd': cuts[index + 1]
+        })
+    return chunks
+
+
+def write_chunk(body, channels, sample_rate, path, block_bytes=1024 * 1024):
+    """
+    Write the 16-bit PCM frames read from `body` to a new WAV file, block by
+    block.
+    """
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(channels)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        while True:
+            frames = body.read(block_bytes)
+            if not frames:
+                break
+            out.writeframes(frames)
+
+
+def split_wav_object(s3, bucket, key, target_seconds, overlap_seconds, window_seconds=0.1):
+    """
+    Split a WAV object into chunk objects next to it.
+
+    The upload is streamed once to find the quiet points. Each chunk's
+    frames are then fetched with a ranged GET, written to local storage and
+    uploaded to `<prefix>/_chunks/NNN.wav` in the same bucket before the next
+    chunk is read.
+
+    Returns:
+        list: Chunk dicts from plan_chunks with their 'key' added, or None if
+            the file cannot be split (not 16-bit PCM)
+    """
+    prefix = key.rsplit('/', 1)[0] if '/' in key else ''
+    chunk_prefix = f"{prefix}/{CHUNK_DIR}" if prefix else CHUNK_DIR
+
+    stream = BodyStream(s3.get_object(Bucket=bucket, Key=key)['Body'])
+    try:
+        wav_file = wave.open(stream, 'rb')
+    except (wave.Error, EOFError):
+        return None
+    with wav_file:
+        if wav_file.getsampwidth() != 2:
+            return None
+        # wave.open stops reading at the start of the frames
+        data_offset = stream.position
+        channels = wav_file.getnchannels()
+        sample_rate = wav_file.getframerate()
+        chunks = plan_chunks(window_energies(wav_file, window_seconds), window_seconds,
+                             target_seconds, overlap_seconds)
+
+    frame_bytes = 2 * channels
+    with tempfile.TemporaryDirectory() as workdir:
+        for chunk in chunks:
+            first_byte = data_offset + int(chunk['start'] * sample_rate) * frame_bytes
+            end_byte = data_offset + int(chunk['end'] * sample_rate) * frame_bytes
+            body = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={first_byte}-{end_byte - 1}")['Body']
+            chunk_path = os.path.join(workdir, f"{chunk['index']:03d}.wav")
+            write_chunk(body, channels, sample_rate, chunk_path)
+            chunk['key'] = f"{chunk_prefix}/{chunk['index']:03d}.wav"
+            s3.upload_file(chunk_path, bucket, chunk['key'])
+            os.remove(chunk_path)
+
+    return chunks
+
+
+def manifest_key(prefix):
+    return f"{prefix}/{CHUNK_DIR}/manifest.json" if prefix else f"{CHUNK_DIR}/manifest.json"
+
+
+def rebase_items(items, offset, keep_start=None, keep_end=None):
+    """
+    Shift BeginAudioTime/EndAudioTime of transcript entries by `offset`
+    seconds, keeping only entries that start inside [keep_start, keep_end).
+
+    Punctuation items carry no timing (both times are 0), so they are left
+    as they are and follow the item before them in or out.
+    """
+    rebased = []
+    keep_previous = False
+    for item in items:
+        if item.get('Type') == 'PUNCTUATION':
+            if keep_previous:
+                rebased.append(item)
+            continue
+        begin = round(item['BeginAudioTime'] + offset, 3)
+        keep_previous = (
+            (keep_start is None or begin >= keep_start)
+            and (keep_end is None or begin < keep_end)
+        )
+        if not keep_previous:
+            continue
+        item = dict(item)
+        item['BeginAudioTime'] = begin
+        item['EndAudioTime'] = round(item['EndAudioTime'] + offset, 3)
+        rebased.append(item)
+    return rebased
+
+
+def merge_transcripts(parts, job_name):
+    """
+    Merge chunk transcript.json documents into one.
+
+    Args:
+        parts (list): (chunk dict, transcript document) pairs in chunk order
+        job_name (str): JobName for the merged document
+
+    Returns:
+        dict: Merged transcript document, with its TranscriptItems as
+            ItemColumns; write it with write_transcript
+    """
+    segments = []
+    items = ItemColumns()
+    insights = []
+    first = parts[0][1]['Conversation']
+
+    for chunk, document in parts:
+        conversation = document['Conversation']
+        offset = chunk['start']
+        kept = rebase_items(conversation.get('TranscriptSegments', []), offset,
+                            chunk['keepStart'], chunk['keepEnd'])
+        segments.extend(kept)
+        chunk_items = conversation.get('TranscriptItems', [])
+        if not isinstance(chunk_items, ItemColumns):
+            chunk_items = ItemColumns.from_dicts(chunk_items)
+        items.extend(chunk_items.rebased(offset, chunk['keepStart'], chunk['keepEnd']))
+
+        kept_ids = {segment['SegmentId'] for segment in kept}
+        for insight in conversation.get('ClinicalInsights', []):
+            if any(span.get('SegmentId') in kept_ids for span in insight.get('Spans', [])):
+                insights.append(insight)
+
+    return {
+        'Conversation': {
+            'ClinicalInsights': insights,
+            'ConversationId': first.get('ConversationId'),
+            'JobName': job_name,
+            'JobType': first.get('JobType'),
+            'LanguageCode': first.get('LanguageCode'),
+            'TranscriptItems': items,
+            'TranscriptSegments': segments
+        }
+    }
+
+
+def merge_summaries(summaries, transcript=None):
+    """
+    Merge chunk summary.json documents section by section.
+
+    Sections keep the order in which they first appear. When the merged
+    transcript is given, evidence links to segments dropped from the overlap
+    are removed.
+
+    Args:
+        summaries (list): summary.json documents in chunk order
+        transcript (dict): Merged transcript document
+
+    Returns:
+        dict: Merged summary document
+    """
+    kept_ids = None
+    if transcript is not None:
+        kept_ids = {segment['SegmentId'] for segment in transcript['Conversation']['TranscriptSegments']}
+
+    sections = {}
+    for summary in summaries:
+        for section in summary['ClinicalDocumentation']['Sections']:
+            merged = sections.setdefault(section['SectionName'], [])
+            for entry in section.get('Summary', []):
+                entry = dict(entry)
+                if kept_ids is not None:
+                    entry['EvidenceLinks'] = [
+                        link for link in entry.get('EvidenceLinks', []) if link['SegmentId'] in kept_ids
+                    ]
+                merged.append(entry)
+
+    return {
+        'ClinicalDocumentation': {
+            'Sections': [
+                {'SectionName': name, 'Summary': entries} for name, entries in sections.items()
+            ]
+        }
+    }
+
+
+def read_json(s3, bucket, key):
+    return json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+
+def read_transcript(body):
+    """
+    Stream a transcript.json document in, keeping its TranscriptItems as columns.
+
+    Args:
+        body (object): File-like object with read(size), e.g. an S3 StreamingBody
+
+    Returns:
+        dict: The document, with Conversation.TranscriptItems as ItemColumns
+    """
+    conversation = {'TranscriptItems': ItemColumns()}
+    for field, value in transcript_stream.conversation(body):
+        if field == 'TranscriptItems':
+            conversation[field].append(transcript_stream.transcript_item(value))
+        elif field in transcript_stream.RECORDS:
+            conversation.setdefault(field, []).append(value)
+        else:
+            conversation[field] = value
+    return {'Conversation': conversation}
+
+
+def write_transcript(document, out):
+    """
+    Write a transcript document as JSON, its ItemColumns one item at a time.
+
+    Args:
+        document (dict): Transcript document, e.g. from merge_transcripts
+        out (object): Text file to write to
+    """
+    out.write('{"Conversation": {')
+    for position, (field, value) in enumerate(document['Conversation'].items()):
+        out.write(('' if position == 0 else ', ') + json.dumps(field) + ': ')
+        if not isinstance(value, ItemColumns):
+            out.write(json.dumps(value))
+            continue
+        out.write('[')
+        for index, item in enumerate(value.dicts()):
+            out.write((', ' if index else '') + json.dumps(item))
+        out.write(']')
+    out.write('}}')
+
+
+def upload_transcript(s3, document, bucket, key, metadata=None):
+    """
+    Write a transcript document to S3 through a temporary file.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'transcript.json')
+        with open(path, 'w') as out:
+            write_transcript(document, out)
+        if metadata:
+            s3.upload_file(path, bucket, key, ExtraArgs={'Metadata': metadata})
+        else:
+            s3.upload_file(path, bucket, key)
@@ -0,0 +1,199 @@
+"""
+AWS clients and configuration shared across warm invocations of the input
+Lambda.
+
+Lambda keeps the module loaded between invocations of a warm container, so
+clients are created lazily on first use and then reused instead of being
+rebuilt for every job. The module also keeps a small startup timing report
+separating module import, client construction and first API call latency.
+"""
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+import lambda_log
+
+
+_lock = threading.Lock()
+_clients = {}
+_settings = None
+
+_startup_timings = {
+    'importSeconds': None,
+    'clientConstructionSeconds': {},
+    'firstCallSeconds': {}
+}
+_startup_reported = False
+_call_started = threading.local()
+
+
+def load_settings():
+    """
+    Read the Lambda configuration from the environment.
+
+    Returns:
+        dict: Settings used by the handlers
+    """
+    max_concurrent_submissions = int(os.environ.get('MAX_CONCURRENT_SUBMISSIONS', '8'))
+    return {
+        'healthscribe_role_arn': os.environ.get('HEALTHSCRIBE_ROLE_ARN'),
+        'output_bucket': os.environ.get('OUTPUT_BUCKET_NAME'),
+        'wait_for_completion': os.environ.get('HEALTHSCRIBE_WAIT_FOR_COMPLETION', 'true').lower() == 'true',
+        'max_concurrent_submissions': max_concurrent_submissions,
+        # One pooled connection per submission thread, plus headroom for polling
+        'max_pool_connections': int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', str(max(10, max_concurrent_submissions + 2)))),
+        'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', '10')),
+        'audio_preflight': os.environ.get('AUDIO_PREFLIGHT', 'true').lower() == 'true',
+        'min_audio_seconds': float(os.environ.get('MIN_AUDIO_SECONDS', '5')),
+        'min_sample_rate': int(os.environ.get('MIN_SAMPLE_RATE', '16000')),
+        'chunking_enabled': os.environ.get('CHUNKING_ENABLED', 'false').lower() == 'true',
+        'chunk_min_seconds': float(os.environ.get('CHUNK_MIN_SECONDS', '1800')),
+        'chunk_target_seconds': float(os.environ.get('CHUNK_TARGET_SECONDS', '600')),
+        'chunk_overlap_seconds': float(os.environ.get('CHUNK_OVERLAP_SECONDS', '10')),
+        # Concurrent HealthScribe jobs allowed by the account quota; 0 turns admission control off.
+        # Must be set for every input Lambda, or slots taken by one are never handed back by the others
+        'max_concurrent_jobs': int(os.environ.get('HEALTHSCRIBE_MAX_CONCURRENT_JOBS', '0')),
+        # Queue wait after which a job moves up one priority class
+        'priority_aging_seconds': float(os.environ.get('PRIORITY_AGING_SECONDS', '600')),
+        # Age after which a job's quota slot is taken back if its completion was never handled
+        'job_timeout_seconds': float(os.environ.get('HEALTHSCRIBE_JOB_TIMEOUT_SECONDS', str(6 * 3600))),
+        # Hand jobs still running after handoff_seconds to the scheduled checkpoint_handler; needs a store
+        # and the medisync_healthscribe_scheduler schedule, otherwise nothing resumes them
+        'checkpoint_handoff': os.environ.get('CHECKPOINT_HANDOFF', 'false').lower() == 'true',
+        'handoff_seconds': float(os.environ.get('HEALTHSCRIBE_HANDOFF_SECONDS', '120')),
+        # Age after which an upload's unfinished ledger claim, e.g. of a timed out invocation, is taken over
+        'ledger_claim_timeout_seconds': float(os.environ.get('LEDGER_CLAIM_TIMEOUT_SECONDS', '900')),
+        # Copy the outputs of an identical recording instead of transcribing it again, when a store is configured
+        'content_dedupe': os.environ.get('CONTENT_DEDUPE', 'true').lower() == 'true',
+        # Cut leading and trailing silence off WAV uploads before submitting them
+        'silence_trim': os.environ.get('SILENCE_TRIM', 'false').lower() == 'true',
+        'silence_threshold_dbfs': float(os.environ.get('SILENCE_THRESHOLD_DBFS', '-45')),
+        'silence_min_trim_seconds': float(os.environ.get('SILENCE_MIN_TRIM_SECONDS', '5'))
+    }
+
+
+def get_settings():
+    """
+    Return the settings, reading the environment only on the first call.
+    """
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+    return _settings
+
+
+def client_config():
+    """
+    botocore configuration for the cached clients: a connection pool sized
+    for the submission thread pool and adaptive, client-side rate limited
+    retries for throttling errors.
+    """
+    settings = get_settings()
+    return Config(
+        max_pool_connections=settings['max_pool_connections'],
+        retries={
+            'mode': 'adaptive',
+            'max_attempts': settings['max_attempts']
+        },
+        connect_timeout=5,
+        read_timeout=30
+    )
+
+
+def get_client(service_name):
+    """
+    Return the cached client for an AWS service, creating it on first use.
+
+    Args:
+        service_name (str): boto3 service name, e.g. 'transcribe' or 's3'
+
+    Returns:
+        object: boto3 client shared by all threads of this container
+    """
+    client = _clients.get(service_name)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(service_name)
+        if client is None:
+            started = time.perf_counter()
+            client = boto3.client(service_name, config=client_config())
+            _startup_timings['clientConstructionSeconds'][service_name] = round(time.perf_counter() - started, 6)
+            _watch_first_call(client, service_name)
+            _clients[service_name] = client
+    return client
+
+
+def register_client(service_name, client):
+    """
+    Use the given client for a service instead of a boto3 one, e.g. one of the
+    fakes when running the handlers locally.
+    """
+    with _lock:
+        _clients[service_name] = client
+
+
+def reset():
+    """
+    Drop cached clients and settings, as a cold start would.
+    """
+    global _settings, _startup_reported
+    with _lock:
+        _clients.clear()
+        _settings = None
+        _startup_reported = False
+        _startup_timings['importSeconds'] = None
+        _startup_timings['clientConstructionSeconds'].clear()
+        _startup_timings['firstCallSeconds'].clear()
+
+
+def _watch_first_call(client, service_name):
+    """
+    Time the first API call made with a client through botocore's event hooks.
+    """
+    def before_call(**kwargs):
+        _call_started.value = time.perf_counter()
+
+    def after_call(**kwargs):
+        started = getattr(_call_started, 'value', None)
+        if started is not None and service_name not in _startup_timings['firstCallSeconds']:
+            _startup_timings['firstCallSeconds'][service_name] = round(time.perf_counter() - started, 6)
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+
+
+def record_import_time(seconds):
+    """
+    Record how long importing the handler module took.
+    """
+    _startup_timings['importSeconds'] = round(seconds, 6)
+
+
+def startup_report():
+    """
+    Return the startup timings collected so far.
+
+    Returns:
+        dict: Import, client construction and first call latency in seconds
+    """
+    return {
+        'importSeconds': _startup_timings['importSeconds'],
+        'clientConstructionSeconds': dict(_startup_timings['clientConstructionSeconds']),
+        'firstCallSeconds': dict(_startup_timings['firstCallSeconds'])
+    }
+
+
+def log_startup_report():
+    """
+    Print the startup report once per container, after the first invocation.
+    """
+    global _startup_reported
+    if _startup_reported:
+        return
+    _startup_reported = True
+    lambda_log.info("Startup timings", **startup_report())
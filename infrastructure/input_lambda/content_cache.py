@@ -0,0 +1,196 @@
+"""
+Cache of HealthScribe outputs by the content of the recording.
+
+The same recording uploaded again under a new visit folder would otherwise
+be transcribed again. Every submitted job is remembered under the content
+hash of its recording, and once it completes its transcript.json and
+summary.json are found through that hash. A later upload with the same hash
+gets copies of those outputs under its own prefix instead of a new job.
+
+The content hash is the object's ETag for single-part uploads, which S3
+computes as the MD5 of the content, and a SHA-256 streamed from the object
+for multipart uploads, whose ETag depends on the part size. A recording
+uploaded once in one piece and once in parts is therefore not matched.
+"""
+import hashlib
+import time
+
+from botocore.exceptions import ClientError
+
+from store import get_store
+
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS healthscribe_content_cache (
+        content_hash VARCHAR(80) NOT NULL PRIMARY KEY,
+        job_name VARCHAR(200) NOT NULL,
+        output_bucket VARCHAR(255) NOT NULL,
+        cached_at DOUBLE NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS healthscribe_content_pending (
+        job_name VARCHAR(200) NOT NULL PRIMARY KEY,
+        content_hash VARCHAR(80) NOT NULL,
+        output_bucket VARCHAR(255) NOT NULL,
+        submitted_at DOUBLE NOT NULL
+    )
+    """
+]
+
+# Output documents of a job, copied in this order: summary.json last, as its
+# arrival marks the visit as processed
+OUTPUT_FILES = ['transcript.json', 'summary.json']
+
+# Read size when hashing multipart uploads
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def content_hash(s3, bucket, key, etag=None):
+    """
+    Hash identifying the content of an uploaded object.
+
+    Args:
+        s3 (object): S3 client
+        bucket (str): Bucket of the object
+        key (str): Key of the object
+        etag (str): ETag from the S3 event, if known
+
+    Returns:
+        str: 'md5:<etag>' for single-part uploads, 'sha256:<hex>' otherwise
+    """
+    etag = (etag or '').strip('"')
+    if etag and '-' not in etag:
+        return f"md5:{etag}"
+
+    digest = hashlib.sha256()
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    for chunk in iter(lambda: body.read(HASH_CHUNK_BYTES), b''):
+        digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+class ContentCache:
+    """
+    Completed job outputs keyed by the content hash of their recording.
+
+    Args:
+        store (store.Store): Store holding the cache tables
+    """
+
+    def __init__(self, store):
+        self.store = store
+        for statement in CREATE_TABLES:
+            self.store.execute(statement)
+
+    def lookup(self, digest):
+        """
+        Completed job for a content hash.
+
+        Returns:
+            tuple: (job name, output bucket), or None on a miss
+        """
+        rows, _ = self.store.execute(
+            "SELECT job_name, output_bucket FROM healthscribe_content_cache WHERE content_hash = %s",
+            (digest,)
+        )
+        return tuple(rows[0]) if rows else None
+
+    def reuse(self, s3, digest, output_bucket, job_name):
+        """
+        Copy the outputs of a cached job to a new job's prefix.
+
+        Args:
+            s3 (object): S3 client
+            digest (str): Content hash of the new upload
+            output_bucket (str): Bucket the new job's outputs belong in
+            job_name (str): Name the new job would have had; its output prefix
+
+        Returns:
+            str: Name of the job whose outputs were copied, or None on a miss
+        """
+        cached = self.lookup(digest)
+        if cached is None:
+            return None
+        source_job, source_bucket = cached
+        if source_job == job_name:
+            return None
+        try:
+            for name in OUTPUT_FILES:
+                s3.copy_object(
+                    Bucket=output_bucket, Key=f"{job_name}/{name}",
+                    CopySource={'Bucket': source_bucket, 'Key': f"{source_job}/{name}"}
+                )
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            # The cached outputs were deleted; transcribe again
+            self.store.execute("DELETE FROM healthscribe_content_cache WHERE content_hash = %s", (digest,))
+            return None
+        return source_job
+
+    def remember(self, digest, job_name, output_bucket):
+        """
+        Note the content hash of a submitted job, to cache it once it completes.
+        """
+        try:
+            self.store.execute(
+                "INSERT INTO healthscribe_content_pending (job_name, content_hash, output_bucket, submitted_at) "
+                "VALUES (%s, %s, %s, %s)",
+                (job_name, digest, output_bucket, time.time())
+            )
+        except self.store.IntegrityError:
+            # Resubmission of the same job
+            pass
+
+    def complete(self, job_name):
+        """
+        Cache the outputs of a completed job.
+
+        Returns:
+            bool: True if the job had been remembered
+        """
+        rows, _ = self.store.execute(
+            "SELECT content_hash, output_bucket FROM healthscribe_content_pending WHERE job_name = %s",
+            (job_name,)
+        )
+        if not rows:
+            return False
+        digest, output_bucket = rows[0]
+        try:
+            self.store.execute(
+                "INSERT INTO healthscribe_content_cache (content_hash, job_name, output_bucket, cached_at) "
+                "VALUES (%s, %s, %s, %s)",
+                (digest, job_name, output_bucket, time.time())
+            )
+        except self.store.IntegrityError:
+            # Another job with the same content finished first; its outputs will do
+            pass
+        self.forget(job_name)
+        return True
+
+    def forget(self, job_name):
+        """
+        Drop the pending record of a job that will not be cached, e.g. one that failed.
+        """
+        self.store.execute("DELETE FROM healthscribe_content_pending WHERE job_name = %s", (job_name,))
+
+
+_cache = None
+
+
+def get_content_cache():
+    """
+    Return the content cache for this container.
+
+    Returns:
+        ContentCache: The cache, or None when no store is configured
+    """
+    global _cache
+    store = get_store()
+    if store is None:
+        return None
+    if _cache is None or _cache.store is not store:
+        _cache = ContentCache(store)
+    return _cache
@@ -0,0 +1,386 @@
+"""
+In-process stand-ins for AWS HealthScribe, used to run the input Lambda
+handlers locally without an AWS account.
+
+FakeTranscribeClient implements the Transcribe calls the handlers make,
+FakeS3Client serves objects from memory (including ranged GETs) and
+FakeJobEventSource plays the role of EventBridge, turning job state changes
+into the events job_state_change_handler receives in production.
+SimulatedTranscribeClient adds job durations, failures, throttling and call
+latency for load tests. Register
+the fakes with clients.register_client('transcribe', ...) and
+clients.register_client('s3', ...) so the handlers pick them up in place of
+the boto3 clients.
+"""
+import hashlib
+import io
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+def job_state_change_event(job_name, job_status):
+    """
+    Build an EventBridge event for a HealthScribe job state change.
+
+    Args:
+        job_name (str): Name of the MedicalScribe job
+        job_status (str): New status of the job
+
+    Returns:
+        dict: Event shaped like the ones delivered by EventBridge
+    """
+    return {
+        'version': '0',
+        'id': str(uuid.uuid4()),
+        'detail-type': 'MedicalScribe Job State Change',
+        'source': 'aws.transcribe',
+        'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'region': 'us-east-1',
+        'resources': [],
+        'detail': {
+            'MedicalScribeJobName': job_name,
+            'MedicalScribeJobStatus': job_status
+        }
+    }
+
+
+class FakeTranscribeClient:
+    """
+    Minimal Transcribe client keeping MedicalScribe jobs in memory.
+
+    Jobs stay IN_PROGRESS until finish_job is called. Every call is counted
+    in `calls` so callers can check how many API requests a flow made.
+    """
+
+    def __init__(self, event_source=None):
+        self.jobs = {}
+        self.calls = {}
+        self.event_source = event_source
+
+    def _count(self, operation):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def start_medical_scribe_job(self, MedicalScribeJobName, Media, OutputBucketName,
+                                 DataAccessRoleArn, Settings, ChannelDefinitions=None):
+        self._count('StartMedicalScribeJob')
+        if MedicalScribeJobName in self.jobs:
+            raise ClientError({'Error': {'Code': 'ConflictException',
+                                         'Message': f"The requested job name already exists: {MedicalScribeJobName}"}},
+                              'StartMedicalScribeJob')
+
+        self.jobs[MedicalScribeJobName] = {
+            'MedicalScribeJobName': MedicalScribeJobName,
+            'MedicalScribeJobStatus': 'IN_PROGRESS',
+            'Media': Media,
+            'OutputBucketName': OutputBucketName,
+            'DataAccessRoleArn': DataAccessRoleArn,
+            'Settings': Settings,
+            'ChannelDefinitions': ChannelDefinitions or [],
+            'StartTime': datetime.now(timezone.utc),
+            'CreationTime': datetime.now(timezone.utc)
+        }
+        return {'MedicalScribeJob': dict(self.jobs[MedicalScribeJobName])}
+
+    def get_medical_scribe_job(self, MedicalScribeJobName):
+        self._count('GetMedicalScribeJob')
+        return {'MedicalScribeJob': dict(self._job(MedicalScribeJobName, 'GetMedicalScribeJob'))}
+
+    def delete_medical_scribe_job(self, MedicalScribeJobName):
+        self._count('DeleteMedicalScribeJob')
+        self._job(MedicalScribeJobName, 'DeleteMedicalScribeJob')
+        del self.jobs[MedicalScribeJobName]
+        return {}
+
+    def _job(self, job_name, operation):
+        if job_name not in self.jobs:
+            raise ClientError({'Error': {'Code': 'BadRequestException',
+                                         'Message': f"The requested job couldn't be found: {job_name}"}},
+                              operation)
+        return self.jobs[job_name]
+
+    def list_medical_scribe_jobs(self, Status=None, JobNameContains=None, NextToken=None, MaxResults=5):
+        self._count('ListMedicalScribeJobs')
+        # Newest first, like the real API
+        matching = [
+            job for job in sorted(self.jobs.values(), key=lambda job: job['CreationTime'], reverse=True)
+            if (Status is None or job['MedicalScribeJobStatus'] == Status)
+            and (JobNameContains is None or JobNameContains in job['MedicalScribeJobName'])
+        ]
+        start = int(NextToken or 0)
+        page = matching[start:start + MaxResults]
+        response = {
+            'MedicalScribeJobSummaries': [
+                {
+                    'MedicalScribeJobName': job['MedicalScribeJobName'],
+                    'MedicalScribeJobStatus': job['MedicalScribeJobStatus'],
+                    'CreationTime': job['CreationTime'],
+                    'StartTime': job['StartTime'],
+                    'CompletionTime': job.get('CompletionTime'),
+                    'FailureReason': job.get('FailureReason')
+                }
+                for job in page
+            ]
+        }
+        if start + MaxResults < len(matching):
+            response['NextToken'] = str(start + MaxResults)
+        return response
+
+    def finish_job(self, job_name, job_status='COMPLETED', failure_reason=None):
+        """
+        Move a job to a terminal state, as HealthScribe would once done.
+
+        Args:
+            job_name (str): Name of the job to finish
+            job_status (str): COMPLETED or FAILED
+            failure_reason (str): Reason reported for FAILED jobs
+        """
+        job = self.jobs[job_name]
+        job['MedicalScribeJobStatus'] = job_status
+        job['CompletionTime'] = datetime.now(timezone.utc)
+        if job_status == 'COMPLETED':
+            output_bucket = job['OutputBucketName']
+            job['MedicalScribeOutput'] = {
+                'TranscriptFileUri': f"s3://{output_bucket}/{job_name}/transcript.json",
+                'ClinicalDocumentUri': f"s3://{output_bucket}/{job_name}/summary.json"
+            }
+        elif failure_reason:
+            job['FailureReason'] = failure_reason
+
+        if self.event_source is not None:
+            self.event_source.publish(job_name, job_status)
+
+
+class SimulatedTranscribeClient(FakeTranscribeClient):
+    """
+    FakeTranscribeClient whose jobs finish on their own, for load tests.
+
+    Each job runs for `job_seconds` on the given clock and then completes,
+    or fails with probability `failure_rate`. Finished jobs are picked up
+    whenever the client is called, or with advance(). Any call can be
+    throttled with probability `throttle_rate`, starting a job beyond
+    `max_running` running jobs fails with LimitExceededException like the
+    account quota does, and every call takes `call_latency` seconds. The
+    client is safe to share between threads.
+
+    Args:
+        event_source (FakeJobEventSource): Receives the job state changes
+        job_seconds (callable): Returns the duration of a new job in seconds
+        failure_rate (float): Share of jobs that end FAILED
+        throttle_rate (float): Share of calls rejected with ThrottlingException
+        max_running (int): Concurrent job quota, None for no limit
+        call_latency (float): Seconds each call takes
+        clock (callable): Clock the job durations are measured on
+        sleep (callable): Used to wait out the call latency
+        seed (int): Seed for the random failures and throttling
+    """
+
+    def __init__(self, event_source=None, job_seconds=lambda: 300.0, failure_rate=0.0, throttle_rate=0.0,
+                 max_running=None, call_latency=0.0, clock=time.monotonic, sleep=time.sleep, seed=None):
+        super().__init__(event_source)
+        self.job_seconds = job_seconds
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.max_running = max_running
+        self.call_latency = call_latency
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.deadlines = {}
+        self.finished_at = {}
+        self.throttled = {}
+
+    def _count(self, operation):
+        with self.lock:
+            super()._count(operation)
+
+    def _call(self, operation):
+        """
+        Latency, throttling and job progress common to every call.
+        """
+        if self.call_latency:
+            self.sleep(self.call_latency)
+        with self.lock:
+            self.advance()
+            if self.rng.random() < self.throttle_rate:
+                self._count(operation)
+                self.throttled[operation] = self.throttled.get(operation, 0) + 1
+                raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                                  operation)
+
+    def advance(self):
+        """
+        Finish every job whose duration has passed.
+
+        Returns:
+            list: Names of the jobs finished by this call
+        """
+        with self.lock:
+            now = self.clock()
+            due = sorted((deadline, job_name) for job_name, deadline in self.deadlines.items() if deadline <= now)
+            for deadline, job_name in due:
+                del self.deadlines[job_name]
+                self.finished_at[job_name] = deadline
+                if self.rng.random() < self.failure_rate:
+                    self.finish_job(job_name, 'FAILED', 'Simulated failure')
+                else:
+                    self.finish_job(job_name)
+            return [job_name for _, job_name in due]
+
+    def start_medical_scribe_job(self, **kwargs):
+        self._call('StartMedicalScribeJob')
+        with self.lock:
+            if self.max_running is not None and len(self.deadlines) >= self.max_running:
+                self._count('StartMedicalScribeJob')
+                self.throttled['StartMedicalScribeJob'] = self.throttled.get('StartMedicalScribeJob', 0) + 1
+                raise ClientError({'Error': {'Code': 'LimitExceededException',
+                                             'Message': 'Concurrent job limit exceeded'}},
+                                  'StartMedicalScribeJob')
+            response = super().start_medical_scribe_job(**kwargs)
+            self.deadlines[kwargs['MedicalScribeJobName']] = self.clock() + self.job_seconds()
+            return response
+
+    def get_medical_scribe_job(self, MedicalScribeJobName):
+        self._call('GetMedicalScribeJob')
+        with self.lock:
+            return super().get_medical_scribe_job(MedicalScribeJobName)
+
+    def list_medical_scribe_jobs(self, **kwargs):
+        self._call('ListMedicalScribeJobs')
+        with self.lock:
+            return super().list_medical_scribe_jobs(**kwargs)
+
+
+class FakeJobEventSource:
+    """
+    Local replacement for the EventBridge rule feeding job_state_change_handler.
+
+    State changes are queued as they happen and handed to the handler when
+    deliver() is called, which keeps delivery under the caller's control.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def publish(self, job_name, job_status):
+        self.pending.append(job_state_change_event(job_name, job_status))
+
+    def deliver(self, handler, context=None, **kwargs):
+        """
+        Deliver every queued event to the handler in publish order.
+
+        Args:
+            handler (callable): Lambda-style handler taking (event, context)
+            context (object): Lambda context passed through to the handler
+            **kwargs: Extra keyword arguments for the handler
+
+        Returns:
+            list: Handler responses, one per delivered event
+        """
+        responses = []
+        while self.pending:
+            responses.append(handler(self.pending.pop(0), context, **kwargs))
+        return responses
+
+
+class FakeS3Client:
+    """
+    Minimal S3 client keeping objects in memory.
+
+    Supports the Range forms the handlers use ('bytes=a-b' and 'bytes=-n').
+    GET requests are counted in `calls` like FakeTranscribeClient does.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = {}
+
+    def _count(self, operation):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def _object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise KeyError(f"NoSuchKey: s3://{Bucket}/{Key}")
+        return self.objects[(Bucket, Key)]
+
+    def put_object(self, Bucket, Key, Body=b'', Metadata=None, **kwargs):
+        self._count('PutObject')
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        self.objects[(Bucket, Key)] = {
+            'Body': Body,
+            'ETag': '"' + hashlib.md5(Body).hexdigest() + '"',
+            'Metadata': dict(Metadata or {})
+        }
+        return {'ETag': self.objects[(Bucket, Key)]['ETag']}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        with open(Filename, 'rb') as source:
+            self.put_object(Bucket=Bucket, Key=Key, Body=source.read(), **(ExtraArgs or {}))
+
+    def download_file(self, Bucket, Key, Filename):
+        self._count('GetObject')
+        with open(Filename, 'wb') as target:
+            target.write(self._object(Bucket, Key)['Body'])
+
+    def head_object(self, Bucket, Key):
+        self._count('HeadObject')
+        stored = self._object(Bucket, Key)
+        return {
+            'ContentLength': len(stored['Body']),
+            'ETag': stored['ETag'],
+            'Metadata': dict(stored['Metadata'])
+        }
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self._count('CopyObject')
+        source = self._object(CopySource['Bucket'], CopySource['Key'])
+        self.objects[(Bucket, Key)] = dict(source, Metadata=dict(source['Metadata']))
+        return {'CopyObjectResult': {'ETag': source['ETag']}}
+
+    def list_objects_v2(self,Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000):
+        self._count('ListObjectsV2')
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {
+            'Contents': [
+                {'Key': key, 'Size': len(self.objects[(Bucket, key)]['Body']), 'ETag': self.objects[(Bucket, key)]['ETag']}
+                for key in page
+            ],
+            'KeyCount': len(page),
+            'IsTruncated': start + MaxKeys < len(keys)
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+    def get_object(self, Bucket, Key, Range=None):
+        self._count('GetObject')
+        stored = self._object(Bucket, Key)
+        body = stored['Body']
+        size = len(body)
+        response = {'ETag': stored['ETag'], 'Metadata': dict(stored['Metadata'])}
+
+        if Range is None:
+            response['ContentLength'] = size
+            response['Body'] = io.BytesIO(body)
+            return response
+
+        start, end = Range[len('bytes='):].split('-')
+        if start == '':
+            start, end = max(0, size - int(end)), size - 1
+        else:
+            start = int(start)
+            end = min(int(end) if end else size - 1, size - 1)
+        response['ContentLength'] = max(0, end - start + 1)
+        response['ContentRange'] = f"bytes {start}-{end}/{size}"
+        response['Body'] = io.BytesIO(body[start:end + 1])
+        return response
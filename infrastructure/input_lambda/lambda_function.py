@@ -1,11 +1,80 @@
-import boto3
-import json
-import uuid
-import os
 import time
+_import_started = time.perf_counter()
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from urllib.parse import urlparse
 
-def start_healthscribe_job(audio_file_uri, output_bucket, output_prefix):
+from botocore.exceptions import ClientError
+
+import chunking
+import clients
+import lambda_log
+import lambda_metrics
+from admission import get_admission_controller
+from audio_probe import ProbeError, channel_settings, check_audio, probe_object
+from checkpoint import MAX_TRACKING_SECONDS, get_checkpoints
+from content_cache import content_hash, get_content_cache
+from ledger import get_ledger
+from poller import JobPoller, THROTTLING_ERROR_CODES, TIMED_OUT
+from preprocess import PREPROCESSED_DIR, manifest_key as trim_manifest_key, restore_times, trim_wav_object
+from scheduling import DEFAULT_PRIORITY, resolve_priority
+from store import get_store
+from visit_stages import VisitStages
+
+# HealthScribe job states after which the job will not change any more
+TERMINAL_JOB_STATUSES = ['COMPLETED', 'FAILED']
+
+# Longest we wait for jobs: 14 minutes (leaving buffer for Lambda's 15 min limit)
+MAX_WAIT_TIME = 840
+
+_visit_stages = None
+
+
+def wait_for_completion_enabled():
+    """
+    Whether submissions should block until the HealthScribe job finishes.
+
+    Controlled by the HEALTHSCRIBE_WAIT_FOR_COMPLETION environment variable.
+    When disabled the job is submitted and the invocation returns straight
+    away; completion is picked up by job_state_change_handler instead.
+    """
+    return clients.get_settings()['wait_for_completion']
+
+
+def admission_controller():
+    """
+    The admission controller configured for this container, or None when
+    admission control is disabled.
+    """
+    settings = clients.get_settings()
+    return get_admission_controller(settings['max_concurrent_jobs'], settings['priority_aging_seconds'],
+                                    settings['job_timeout_seconds'])
+
+
+def drain_backlog(admission, healthscribe):
+    """
+    Submit queued jobs while quota slots are free.
+
+    Called whenever a slot may have been handed back: on job completion,
+    after each batch of submissions and from the scheduled checkpoint_handler,
+    so a backlog left behind with no job running is still drained.
+
+    Returns:
+        list: Names of the jobs submitted from the backlog
+    """
+    drained = admission.drain(lambda request: healthscribe.start_medical_scribe_job(**request))
+    if drained:
+        lambda_log.info("Submitted queued jobs", jobNames=drained)
+        record_stage([(chunking.parse_chunk_job_name(name) or (name,))[0] for name in drained], 'submitted')
+    admission.report()
+    return drained
+
+
+def start_healthscribe_job(audio_file_uri, output_bucket, output_prefix,
+                           wait_for_completion=None, healthscribe=None, audio_info=None,
+                           split_long_audio=None, priority=DEFAULT_PRIORITY, doctor_id=None):
     """
     Start an AWS HealthScribe job to process medical audio files.
     
@@ -13,70 +82,821 @@ def start_healthscribe_job(audio_file_uri, output_bucket, output_prefix):
         audio_file_uri (str): S3 URI of the audio file to process
         output_bucket (str): S3 bucket where output should be stored
         output_prefix (str): Prefix for the output files in S3 (not directly used as parameter)
+        wait_for_completion (bool): Poll until the job finishes. Defaults to
+            the HEALTHSCRIBE_WAIT_FOR_COMPLETION environment variable.
+        healthscribe (object): Transcribe client to use instead of the cached one
+        audio_info (AudioInfo): Pre-flight probe result used to pick the
+            channel settings; stereo clinician/patient layout if not given
+        split_long_audio (bool): Split long WAV recordings into parallel chunk
+            jobs. Defaults to the CHUNKING_ENABLED environment variable.
+        priority (str): Priority class of the visit, used when the job has
+            to wait for a quota slot
+        doctor_id (str): Doctor the visit belongs to, for fair scheduling
         
     Returns:
         dict: Response from AWS HealthScribe service
     """
-    # Initialize HealthScribe client
-    healthscribe = boto3.client('transcribe')
+    if wait_for_completion is None:
+        wait_for_completion = wait_for_completion_enabled()
+    if split_long_audio is None:
+        split_long_audio = clients.get_settings()['chunking_enabled']
+
+    # Reuse the HealthScribe client kept warm between invocations
+    if healthscribe is None:
+        healthscribe = clients.get_client('transcribe')
+    role_arn = clients.get_settings()['healthscribe_role_arn']
     
     # Create a unique job name that includes the prefix for organization
     job_name = f"{output_prefix}"
     # Remove any leading or trailing hyphens
     job_name = job_name.strip('-')
     
-    print(f"Starting HealthScribe job: {job_name}")
-    print(f"Using IAM Role: {os.environ.get('HEALTHSCRIBE_ROLE_ARN')}")
+    if split_long_audio and should_split(audio_info):
+        response = submit_chunked_job(audio_file_uri, output_bucket, job_name, audio_info, healthscribe,
+                                      priority, doctor_id)
+        if response is not None:
+            if wait_for_completion:
+                queued = response['MedicalScribeJob']['QueuedChunkJobNames']
+                chunk_jobs = [name for name in response['MedicalScribeJob']['ChunkJobNames'] if name not in queued]
+                finished = wait_for_jobs({name: None for name in chunk_jobs}, healthscribe)
+                if not queued:
+                    response['MedicalScribeJob']['MedicalScribeJobStatus'] = combined_status(
+                        [finished[name]['MedicalScribeJobStatus'] for name in chunk_jobs]
+                    )
+            return response
+    
+    lambda_log.debug("Starting HealthScribe job", jobName=job_name, roleArn=role_arn)
 
-    response = healthscribe.start_medical_scribe_job(
-        MedicalScribeJobName=job_name,
-        Media={
+    settings, channel_definitions = channel_settings(audio_info)
+    job_request = {
+        'MedicalScribeJobName': job_name,
+        'Media': {
             'MediaFileUri': audio_file_uri
         },
-        OutputBucketName=output_bucket,
-        DataAccessRoleArn=os.environ.get('HEALTHSCRIBE_ROLE_ARN'),
-        Settings={
-            'ShowSpeakerLabels': False,
-            'ChannelIdentification': True
-        },
-        ChannelDefinitions=[
-            {
-                'ChannelId': 0, 
-                'ParticipantRole': 'CLINICIAN'
-            }, 
-            {
-                'ChannelId': 1, 
-                'ParticipantRole': 'PATIENT'
-            }
-        ]
-    )
+        'OutputBucketName': output_bucket,
+        'DataAccessRoleArn': role_arn,
+        'Settings': settings
+    }
+    if channel_definitions is not None:
+        job_request['ChannelDefinitions'] = channel_definitions
+
+    # Take a slot of the concurrent job quota, or park the request until one frees up
+    admission = admission_controller()
+    if admission is not None and not admission.admit(job_name, job_request, priority, doctor_id):
+        lambda_log.info("Concurrent job quota reached, job queued", jobName=job_name, priority=priority)
+        lambda_log.count('queued')
+        admission.report()
+        return {'MedicalScribeJob': {'MedicalScribeJobName': job_name, 'MedicalScribeJobStatus': 'QUEUED'}}
+
+    try:
+        submit_started = time.perf_counter()
+        response = healthscribe.start_medical_scribe_job(**job_request)
+        lambda_metrics.put('SubmitLatency', (time.perf_counter() - submit_started) * 1000)
+    except ClientError as e:
+        if admission is None:
+            raise
+        if e.response['Error']['Code'] in THROTTLING_ERROR_CODES:
+            lambda_log.warning("Submission throttled, job queued", jobName=job_name, error=str(e))
+            lambda_log.count('queued')
+            admission.requeue(job_name, job_request, priority, doctor_id)
+            return {'MedicalScribeJob': {'MedicalScribeJobName': job_name, 'MedicalScribeJobStatus': 'QUEUED'}}
+        admission.release(job_name)
+        raise
+
+    if not wait_for_completion:
+        # Submit-and-return: the job state change event drives completion
+        lambda_log.info("Submitted job", jobName=job_name,
+                        status=response['MedicalScribeJob']['MedicalScribeJobStatus'])
+        return response
 
     # Wait for job completion
-    start_time = time.time()
-    max_wait_time = 840  # 14 minutes (leaving buffer for Lambda's 15 min limit)
+    created_at = response['MedicalScribeJob'].get('CreationTime')
+    summary = wait_for_jobs({job_name: created_at}, healthscribe)[job_name]
     
-    while True:
-        # Check if we're approaching Lambda timeout
-        if time.time() - start_time > max_wait_time:
-            print(f"Approaching Lambda timeout limit after {max_wait_time} seconds. Job is still running.")
-            # Return the current status without waiting for completion
-            return healthscribe.get_medical_scribe_job(MedicalScribeJobName=job_name)
-            
-        status = healthscribe.get_medical_scribe_job(MedicalScribeJobName=job_name)
-        job_status = status['MedicalScribeJob']['MedicalScribeJobStatus']
+    if summary['MedicalScribeJobStatus'] == TIMED_OUT:
+        # Return the current status without waiting for completion
+        return healthscribe.get_medical_scribe_job(MedicalScribeJobName=job_name)
         
-        if job_status in ['COMPLETED', 'FAILED']:
-            print(f"Job {job_name} finished with status: {job_status}")
+    return {'MedicalScribeJob': summary}
+
+def combined_status(statuses):
+    """
+    Overall status of a job made of several HealthScribe jobs.
+    """
+    if 'FAILED' in statuses:
+        return 'FAILED'
+    if all(status == 'COMPLETED' for status in statuses):
+        return 'COMPLETED'
+    return 'IN_PROGRESS'
+
+def should_split(audio_info):
+    """
+    Whether a probed recording is long enough, and in a format we can cut,
+    to be split into chunk jobs.
+    """
+    settings = clients.get_settings()
+    return (
+        audio_info is not None
+        and audio_info.format == 'wav'
+        and audio_info.duration_seconds is not None
+        and audio_info.duration_seconds > settings['chunk_min_seconds']
+    )
+
+def submit_chunked_job(audio_file_uri, output_bucket, job_name, audio_info, healthscribe,
+                       priority=DEFAULT_PRIORITY, doctor_id=None):
+    """
+    Split a long recording at quiet points and start one job per chunk.
+
+    The chunks and a manifest describing them are written under the upload's
+    `_chunks/` folder; the manifest is read back to merge the outputs once
+    every chunk job has finished.
+
+    Args:
+        audio_file_uri (str): S3 URI of the recording
+        output_bucket (str): S3 bucket where output should be stored
+        job_name (str): Name of the job the merged output belongs to
+        audio_info (AudioInfo): Pre-flight probe result
+        healthscribe (object): Transcribe client
+        priority (str): Priority class of the visit
+        doctor_id (str): Doctor the visit belongs to
+
+    Returns:
+        dict: Response shaped like StartMedicalScribeJob's, listing the chunk
+            jobs in ChunkJobNames and those waiting for a quota slot in
+            QueuedChunkJobNames, or None if the file could not be split
+    """
+    settings = clients.get_settings()
+    s3 = clients.get_client('s3')
+    parsed = urlparse(audio_file_uri)
+    source_bucket, source_key = parsed.netloc, parsed.path.lstrip('/')
+
+    chunks = chunking.split_wav_object(s3, source_bucket, source_key,
+                                       settings['chunk_target_seconds'], settings['chunk_overlap_seconds'])
+    if chunks is None or len(chunks) < 2:
+        lambda_log.info("Not splitting recording, submitting it as one job", inputFile=audio_file_uri)
+        return None
+
+    for chunk in chunks:
+        chunk['jobName'] = chunking.chunk_job_name(job_name, chunk['index'])
+    s3.put_object(
+        Bucket=source_bucket,
+        Key=chunking.manifest_key(job_name),
+        Body=json.dumps({
+            'jobName': job_name,
+            'sourceUri': audio_file_uri,
+            'outputBucket': output_bucket,
+            'chunks': chunks
+        })
+    )
+    lambda_log.info("Split recording into chunks", inputFile=audio_file_uri, chunks=len(chunks))
+
+    def submit(chunk):
+        return start_healthscribe_job(
+            audio_file_uri=f"s3://{source_bucket}/{chunk['key']}",
+            output_bucket=output_bucket,
+            output_prefix=chunk['jobName'],
+            wait_for_completion=False,
+            healthscribe=healthscribe,
+            audio_info=audio_info,
+            split_long_audio=False,
+            priority=priority,
+            doctor_id=doctor_id
+        )
+
+    with ThreadPoolExecutor(max_workers=min(len(chunks), settings['max_concurrent_submissions'])) as executor:
+        responses = list(executor.map(submit, chunks))
+
+    return {
+        'MedicalScribeJob': {
+            'MedicalScribeJobName': job_name,
+            'MedicalScribeJobStatus': 'IN_PROGRESS',
+            'ChunkJobNames': [chunk['jobName'] for chunk in chunks],
+            'QueuedChunkJobNames': [
+                chunk['jobName'] for chunk, response in zip(chunks, responses)
+                if response['MedicalScribeJob']['MedicalScribeJobStatus'] == 'QUEUED'
+            ]
+        }
+    }
+
+def complete_chunked_job(base_job_name, job, healthscribe):
+    """
+    Merge the outputs of a chunked job once all of its chunk jobs finished.
+
+    Called for every finished chunk job; only the call that sees every chunk
+    COMPLETED writes the merged transcript.json and summary.json.
+
+    Args:
+        base_job_name (str): Name of the job the chunks belong to
+        job (dict): Description of the chunk job that just finished
+        healthscribe (object): Transcribe client
+
+    Returns:
+        str: Status of the chunked job as a whole
+    """
+    if 'Media' not in job:
+        job = healthscribe.get_medical_scribe_job(MedicalScribeJobName=job['MedicalScribeJobName'])['MedicalScribeJob']
+    input_bucket = urlparse(job['Media']['MediaFileUri']).netloc
+
+    s3 = clients.get_client('s3')
+    manifest = chunking.read_json(s3, input_bucket, chunking.manifest_key(base_job_name))
+
+    statuses = {}
+    request = {'JobNameContains': f"{base_job_name}-part-", 'MaxResults': 100}
+    while True:
+        page = healthscribe.list_medical_scribe_jobs(**request)
+        for summary in page.get('MedicalScribeJobSummaries', []):
+            statuses[summary['MedicalScribeJobName']] = summary['MedicalScribeJobStatus']
+        if not page.get('NextToken'):
             break
-            
-        print(f"Job status: {job_status} - waiting...")
-        time.sleep(30)  # Check every 30 seconds instead of 5 to reduce API calls
+        request['NextToken'] = page['NextToken']
+
+    chunk_statuses = [statuses.get(chunk['jobName']) for chunk in manifest['chunks']]
+    if 'FAILED' in chunk_statuses:
+        lambda_log.warning("Chunked job failed: a chunk job failed", jobName=base_job_name)
+        return 'FAILED'
+    if any(status != 'COMPLETED' for status in chunk_statuses):
+        lambda_log.info("Chunked job in progress", jobName=base_job_name,
+                        chunksDone=chunk_statuses.count('COMPLETED'), chunks=len(chunk_statuses))
+        return 'IN_PROGRESS'
+
+    output_bucket = manifest['outputBucket']
+    parts = [
+        (chunk, chunking.read_transcript(
+            s3.get_object(Bucket=output_bucket, Key=f"{chunk['jobName']}/transcript.json")['Body']
+        ))
+        for chunk in manifest['chunks']
+    ]
+    transcript = chunking.merge_transcripts(parts, base_job_name)
+    summary = chunking.merge_summaries(
+        [chunking.read_json(s3, output_bucket, f"{chunk['jobName']}/summary.json") for chunk in manifest['chunks']],
+        transcript
+    )
+
+    # summary.json last: its arrival marks the visit as processed
+    chunking.upload_transcript(s3, transcript, output_bucket, f"{base_job_name}/transcript.json")
+    s3.put_object(Bucket=output_bucket, Key=f"{base_job_name}/summary.json", Body=json.dumps(summary))
+    lambda_log.info("Merged chunk outputs", jobName=base_job_name, chunks=len(parts),
+                    outputLocation=f"s3://{output_bucket}/{base_job_name}/")
+    return 'COMPLETED'
+
+def wait_for_jobs(jobs, healthscribe, max_wait_time=None):
+    """
+    Wait for several HealthScribe jobs at once with a batched poller.
+
+    With CHECKPOINT_HANDOFF enabled and a state store configured, jobs still
+    running when the wait runs out are checkpointed with their polling state
+    and picked up by the scheduled checkpoint_handler, so the wait can be
+    kept short.
+
+    Args:
+        jobs (dict): Submission time (or None) keyed by job name
+        healthscribe (object): Transcribe client used for polling
+        max_wait_time (float): Seconds to wait before giving up on a job or
+            handing it off
+
+    Returns:
+        dict: Final job summaries keyed by job name; jobs still running when
+            the wait ran out have the TIMED_OUT status
+    """
+    settings = clients.get_settings()
+    checkpoints = get_checkpoints() if settings['checkpoint_handoff'] else None
+    if checkpoints is None and settings['checkpoint_handoff']:
+        lambda_log.warning("CHECKPOINT_HANDOFF is enabled but no STATE_STORE is configured, waiting instead")
+    if max_wait_time is None:
+        max_wait_time = settings['handoff_seconds'] if checkpoints is not None else MAX_WAIT_TIME
+
+    poller = JobPoller(healthscribe)
+    for job_name, submitted_at in jobs.items():
+        poller.track(job_name, max_wait_seconds=max_wait_time, submitted_at=submitted_at)
+    submitted = {job_name: job['submitted_at'] for job_name, job in poller.outstanding.items()}
+
+    def on_finished(summary):
+        job_name = summary['MedicalScribeJobName']
+        if summary['MedicalScribeJobStatus'] == TIMED_OUT and checkpoints is not None:
+            checkpoints.save(job_name, submitted[job_name].timestamp(), poller.attempt,
+                             time.time() + poller.max_delay)
+            lambda_log.info("Job still running, handed off with a checkpoint", jobName=job_name,
+                            waitedSeconds=max_wait_time)
+        elif summary['MedicalScribeJobStatus'] == TIMED_OUT:
+            lambda_log.warning("Approaching Lambda timeout limit, job still running", jobName=job_name,
+                               waitedSeconds=max_wait_time)
+        else:
+            lambda_log.info("Job finished", jobName=job_name, status=summary['MedicalScribeJobStatus'])
+            handle_job_completion(summary)
+
+    finished = poller.wait(on_finished)
+    lambda_log.info("Polled jobs", jobs=len(jobs), listCalls=poller.api_calls)
+    lambda_log.count('listCalls', poller.api_calls)
+    if jobs:
+        lambda_metrics.put('PollCallsPerJob', poller.api_calls / len(jobs), 'Count')
+    return finished
+
+def record_stage(unique_ids, stage, at=None):
+    """
+    Record that visits reached a pipeline stage, when a store is configured.
+
+    Stage tracking is bookkeeping: a failure to record it is logged and the
+    pipeline carries on.
+
+    Args:
+        unique_ids (list): uniqueIDs (job names) of the visits
+        stage (str): Stage from visit_stages.STAGES
+        at (float): When the stage was reached, epoch seconds; now if not given
+    """
+    global _visit_stages
+    store = get_store()
+    if store is None or not unique_ids:
+        return
+    try:
+        if _visit_stages is None or _visit_stages[0] is not store:
+            _visit_stages = (store, VisitStages(store.execute, store.dialect))
+        _visit_stages[1].advance(unique_ids, stage, at)
+    except Exception as e:
+        lambda_log.warning("Could not record visit stage", stage=stage, visits=len(unique_ids), error=str(e))
+
+def content_cache():
+    """
+    The content cache configured for this container, or None when output
+    reuse is disabled.
+    """
+    if not clients.get_settings()['content_dedupe']:
+        return None
+    return get_content_cache()
+
+def cache_outputs(job_name, job_status):
+    """
+    Make the outputs of a completed job available for identical recordings,
+    or forget a failed one.
+    """
+    cache = content_cache()
+    if cache is None:
+        return
+    if job_status == 'COMPLETED':
+        cache.complete(job_name)
+    elif job_status == 'FAILED':
+        cache.forget(job_name)
+
+def restore_trimmed_times(job, healthscribe):
+    """
+    Move the transcript times of a job submitted with a trimmed derivative
+    back onto the original recording.
+
+    The rewritten transcript.json is marked in its metadata, so a repeated
+    completion event does not shift it twice.
+
+    Args:
+        job (dict): MedicalScribeJob description or summary of a completed job
+        healthscribe (object): Transcribe client
+    """
+    if 'Media' not in job:
+        job = healthscribe.get_medical_scribe_job(MedicalScribeJobName=job['MedicalScribeJobName'])['MedicalScribeJob']
+    media = urlparse(job['Media']['MediaFileUri'])
+    key = media.path.lstrip('/')
+    if f"/{PREPROCESSED_DIR}/" not in f"/{key}":
+        return
+
+    s3 = clients.get_client('s3')
+    prefix = key.rsplit(f"{PREPROCESSED_DIR}/", 1)[0].rstrip('/')
+    offset = chunking.read_json(s3, media.netloc, trim_manifest_key(prefix))['offsetSeconds']
+    if not offset:
+        return
+
+    output_bucket = job.get('OutputBucketName') or clients.get_settings()['output_bucket']
+    transcript_key = f"{job['MedicalScribeJobName']}/transcript.json"
+    response = s3.get_object(Bucket=output_bucket, Key=transcript_key)
+    if 'time-offset-seconds' in response.get('Metadata', {}):
+        return
+    transcript = restore_times(chunking.read_transcript(response['Body']), offset)
+    chunking.upload_transcript(s3, transcript, output_bucket, transcript_key,
+                               metadata={'time-offset-seconds': str(offset)})
+    lambda_log.info("Restored transcript times of trimmed recording", jobName=job['MedicalScribeJobName'],
+                    offsetSeconds=offset)
+
+def handle_job_completion(job):
+    """
+    Handle a HealthScribe job that reached a terminal state.
+
+    Called from the poller when waiting for completion, and from
+    job_state_change_handler when running in submit-and-return mode, so both
+    paths finish a job the same way.
+
+    Args:
+        job (dict): MedicalScribeJob description or summary
+
+    Returns:
+        dict: Summary of the finished job
+    """
+    job_name = job['MedicalScribeJobName']
+    job_status = job['MedicalScribeJobStatus']
+
+    lambda_metrics.put('JobsFailed' if job_status == 'FAILED' else 'JobsCompleted', 1, 'Count')
+    if job.get('CreationTime') and job.get('CompletionTime'):
+        lambda_metrics.put('JobDuration', (job['CompletionTime'] - job['CreationTime']).total_seconds(), 'Seconds')
+    if job.get('CompletionTime'):
+        # How long after the job finished we got to handle it
+        lambda_metrics.put('CompletionDetectionDelay', lambda_metrics.seconds_since(job['CompletionTime']), 'Seconds')
+
+    # Hand the job's quota slot to the next queued submission
+    admission = admission_controller()
+    if admission is not None:
+        admission.release(job_name)
+        drain_backlog(admission, clients.get_client('transcribe'))
+
+    chunk = chunking.parse_chunk_job_name(job_name)
+    if chunk is not None and job_status == 'COMPLETED':
+        base_job_name = chunk[0]
+        base_status = complete_chunked_job(base_job_name, job, clients.get_client('transcribe'))
+        if base_status == 'COMPLETED':
+            record_stage([base_job_name], 'transcribed')
+        cache_outputs(base_job_name, base_status)
+        return {
+            'jobName': base_job_name,
+            'jobStatus': base_status,
+            'failureReason': None
+        }
+    if chunk is None and job_status == 'COMPLETED':
+        # Not gated on SILENCE_TRIM: that is the processor's setting, and the
+        # Lambda handling completions may not have it
+        restore_trimmed_times(job, clients.get_client('transcribe'))
+        completed_at = job['CompletionTime'].timestamp() if job.get('CompletionTime') else None
+        record_stage([job_name], 'transcribed', completed_at)
+    cache_outputs(chunk[0] if chunk is not None else job_name, job_status)
+
+    if job_status == 'FAILED':
+        lambda_log.warning("Job failed", jobName=job_name, failureReason=job.get('FailureReason', 'unknown reason'))
+    else:
+        lambda_log.info("Job completed", jobName=job_name, output=job.get('MedicalScribeOutput', {}))
+
+    return {
+        'jobName': job_name,
+        'jobStatus': job_status,
+        'failureReason': job.get('FailureReason')
+    }
+
+@lambda_metrics.emit_metrics
+@lambda_log.log_invocation
+def job_state_change_handler(event, context, healthscribe=None):
+    """
+    Lambda handler for HealthScribe job state change events from EventBridge.
+
+    The event only tells us that a job changed state, so the job is looked up
+    again with GetMedicalScribeJob before it is treated as finished. Events for
+    non-terminal states are ignored.
+
+    Args:
+        event (dict): EventBridge event with the job name and status in 'detail'
+        context (object): Lambda context
+        healthscribe (object): Transcribe client to use instead of the cached one
+
+    Returns:
+        dict: Response containing the handled job, if any
+    """
+    detail = event.get('detail', {})
+    job_name = detail.get('MedicalScribeJobName')
+    job_status = detail.get('MedicalScribeJobStatus')
+
+    if not job_name:
+        lambda_log.warning("Ignoring event without a MedicalScribeJobName", eventId=event.get('id'))
+        return {'statusCode': 400, 'body': json.dumps({'message': 'No job name in event'})}
+
+    if job_status not in TERMINAL_JOB_STATUSES:
+        lambda_log.info("Ignoring non-terminal state change", jobName=job_name, status=job_status)
+        return {'statusCode': 200, 'body': json.dumps({'message': 'Job not finished', 'jobName': job_name})}
+
+    if healthscribe is None:
+        healthscribe = clients.get_client('transcribe')
+
+    job = healthscribe.get_medical_scribe_job(MedicalScribeJobName=job_name)['MedicalScribeJob']
+    if job['MedicalScribeJobStatus'] not in TERMINAL_JOB_STATUSES:
+        # Events can arrive before the job description is consistent
+        lambda_log.info("Ignoring state change not yet visible on the job", jobName=job_name,
+                        reportedStatus=job_status, status=job['MedicalScribeJobStatus'])
+        return {'statusCode': 200, 'body': json.dumps({'message': 'Job not finished', 'jobName': job_name})}
+
+    result = handle_job_completion(job)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'HealthScribe job completion handled',
+            'result': result
+        })
+    }
+
+@lambda_metrics.emit_metrics
+@lambda_log.log_invocation
+def checkpoint_handler(event, context, healthscribe=None):
+    """
+    Lambda handler continuing to poll jobs handed off with a checkpoint.
+
+    Runs on an EventBridge rate(1 minute) schedule. Each run refreshes the
+    due checkpoints once with a batched poller restored to their backoff
+    state, completes the jobs that finished and moves the next poll time of
+    the rest. It never sleeps between polls. It also drains the admission
+    backlog, which otherwise only moves when a job completes.
+
+    Args:
+        event (dict): Scheduled event (unused)
+        context (object): Lambda context
+        healthscribe (object): Transcribe client to use instead of the cached one
+
+    Returns:
+        dict: Response containing the jobs completed by this run
+    """
+    if healthscribe is None:
+        healthscribe = clients.get_client('transcribe')
+
+    admission = admission_controller()
+    if admission is not None:
+        drain_backlog(admission, healthscribe)
+
+    checkpoints = get_checkpoints()
+    if checkpoints is None:
+        lambda_log.info("No STATE_STORE configured, nothing to resume")
+        return {'statusCode': 200, 'body': json.dumps({'message': 'No state store configured', 'results': []})}
+
+    due = checkpoints.due()
+    if not due:
+        return {'statusCode': 200, 'body': json.dumps({'message': 'No checkpointed jobs due', 'results': []})}
+
+    # Resume from the furthest backoff reached rather than from scratch
+    poller = JobPoller(healthscribe)
+    poller.attempt = max(checkpoint['attempt'] for checkpoint in due)
+    for checkpoint in due:
+        poller.track(checkpoint['jobName'],
+                     submitted_at=datetime.fromtimestamp(checkpoint['submittedAt'], timezone.utc))
+    finished = poller.refresh()
+
+    results = []
+    for summary in finished:
+        # Only the invocation that removes the checkpoint completes the job
+        if checkpoints.claim(summary['MedicalScribeJobName']):
+            lambda_log.info("Job finished", jobName=summary['MedicalScribeJobName'],
+                            status=summary['MedicalScribeJobStatus'])
+            results.append(handle_job_completion(summary))
+
+    now = time.time()
+    next_poll_at = now + poller.next_delay()
+    for checkpoint in due:
+        job_name = checkpoint['jobName']
+        if job_name not in poller.outstanding:
+            continue
+        if now - checkpoint['submittedAt'] > MAX_TRACKING_SECONDS:
+            checkpoints.claim(job_name)
+            lambda_log.warning("Giving up on job still running long after submission", jobName=job_name,
+                               trackedSeconds=MAX_TRACKING_SECONDS)
+            continue
+        checkpoints.save(job_name, checkpoint['submittedAt'], poller.attempt + 1, next_poll_at,
+                         checkpoint['handoffs'] + 1)
+
+    lambda_log.annotate(resumed=len(due), finished=len(results), listCalls=poller.api_calls)
+    lambda_metrics.put('PollCallsPerJob', poller.api_calls / len(due), 'Count')
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Checkpointed jobs polled',
+            'results': results
+        })
+    }
+
+def output_prefix_for_key(source_key):
+    """
+    Output prefix of an upload: the folder it was uploaded to, which is also
+    the visit's uniqueID and, stripped of hyphens, its job name.
+    """
+    key_parts = source_key.split('/')
+    if len(key_parts) > 1:
+        # If key has slashes, use everything before the last slash as prefix
+        return '/'.join(key_parts[:-1])
+    # If no slashes, use empty prefix
+    return ""
+
+def process_record(record, output_bucket, healthscribe=None):
+    """
+    Start a HealthScribe job for a single S3 event record.
+
+    Args:
+        record (dict): S3 event record
+        output_bucket (str): S3 bucket where output should be stored
+        healthscribe (object): Transcribe client shared between records
+
+    Returns:
+        dict: Job details for the record, or None if the record was skipped
+    """
+    # Extract S3 bucket and key info
+    source_bucket = record['s3']['bucket']['name']
+    source_key = record['s3']['object']['key']
+    
+    # Chunks of split recordings are submitted by the job that split them
+    if f"{chunking.CHUNK_DIR}/" in source_key:
+        lambda_log.debug("Skipping chunk file", key=source_key)
+        return None
+    # Likewise trimmed derivatives, by the job of the upload they came from
+    if f"{PREPROCESSED_DIR}/" in source_key:
+        lambda_log.debug("Skipping preprocessed file", key=source_key)
+        return None
+    
+    # Skip processing if this is not an audio file
+    audio_extensions = ['.mp3', '.wav', '.flac', '.m4a', '.mp4', '.ogg']
+    if not any(source_key.lower().endswith(ext) for ext in audio_extensions):
+        lambda_log.info("Skipping non-audio file", key=source_key)
+        return None
         
-    return status
+    
+    # Create S3 URI for input file
+    audio_file_uri = f"s3://{source_bucket}/{source_key}"
+    
+    # Extract the prefix (everything before the last slash) for the output
+    output_prefix = output_prefix_for_key(source_key)
+    
+    lambda_log.debug("Processing file", inputFile=audio_file_uri, outputPrefix=output_prefix)
+    
+    # Drop duplicate deliveries of the same upload before any AWS call
+    ledger = get_ledger(clients.get_settings()['ledger_claim_timeout_seconds'])
+    etag = record['s3']['object'].get('eTag', '')
+    if ledger is not None and not ledger.claim(source_bucket, source_key, etag, output_prefix.strip('-')):
+        lambda_log.info("Skipping duplicate notification", inputFile=audio_file_uri, etag=etag)
+        lambda_log.count('duplicates')
+        return {
+            'inputFile': audio_file_uri,
+            'skipped': 'Duplicate S3 notification'
+        }
+    
+    try:
+        job_name = output_prefix.strip('-')
+        upload_age = lambda_metrics.seconds_since(record.get('eventTime'))
+        record_stage([job_name], 'uploaded', time.time() - upload_age if upload_age is not None else None)
+
+        # A recording transcribed before gets copies of its outputs instead of a new job
+        cache = content_cache()
+        digest = None
+        if cache is not None:
+            s3 = clients.get_client('s3')
+            try:
+                with lambda_log.timer('contentHash'):
+                    digest = content_hash(s3, source_bucket, source_key, etag)
+                reused_from = cache.reuse(s3, digest, output_bucket, job_name)
+            except ClientError as e:
+                lambda_log.warning("Content cache unavailable, transcribing", inputFile=audio_file_uri, error=str(e))
+                digest, reused_from = None, None
+            if reused_from is not None:
+                lambda_log.info("Reused outputs of an identical recording", inputFile=audio_file_uri,
+                                jobName=job_name, reusedFrom=reused_from)
+                lambda_log.count('reused')
+                lambda_metrics.put('OutputsReused', 1, 'Count')
+                return {
+                    'jobName': job_name,
+                    'jobStatus': 'COMPLETED',
+                    'inputFile': audio_file_uri,
+                    'outputLocation': f"s3://{output_bucket}/",
+                    'reusedFrom': reused_from
+                }
+
+        # Check the container header with a ranged read before paying for a job
+        audio_info = None
+        settings = clients.get_settings()
+        if settings['audio_preflight']:
+            try:
+                with lambda_log.timer('probe'):
+                    audio_info, _ = probe_object(clients.get_client('s3'), source_bucket, source_key)
+                rejection = check_audio(audio_info, settings['min_audio_seconds'], settings['min_sample_rate'])
+            except ProbeError as e:
+                rejection = str(e)
+            if rejection:
+                lambda_log.info("Rejecting recording", inputFile=audio_file_uri, reason=rejection)
+                lambda_log.count('rejected')
+                lambda_metrics.put('Rejected', 1, 'Count')
+                return {
+                    'inputFile': audio_file_uri,
+                    'rejected': rejection
+                }
+            lambda_log.debug("Probed recording", inputFile=audio_file_uri, audio=audio_info)
+
+        # Cut leading and trailing silence before paying for the recording's length
+        media_uri = audio_file_uri
+        if (settings['silence_trim'] and source_key.lower().endswith('.wav')
+                and not (settings['chunking_enabled'] and should_split(audio_info))):
+            with lambda_log.timer('trim'):
+                trimmed = trim_wav_object(clients.get_client('s3'), source_bucket, source_key,
+                                          settings['silence_threshold_dbfs'], settings['silence_min_trim_seconds'])
+            if trimmed is not None:
+                media_uri = f"s3://{source_bucket}/{trimmed['key']}"
+                lambda_log.info("Trimmed silence", inputFile=audio_file_uri, offsetSeconds=trimmed['offsetSeconds'],
+                                durationSeconds=trimmed['durationSeconds'], originalSeconds=trimmed['originalSeconds'])
+                lambda_metrics.put('SilenceTrimmed', trimmed['originalSeconds'] - trimmed['durationSeconds'], 'Seconds')
+                if audio_info is not None:
+                    audio_info = audio_info._replace(duration_seconds=trimmed['durationSeconds'],
+                                                     sample_rate=trimmed['sampleRate'])
+
+        # Priority only matters when jobs have to queue for a quota slot
+        priority, doctor_id = DEFAULT_PRIORITY, None
+        if admission_controller() is not None:
+            priority, doctor_id = resolve_priority(clients.get_client('s3'), source_bucket, source_key,
+                                                   output_prefix.strip('-'), get_store())
+            lambda_log.debug("Scheduling recording", inputFile=audio_file_uri, priority=priority, doctorId=doctor_id)
+
+        # Start the HealthScribe job; waiting, if enabled, is done for the whole batch
+        job_status = start_healthscribe_job(
+            audio_file_uri=media_uri,
+            output_bucket=output_bucket,
+            output_prefix=output_prefix,
+            wait_for_completion=False,
+            healthscribe=healthscribe,
+            audio_info=audio_info,
+            priority=priority,
+            doctor_id=doctor_id
+        )
+    except Exception:
+        # Let a redelivered notification try again
+        if ledger is not None:
+            ledger.release(source_bucket, source_key, etag)
+            ledger = None
+        raise
+    finally:
+        # Submitted, queued, reused or rejected: later deliveries are duplicates
+        if ledger is not None:
+            ledger.complete(source_bucket, source_key, etag)
+    if digest is not None:
+        cache.remember(digest, job_status['MedicalScribeJob']['MedicalScribeJobName'], output_bucket)
+    
+    result = {
+        'jobName': job_status['MedicalScribeJob']['MedicalScribeJobName'],
+        'jobStatus': job_status['MedicalScribeJob']['MedicalScribeJobStatus'],
+        'inputFile': audio_file_uri,
+        'outputLocation': f"s3://{output_bucket}/"
+    }
+    if 'ChunkJobNames' in job_status['MedicalScribeJob']:
+        result['chunkJobs'] = job_status['MedicalScribeJob']['ChunkJobNames']
+        if job_status['MedicalScribeJob']['QueuedChunkJobNames']:
+            result['queuedChunkJobs'] = job_status['MedicalScribeJob']['QueuedChunkJobNames']
+    lambda_metrics.put('Submissions' if result['jobStatus'] != 'QUEUED' else 'Queued', 1, 'Count')
+    if result['jobStatus'] != 'QUEUED':
+        record_stage([result['jobName']], 'submitted')
+        upload_age = lambda_metrics.seconds_since(record.get('eventTime'))
+        if upload_age is not None:
+            lambda_metrics.put('UploadToSubmit', upload_age, 'Seconds')
+    return result
+
+def _process_record_safely(record, output_bucket, healthscribe):
+    """
+    Run process_record, turning an exception into an error result so one bad
+    record does not abort the rest of the batch.
+    """
+    try:
+        return process_record(record, output_bucket, healthscribe)
+    except Exception as e:
+        source = record.get('s3', {})
+        input_file = f"s3://{source.get('bucket', {}).get('name')}/{source.get('object', {}).get('key')}"
+        lambda_log.error("Error processing record", inputFile=input_file, error=str(e))
+        lambda_log.count('errors')
+        return {
+            'inputFile': input_file,
+            'error': str(e)
+        }
+
+def unwrap_records(records):
+    """
+    S3 event records of a Lambda event, paired with the SQS message that
+    carried them.
+
+    Records of a direct S3 invocation are returned as they are. SQS messages
+    have their body parsed as an S3 notification.
 
+    Args:
+        records (list): Records of the Lambda event
+
+    Returns:
+        tuple: (list of (SQS message ID or None, S3 record) pairs, list of
+            IDs of messages whose body is not an S3 notification)
+    """
+    pairs = []
+    unreadable = []
+    for record in records:
+        if 'messageId' not in record:
+            pairs.append((None, record))
+            continue
+        try:
+            body = json.loads(record['body'])
+        except (KeyError, TypeError, json.JSONDecodeError) as e:
+            lambda_log.error("Could not read SQS message", messageId=record['messageId'], error=str(e))
+            unreadable.append(record['messageId'])
+            continue
+        # s3:TestEvent messages carry no records and need no work
+        for s3_record in body.get('Records', []):
+            pairs.append((record['messageId'], s3_record))
+    return pairs, unreadable
+
+@lambda_metrics.emit_metrics
+@lambda_log.log_invocation
 def lambda_handler(event, context):
     """
     Lambda handler that processes S3 events and starts HealthScribe jobs.
+
+    Records are submitted in parallel on a bounded thread pool sharing one
+    Transcribe client. MAX_CONCURRENT_SUBMISSIONS sets the pool size.
+
+    The S3 events can also arrive through SQS. The response then lists the
+    messages with a failed record in batchItemFailures, so an event source
+    mapping with ReportBatchItemFailures redelivers only those.
     
     Args:
         event (dict): Lambda event containing S3 event data
@@ -85,72 +905,91 @@ def lambda_handler(event, context):
     Returns:
         dict: Response containing job status and details
     """
-    print("Received event:", json.dumps(event, indent=2))
+    lambda_log.info("Received event", records=len(event.get('Records', [])))
+    lambda_log.debug("Event payload", event=lambda: event)
+    message_ids = [record['messageId'] for record in event.get('Records', []) if 'messageId' in record]
     
     try:
         # Get the output bucket from environment variable
-        output_bucket = os.environ.get('OUTPUT_BUCKET_NAME')
+        settings = clients.get_settings()
+        output_bucket = settings['output_bucket']
         if not output_bucket:
             raise ValueError("OUTPUT_BUCKET_NAME environment variable is not set")
         
         results = []
+        records, failed_messages = unwrap_records(event['Records'])
+        max_workers = max(1, min(len(records), settings['max_concurrent_submissions']))
         
-        # Process each record in the S3 event
-        for record in event['Records']:
-            # Extract S3 bucket and key info
-            source_bucket = record['s3']['bucket']['name']
-            source_key = record['s3']['object']['key']
-            
-           # Skip processing if this is not an audio file
-            audio_extensions = ['.mp3', '.wav', '.flac', '.m4a', '.mp4', '.ogg']
-            if not any(source_key.lower().endswith(ext) for ext in audio_extensions):
-                print(f"Skipping non-audio file: {source_key}")
-                continue
-                
-            print(f"Processing file s3://{source_bucket}/{source_key}")
-            
-            # Create S3 URI for input file
-            audio_file_uri = f"s3://{source_bucket}/{source_key}"
-            
-            # Extract the prefix (everything before the last slash) for the output
-            key_parts = source_key.split('/')
-            if len(key_parts) > 1:
-                # If key has slashes, use everything before the last slash as prefix
-                output_prefix = '/'.join(key_parts[:-1]) 
-            else:
-                # If no slashes, use empty prefix
-                output_prefix = ""
-            
-            print(f"Using output prefix: {output_prefix}")
-            
-            # Start the HealthScribe job
-            job_status = start_healthscribe_job(
-                audio_file_uri=audio_file_uri,
-                output_bucket=output_bucket,
-                output_prefix=output_prefix
-            )
-            
-            results.append({
-                'jobName': job_status['MedicalScribeJob']['MedicalScribeJobName'],
-                'jobStatus': job_status['MedicalScribeJob']['MedicalScribeJobStatus'],
-                'inputFile': audio_file_uri,
-                'outputLocation': f"s3://{output_bucket}/"
-            })
+        # botocore clients are thread safe, so all workers share one
+        healthscribe = clients.get_client('transcribe')
+        
+        # Process the records of the S3 event in parallel, keeping their order
+        with lambda_log.timer('submit'), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for (message_id, _), result in zip(records, executor.map(
+                lambda pair: _process_record_safely(pair[1], output_bucket, healthscribe),
+                records
+            )):
+                if result is None:
+                    continue
+                results.append(result)
+                if 'error' in result and message_id is not None and message_id not in failed_messages:
+                    failed_messages.append(message_id)
+        
+        # A job queued with no job running, or throttled, has no completion to drain it
+        admission = admission_controller()
+        if admission is not None:
+            drain_backlog(admission, healthscribe)
+        
+        if settings['wait_for_completion']:
+            # One poller for every job of the batch instead of a loop per job
+            # Queued jobs do not exist in HealthScribe yet; the backlog drain submits them
+            submitted = [
+                result for result in results
+                if 'jobName' in result and 'reusedFrom' not in result and result['jobStatus'] != 'QUEUED'
+            ]
+            job_names = {}
+            for result in submitted:
+                job_names[result['jobName']] = [
+                    job_name for job_name in result.get('chunkJobs', [result['jobName']])
+                    if job_name not in result.get('queuedChunkJobs', [])
+                ]
+            with lambda_log.timer('wait'):
+                finished = wait_for_jobs(
+                    {job_name: None for names in job_names.values() for job_name in names}, healthscribe
+                )
+            for result in submitted:
+                statuses = [finished[job_name]['MedicalScribeJobStatus'] for job_name in job_names[result['jobName']]]
+                if 'queuedChunkJobs' in result or all(status == TIMED_OUT for status in statuses):
+                    continue
+                result['jobStatus'] = combined_status(statuses)
+        
+        clients.log_startup_report()
+        lambda_log.annotate(records=len(records), submitted=sum(1 for result in results if 'jobName' in result),
+                            failedMessages=len(failed_messages))
         
         # Return results for all processed records
-        return {
+        response = {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'HealthScribe processing initiated',
                 'results': results
             })
         }
+        if message_ids:
+            response['batchItemFailures'] = [{'itemIdentifier': message_id} for message_id in failed_messages]
+        return response
             
     except Exception as e:
-        print(f"Error processing request: {str(e)}")
-        return {
+        lambda_log.error("Error processing request", error=str(e))
+        response = {
             'statusCode': 500,
             'body': json.dumps({
                 'message': f'Error processing request: {str(e)}'
             })
-        }
\ No newline at end of file
+        }
+        if message_ids:
+            # Nothing can be vouched for: have SQS redeliver every message
+            response['batchItemFailures'] = [{'itemIdentifier': message_id} for message_id in message_ids]
+        return response
+
+clients.record_import_time(time.perf_counter() - _import_started)
@@ -0,0 +1,156 @@
+"""
+Idempotency ledger for S3 notifications.
+
+S3 delivers event notifications at least once, so the same upload can reach
+the input Lambda more than once. Every upload is claimed in the ledger under
+its bucket, key and ETag before any AWS call is made; a second claim for the
+same object is rejected with a single primary key insert.
+
+A claim is only marked done once the upload's job was submitted. A claim
+left unfinished by an invocation that timed out or crashed can be taken
+over once it is older than the claim timeout; until then a redelivery is
+refused with ClaimInProgress so it is retried rather than dropped.
+"""
+import hashlib
+import time
+
+from store import get_store
+
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS healthscribe_job_ledger (
+    ledger_key CHAR(64) NOT NULL PRIMARY KEY,
+    bucket VARCHAR(255) NOT NULL,
+    object_key VARCHAR(1024) NOT NULL,
+    etag VARCHAR(128) NOT NULL,
+    job_name VARCHAR(200) NOT NULL,
+    state VARCHAR(16) NOT NULL,
+    claimed_at DOUBLE NOT NULL
+)
+"""
+
+CLAIMED = 'claimed'
+DONE = 'done'
+
+
+class ClaimInProgress(Exception):
+    """
+    The upload is claimed by an invocation that may still be submitting it.
+    """
+
+
+def ledger_key(bucket, key, etag):
+    """
+    Fixed-size primary key for an uploaded object version.
+    """
+    return hashlib.sha256(f"{bucket}\0{key}\0{etag}".encode('utf-8')).hexdigest()
+
+
+class JobLedger:
+    """
+    Ledger of uploads that already have a HealthScribe job.
+
+    Args:
+        store (store.Store): Store holding the ledger table
+        claim_timeout_seconds (float): Age after which an unfinished claim
+            may be taken over
+        clock (callable): Wall clock in seconds
+    """
+
+    def __init__(self, store, claim_timeout_seconds=900, clock=time.time):
+        self.store = store
+        self.claim_timeout_seconds = claim_timeout_seconds
+        self.clock = clock
+        self.store.execute(CREATE_TABLE)
+
+    def claim(self, bucket, key, etag, job_name):
+        """
+        Claim an upload for submission.
+
+        Args:
+            bucket (str): Source bucket
+            key (str): Source object key
+            etag (str): ETag of the object from the S3 event
+            job_name (str): HealthScribe job the upload will be submitted as
+
+        Returns:
+            bool: True if the upload was claimed, False if it was already
+                submitted
+
+        Raises:
+            ClaimInProgress: If another claim on the upload is unfinished and
+                not yet past the claim timeout
+        """
+        now = self.clock()
+        try:
+            self.store.execute(
+                "INSERT INTO healthscribe_job_ledger "
+                "(ledger_key, bucket, object_key, etag, job_name, state, claimed_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (ledger_key(bucket, key, etag), bucket, key, etag, job_name, CLAIMED, now)
+            )
+            return True
+        except self.store.IntegrityError:
+            pass
+        # Take over a stale claim; the conditional UPDATE lets only one invocation win
+        _, rowcount = self.store.execute(
+            "UPDATE healthscribe_job_ledger SET job_name = %s, claimed_at = %s "
+            "WHERE ledger_key = %s AND state = %s AND claimed_at < %s",
+            (job_name, now, ledger_key(bucket, key, etag), CLAIMED, now - self.claim_timeout_seconds)
+        )
+        if rowcount == 1:
+            return True
+        rows, _ = self.store.execute(
+            "SELECT state FROM healthscribe_job_ledger WHERE ledger_key = %s",
+            (ledger_key(bucket, key, etag),)
+        )
+        if not rows:
+            # Released since the INSERT, after a failed submission: claim it afresh
+            return self.claim(bucket, key, etag, job_name)
+        if rows[0][0] == CLAIMED:
+            raise ClaimInProgress(f"s3://{bucket}/{key} is being submitted by another invocation")
+        return False
+
+    def complete(self, bucket, key, etag):
+        """
+        Mark a claim done once the upload's job was submitted; later
+        deliveries of the notification are then duplicates for good.
+        """
+        self.store.execute(
+            "UPDATE healthscribe_job_ledger SET state = %s WHERE ledger_key = %s",
+            (DONE, ledger_key(bucket, key, etag))
+        )
+
+    def release(self, bucket, key, etag):
+        """
+        Drop a claim, e.g. after the submission failed, so a redelivery of the
+        notification can try again.
+        """
+        self.store.execute(
+            "DELETE FROM healthscribe_job_ledger WHERE ledger_key = %s",
+            (ledger_key(bucket, key, etag),)
+        )
+
+
+_ledger = None
+
+
+def get_ledger(claim_timeout_seconds=900):
+    """
+    Return the ledger for this container.
+
+    Args:
+        claim_timeout_seconds (float): Age after which an unfinished claim
+            may be taken over
+
+    Returns:
+        JobLedger: The ledger, or None when no store is configured
+    """
+    global _ledger
+    store = get_store()
+    if store is None:
+        return None
+    if _ledger is None or _ledger.store is not store:
+        _ledger = JobLedger(store, claim_timeout_seconds)
+    _ledger.claim_timeout_seconds = claim_timeout_seconds
+    return _ledger
@@ -0,0 +1,180 @@
+"""
+Batched status polling for HealthScribe jobs.
+
+Instead of one GetMedicalScribeJob call per job per interval, JobPoller keeps
+every outstanding job in one place and refreshes them all with paginated
+ListMedicalScribeJobs calls filtered by terminal status. Polls are spaced
+with jittered exponential backoff, and each job has its own deadline.
+"""
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+import lambda_log
+
+
+# Statuses we list on each refresh; anything not found is still running
+POLLED_STATUSES = ['COMPLETED', 'FAILED']
+
+# Status reported for jobs that were still running when their deadline passed
+TIMED_OUT = 'TIMED_OUT'
+
+# Allowance for clock skew between our submit time and the job's CreationTime
+CREATION_TIME_SLACK = timedelta(minutes=5)
+
+THROTTLING_ERROR_CODES = ['ThrottlingException', 'LimitExceededException', 'TooManyRequestsException']
+
+
+class JobPoller:
+    """
+    Track outstanding HealthScribe jobs and wait for them to finish.
+
+    Args:
+        healthscribe (object): Transcribe client (or a stub with the same calls)
+        base_delay (float): Initial delay between refreshes in seconds
+        max_delay (float): Upper bound for the delay between refreshes
+        page_size (int): MaxResults for each ListMedicalScribeJobs page
+        sleep (callable): Sleep function, replaceable for simulations
+        clock (callable): Monotonic clock in seconds
+        rng (callable): Random number source in [0, 1) used for jitter
+    """
+
+    def __init__(self, healthscribe, base_delay=10, max_delay=60, page_size=100,
+                 sleep=time.sleep, clock=time.monotonic, rng=random.random):
+        self.healthscribe = healthscribe
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.page_size = page_size
+        self.sleep = sleep
+        self.clock = clock
+        self.rng = rng
+        self.attempt = 0
+        self.api_calls = 0
+        self.outstanding = {}
+        self.finished = {}
+
+    def track(self, job_name, max_wait_seconds=None, submitted_at=None):
+        """
+        Start tracking a job.
+
+        Args:
+            job_name (str): Name of the MedicalScribe job
+            max_wait_seconds (float): Stop waiting for the job after this long
+            submitted_at (datetime): When the job was submitted; listing pages
+                older than the oldest outstanding job are not fetched
+        """
+        deadline = None if max_wait_seconds is None else self.clock() + max_wait_seconds
+        self.outstanding[job_name] = {
+            'deadline': deadline,
+            'submitted_at': submitted_at or datetime.now(timezone.utc)
+        }
+
+    def refresh(self):
+        """
+        Refresh every outstanding job with one round of listing calls.
+
+        Returns:
+            list: Job summaries of the jobs that finished or timed out
+        """
+        newly_finished = []
+
+        if len(self.outstanding) == 1:
+            # A single job is looked up by name in one call, whatever its status
+            statuses = [None]
+        else:
+            statuses = POLLED_STATUSES
+
+        try:
+            for status in statuses:
+                if not self.outstanding:
+                    break
+                for summary in self._list_jobs(status):
+                    job_name = summary['MedicalScribeJobName']
+                    if job_name in self.outstanding and summary['MedicalScribeJobStatus'] in POLLED_STATUSES:
+                        del self.outstanding[job_name]
+                        self.finished[job_name] = summary
+                        newly_finished.append(summary)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                raise
+            lambda_log.warning("Throttled while polling job statuses, backing off", error=str(e))
+            self.attempt += 1
+
+        # Per-job stop condition
+        now = self.clock()
+        for job_name, job in list(self.outstanding.items()):
+            if job['deadline'] is not None and now >= job['deadline']:
+                del self.outstanding[job_name]
+                summary = {
+                    'MedicalScribeJobName': job_name,
+                    'MedicalScribeJobStatus': TIMED_OUT
+                }
+                self.finished[job_name] = summary
+                newly_finished.append(summary)
+
+        return newly_finished
+
+    def _list_jobs(self, status):
+        """
+        Yield job summaries with the given status (any status if None),
+        newest first, stopping once every outstanding job is found or the
+        pages predate all of them.
+        """
+        oldest_submitted = min(job['submitted_at'] for job in self.outstanding.values()) - CREATION_TIME_SLACK
+        request = {'MaxResults': self.page_size}
+        if status is not None:
+            request['Status'] = status
+        if len(self.outstanding) == 1:
+            request['JobNameContains'] = next(iter(self.outstanding))
+
+        while True:
+            self.api_calls += 1
+            page = self.healthscribe.list_medical_scribe_jobs(**request)
+            summaries = page.get('MedicalScribeJobSummaries', [])
+            for summary in summaries:
+                yield summary
+                if not self.outstanding:
+                    return
+
+            next_token = page.get('NextToken')
+            if not next_token or not summaries:
+                return
+            creation_time = summaries[-1].get('CreationTime')
+            if creation_time is not None and creation_time < oldest_submitted:
+                return
+            request['NextToken'] = next_token
+
+    def next_delay(self):
+        """
+        Delay before the next refresh: exponential backoff with random jitter,
+        never sleeping past the earliest job deadline.
+        """
+        ceiling = min(self.max_delay, self.base_delay * (2 ** self.attempt))
+        delay = self.base_delay + self.rng() * max(0, ceiling - self.base_delay)
+
+        deadlines = [job['deadline'] for job in self.outstanding.values() if job['deadline'] is not None]
+        if deadlines:
+            delay = min(delay, max(0, min(deadlines) - self.clock()))
+        return delay
+
+    def wait(self, on_finished=None):
+        """
+        Refresh until no job is outstanding.
+
+        Args:
+            on_finished (callable): Called with each job summary as it finishes
+
+        Returns:
+            dict: Final job summaries keyed by job name
+        """
+        while self.outstanding:
+            for summary in self.refresh():
+                if on_finished is not None:
+                    on_finished(summary)
+            if not self.outstanding:
+                break
+            self.sleep(self.next_delay())
+            self.attempt += 1
+        return self.finished
@@ -0,0 +1,260 @@
+"""
+Silence trimming of WAV uploads before they are sent to HealthScribe.
+
+HealthScribe time and cost scale with the length of the audio, and clinic
+recordings often start and end with minutes of an empty room. When the
+stage is enabled, leading and trailing silence is cut off and a compact
+16-bit, 16 kHz WAV derivative is submitted instead of the upload. The
+channel count is kept, so the clinician/patient channel layout still
+matches the job's ChannelDefinitions.
+
+The upload is streamed twice (once to find the speech, once to write the
+derivative), a block at a time, so memory stays bounded for hour-long
+recordings. The number of seconds cut from the start is written to a
+manifest next to the derivative, and the times in the job's transcript.json
+are moved back onto the original recording once the job completes.
+
+Only PCM WAV can be read without a decoder; other formats are submitted
+unchanged. Sample conversion uses the standard library's audioop module,
+which the python3.9 runtime ships; without it the stage is skipped.
+"""
+import json
+import os
+import tempfile
+import wave
+
+try:
+    import audioop
+except ImportError:  # removed from the standard library in Python 3.13
+    audioop = None
+
+from chunking import BodyStream, rebase_items
+from transcript_columns import ItemColumns
+
+
+# Folder, below the upload's prefix, where derivatives and their manifest live
+PREPROCESSED_DIR = '_preprocessed'
+
+# Sample rate of the derivative; recordings at a lower rate keep theirs
+TARGET_SAMPLE_RATE = 16000
+
+WINDOW_SECONDS = 0.1
+
+# Speech needs this many loud windows in a row, so a cough or a door does not count
+MIN_SPEECH_WINDOWS = 3
+
+# Audio kept on either side of the speech
+PADDING_SECONDS = 0.5
+
+BLOCK_FRAMES = 65536
+
+
+def _to_16_bit(frames, sample_width):
+    if sample_width == 2:
+        return frames
+    if sample_width == 1:
+        # 8-bit WAV samples are unsigned
+        frames = audioop.bias(frames, 1, -128)
+    return audioop.lin2lin(frames, sample_width, 2)
+
+
+def window_levels(wav_file, window_seconds=WINDOW_SECONDS):
+    """
+    RMS level of consecutive windows of a WAV file, across all channels.
+
+    Args:
+        wav_file (wave.Wave_read): Open PCM WAV file, positioned at the start
+        window_seconds (float): Window length
+
+    Returns:
+        list: One RMS value per window, on the 16-bit scale
+    """
+    frames_per_window = max(1, int(wav_file.getframerate() * window_seconds))
+    levels = []
+    while True:
+        frames = wav_file.readframes(frames_per_window)
+        if not frames:
+            break
+        levels.append(audioop.rms(_to_16_bit(frames, wav_file.getsampwidth()), 2))
+    return levels
+
+
+def speech_bounds(levels, window_seconds, threshold_dbfs, padding_seconds=PADDING_SECONDS,
+                  min_speech_windows=MIN_SPEECH_WINDOWS):
+    """
+    Start and end of the audio worth keeping.
+
+    A window is loud when its level is above `threshold_dbfs` and above
+    twice the room's noise floor, taken as the 1st percentile level so a
+    few digital dropouts do not pull it to zero. Steady background hum is
+    thus treated as silence.
+
+    Returns:
+        tuple: (start, end) in seconds, or None if no speech was found
+    """
+    if not levels:
+        return None
+    noise_floor = sorted(levels)[len(levels) // 100]
+    threshold = max(32768 * 10 ** (threshold_dbfs / 20), 2 * noise_floor)
+
+    loud = [level > threshold for level in levels]
+    first = last = None
+    run = 0
+    for index, is_loud in enumerate(loud):
+        run = run + 1 if is_loud else 0
+        if run == min_speech_windows:
+            first = index - min_speech_windows + 1
+            break
+    run = 0
+    for index in range(len(loud) - 1, -1, -1):
+        run = run + 1 if loud[index] else 0
+        if run == min_speech_windows:
+            last = index + min_speech_windows - 1
+            break
+    if first is None:
+        return None
+
+    duration = len(levels) * window_seconds
+    return (max(0.0, first * window_seconds - padding_seconds),
+            min(duration, (last + 1) * window_seconds + padding_seconds))
+
+
+def write_derivative(wav_file, start, end, path, target_rate=TARGET_SAMPLE_RATE, block_frames=BLOCK_FRAMES):
+    """
+    Write the frames between `start` and `end` as 16-bit PCM, resampled down
+    to `target_rate`, a block at a time.
+
+    Args:
+        wav_file (wave.Wave_read): Open PCM WAV file, positioned at the start
+        start (float): First second to keep
+        end (float): Second to stop at
+        path (str): Output file
+
+    Returns:
+        int: Sample rate of the derivative
+    """
+    rate = wav_file.getframerate()
+    channels = wav_file.getnchannels()
+    width = wav_file.getsampwidth()
+    out_rate = min(rate, target_rate)
+
+    # The stream can only be read forwards, so skip to the start by reading
+    skip = int(start * rate)
+    while skip > 0:
+        skipped = len(wav_file.readframes(min(block_frames, skip))) // (width * channels)
+        if not skipped:
+            break
+        skip -= skipped
+
+    remaining = int(end * rate) - int(start * rate)
+    state = None
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(channels)
+        out.setsampwidth(2)
+        out.setframerate(out_rate)
+        while remaining > 0:
+            frames = wav_file.readframes(min(block_frames, remaining))
+            if not frames:
+                break
+            remaining -= len(frames) // (width * channels)
+            frames = _to_16_bit(frames, width)
+            if out_rate != rate:
+                frames, state = audioop.ratecv(frames, 2, channels, rate, out_rate, state)
+            out.writeframes(frames)
+    return out_rate
+
+
+def derivative_key(key):
+    prefix = key.rsplit('/', 1)[0] if '/' in key else ''
+    name = os.path.splitext(key.rsplit('/', 1)[-1])[0]
+    folder = f"{prefix}/{PREPROCESSED_DIR}" if prefix else PREPROCESSED_DIR
+    return f"{folder}/{name}.wav"
+
+
+def manifest_key(prefix):
+    return f"{prefix}/{PREPROCESSED_DIR}/manifest.json" if prefix else f"{PREPROCESSED_DIR}/manifest.json"
+
+
+def _open(s3, bucket, key):
+    return wave.open(BodyStream(s3.get_object(Bucket=bucket, Key=key)['Body']), 'rb')
+
+
+def trim_wav_object(s3, bucket, key, threshold_dbfs=-45.0, min_trim_seconds=5.0):
+    """
+    Write a trimmed derivative of a WAV upload next to it.
+
+    The derivative goes to `<prefix>/_preprocessed/<name>.wav` in the same
+    bucket, with a manifest recording where it starts in the original.
+
+    Args:
+        s3 (object): S3 client
+        bucket (str): Bucket of the upload
+        key (str): Key of the upload
+        threshold_dbfs (float): Level below which audio counts as silence
+        min_trim_seconds (float): Smallest saving worth a derivative
+
+    Returns:
+        dict: Manifest with the derivative's key, offsetSeconds and
+            durations, or None if the upload is submitted as it is (not PCM
+            WAV, no speech found, or too little to trim)
+    """
+    if audioop is None:
+        return None
+    try:
+        with _open(s3, bucket, key) as wav_file:
+            if wav_file.getcomptype() != 'NONE':
+                return None
+            levels = window_levels(wav_file)
+            rate = wav_file.getframerate()
+    except (wave.Error, EOFError):
+        return None
+
+    duration = len(levels) * WINDOW_SECONDS
+    bounds = speech_bounds(levels, WINDOW_SECONDS, threshold_dbfs)
+    if bounds is None:
+        return None
+    start, end = bounds
+    if duration - (end - start) < min_trim_seconds and rate <= TARGET_SAMPLE_RATE:
+        return None
+
+    manifest = {
+        'source': key,
+        'key': derivative_key(key),
+        'offsetSeconds': round(start, 3),
+        'durationSeconds': round(end - start, 3),
+        'originalSeconds': round(duration, 3)
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'trimmed.wav')
+        with _open(s3, bucket, key) as wav_file:
+            manifest['sampleRate'] = write_derivative(wav_file, start, end, path)
+            manifest['channels'] = wav_file.getnchannels()
+        s3.upload_file(path, bucket, manifest['key'])
+
+    prefix = key.rsplit('/', 1)[0] if '/' in key else ''
+    s3.put_object(Bucket=bucket, Key=manifest_key(prefix), Body=json.dumps(manifest))
+    return manifest
+
+
+def restore_times(transcript, offset):
+    """
+    Move the times of a transcript made from a derivative back onto the
+    original recording.
+
+    Args:
+        transcript (dict): transcript.json document; its TranscriptItems may
+            be ItemColumns, as read by chunking.read_transcript
+        offset (float): offsetSeconds from the derivative's manifest
+
+    Returns:
+        dict: The document with shifted segment and item times
+    """
+    conversation = dict(transcript['Conversation'])
+    if 'TranscriptSegments' in conversation:
+        conversation['TranscriptSegments'] = rebase_items(conversation['TranscriptSegments'], offset)
+    items = conversation.get('TranscriptItems')
+    if isinstance(items, ItemColumns):
+        conversation['TranscriptItems'] = items.rebased(offset)
+    elif items is not None:
+        conversation['TranscriptItems'] = rebase_items(items, offset)
+    return dict(transcript, Conversation=conversation)
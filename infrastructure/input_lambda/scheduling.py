@@ -0,0 +1,135 @@
+"""
+Priority scheduling of queued HealthScribe submissions.
+
+When the concurrent job quota is used up, submissions wait in the admission
+backlog. Instead of draining it first-come-first-served, the next job is
+chosen by visit urgency:
+
+    1. lowest effective priority rank, where a job gains one rank for every
+       `aging_seconds` it has waited so routine visits cannot starve
+    2. the doctor with the fewest running jobs, so one doctor uploading a
+       day's worth of visits does not hold up everyone else
+    3. the job that has waited longest
+
+The priority of an upload is taken from its `priority` object metadata, or
+derived from the purpose of its row in the Visits table.
+"""
+import re
+
+import lambda_log
+
+
+# Priority classes, most urgent first; the index is the rank
+PRIORITY_CLASSES = ['urgent', 'standard', 'routine']
+
+DEFAULT_PRIORITY = 'standard'
+
+# Words in Visits.purpose that mark a visit as urgent or routine
+URGENT_KEYWORDS = ['urgent', 'emergency', 'acute', 'severe', 'stat', 'asap']
+ROUTINE_KEYWORDS = ['follow-up', 'follow up', 'followup', 'routine', 'check-up', 'checkup',
+                    'annual', 'refill', 'review']
+
+
+def priority_rank(priority):
+    """
+    Rank of a priority class; unknown classes rank as the default.
+    """
+    if priority in PRIORITY_CLASSES:
+        return PRIORITY_CLASSES.index(priority)
+    return PRIORITY_CLASSES.index(DEFAULT_PRIORITY)
+
+
+def classify_purpose(purpose):
+    """
+    Priority class of a visit from its free-text purpose.
+
+    Args:
+        purpose (str): Visits.purpose as entered by the doctor
+
+    Returns:
+        str: One of PRIORITY_CLASSES
+    """
+    text = (purpose or '').lower()
+    # Whole words only, so 'stat' does not match 'status'
+    if set(re.findall(r'[a-z]+', text)) & set(URGENT_KEYWORDS):
+        return 'urgent'
+    if any(keyword in text for keyword in ROUTINE_KEYWORDS):
+        return 'routine'
+    return DEFAULT_PRIORITY
+
+
+def resolve_priority(s3, bucket, key, job_name, store=None):
+    """
+    Work out the priority class and doctor of an upload.
+
+    Object metadata set by the uploader wins (`priority`, `doctor-id`). When
+    it is missing, the visit is looked up in the Visits table by its
+    uniqueID, which is the upload's folder and so the job name. The visit row
+    is written after the upload, so it may not exist yet; the default class
+    is used then.
+
+    Args:
+        s3 (object): S3 client
+        bucket (str): Bucket of the upload
+        key (str): Key of the upload
+        job_name (str): HealthScribe job name of the upload
+        store (store.Store): Application database, if configured
+
+    Returns:
+        tuple: (priority class, doctor id or None)
+    """
+    metadata = s3.head_object(Bucket=bucket, Key=key).get('Metadata', {})
+    priority = metadata.get('priority', '').lower() or None
+    doctor_id = metadata.get('doctor-id')
+
+    if (priority is None or doctor_id is None) and store is not None and store.dialect == 'mysql':
+        try:
+            rows, _ = store.execute("SELECT purpose, doctorID FROM Visits WHERE uniqueID = %s", (job_name,))
+        except Exception as e:
+            lambda_log.warning("Could not look up visit", jobName=job_name, error=str(e))
+            rows = []
+        if rows:
+            purpose, visit_doctor_id = rows[0]
+            if priority is None:
+                priority = classify_purpose(purpose)
+            if doctor_id is None:
+                doctor_id = visit_doctor_id
+
+    if priority not in PRIORITY_CLASSES:
+        priority = DEFAULT_PRIORITY
+    return priority, doctor_id
+
+
+def effective_rank(priority, waited_seconds, aging_seconds):
+    """
+    Priority rank after aging: one rank better for every `aging_seconds`
+    waited, without a floor, so a job that waited long enough goes ahead of
+    fresh urgent ones. An aging period of 0 turns aging off.
+    """
+    rank = priority_rank(priority)
+    if aging_seconds > 0:
+        rank -= int(waited_seconds // aging_seconds)
+    return rank
+
+
+def pick_next(backlog, running_by_doctor, now, aging_seconds):
+    """
+    Choose the queued job to submit next.
+
+    Args:
+        backlog (list): (job name, priority class, doctor id, enqueued at)
+            tuples of the queued jobs
+        running_by_doctor (dict): Number of running jobs keyed by doctor id
+        now (float): Current time in seconds
+        aging_seconds (float): Wait after which a job moves up one class
+
+    Returns:
+        tuple: The chosen backlog entry, or None if the backlog is empty
+    """
+    if not backlog:
+        return None
+    return min(backlog, key=lambda entry: (
+        effective_rank(entry[1], now - entry[3], aging_seconds),
+        running_by_doctor.get(entry[2], 0),
+        entry[3]
+    ))
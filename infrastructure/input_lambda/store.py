@@ -0,0 +1,155 @@
+"""
+Persistent store for the input Lambda's bookkeeping tables.
+
+The store is selected with the STATE_STORE environment variable:
+
+    mysql               the application database, using the same db_string,
+                        db_user, db_password and db_name variables as the
+                        output Lambda; pymysql comes from the shared layer
+    sqlite:<path>       a local SQLite file, for local runs
+    (unset)             no store; features that need one are disabled
+
+SQL is written with pymysql's %s placeholders and translated for SQLite.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+# Idle time after which a warm MySQL connection is pinged before it is used
+PING_AFTER_IDLE_SECONDS = float(os.environ.get('DB_PING_AFTER_IDLE_SECONDS', '30'))
+
+
+class Store:
+    """
+    Thin wrapper around a DB-API connection shared by the worker threads.
+
+    Args:
+        connection (object): pymysql or sqlite3 connection
+        dialect (str): 'mysql' or 'sqlite'
+        integrity_error (type): Exception raised on unique key violations
+    """
+
+    def __init__(self, connection, dialect, integrity_error):
+        self.connection = connection
+        self.dialect = dialect
+        self.IntegrityError = integrity_error
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+
+    def _sql(self, sql):
+        return sql.replace('%s', '?') if self.dialect == 'sqlite' else sql
+
+    def execute(self, sql, params=(), commit=True):
+        """
+        Run one statement.
+
+        Args:
+            sql (str): Statement with %s placeholders
+            params (tuple): Statement parameters
+            commit (bool): Commit straight after the statement
+
+        Returns:
+            tuple: (rows fetched, affected row count)
+        """
+        with self.lock:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(self._sql(sql), params)
+                rows = cursor.fetchall() if cursor.description else []
+                rowcount = cursor.rowcount
+            except Exception:
+                self.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+            if commit:
+                self.connection.commit()
+            self.last_used = time.monotonic()
+            return rows, rowcount
+
+    def ping_if_idle(self, idle_seconds):
+        """
+        Check a MySQL connection that sat idle longer than `idle_seconds`,
+        reconnecting if the server dropped it. Within a busy invocation the
+        connection is used without the extra round trip.
+        """
+        if self.dialect != 'mysql' or time.monotonic() - self.last_used <= idle_seconds:
+            return
+        with self.lock:
+            if time.monotonic() - self.last_used > idle_seconds:
+                self.connection.ping(reconnect=True)
+                self.last_used = time.monotonic()
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def connect(store_url):
+    """
+    Open a store from a STATE_STORE style URL.
+
+    Args:
+        store_url (str): 'mysql' or 'sqlite:<path>'
+
+    Returns:
+        Store: Connected store
+    """
+    if store_url == 'mysql':
+        import pymysql
+
+        connection = pymysql.connect(
+            host=os.environ['db_string'],
+            port=3306,
+            user=os.environ['db_user'],
+            password=os.environ['db_password'],
+            database=os.environ['db_name'],
+        )
+        return Store(connection, 'mysql', pymysql.err.IntegrityError)
+
+    if store_url.startswith('sqlite:'):
+        connection = sqlite3.connect(store_url[len('sqlite:'):], check_same_thread=False)
+        return Store(connection, 'sqlite', sqlite3.IntegrityError)
+
+    raise ValueError(f"Unsupported STATE_STORE: {store_url}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Return the store for this container, connecting on first use.
+
+    A warm connection idle for longer than PING_AFTER_IDLE_SECONDS is pinged
+    first. The ping holds only the store's own lock, so other threads are
+    not kept from getting the store meanwhile.
+
+    Returns:
+        Store: The configured store, or None when STATE_STORE is unset
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            store_url = os.environ.get('STATE_STORE')
+            if not store_url:
+                return None
+            _store = connect(store_url)
+        store = _store
+    store.ping_if_idle(PING_AFTER_IDLE_SECONDS)
+    return store
+
+
+def set_store(store):
+    """
+    Use the given store instead of the one configured by STATE_STORE.
+    """
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,53 @@
+"""
+Puts the input Lambda modules and the shared layer on the import path, as
+the Lambda runtime does, so the tests run from any directory:
+
+    python -m pytest infrastructure/input_lambda/tests
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+INPUT_LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED_LAYER_DIR = os.path.join(os.path.dirname(INPUT_LAMBDA_DIR), 'shared_layer', 'python')
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(INPUT_LAMBDA_DIR)), 'demo response')
+
+for path in (SHARED_LAYER_DIR, INPUT_LAMBDA_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import clients  # noqa: E402
+import store  # noqa: E402
+from fakes import FakeS3Client, FakeTranscribeClient  # noqa: E402
+
+
+@pytest.fixture
+def demo_dir():
+    """
+    Folder holding the demo HealthScribe outputs (summary.json, transcript.json).
+    """
+    return DEMO_DIR
+
+
+@pytest.fixture
+def fake_aws(monkeypatch):
+    """
+    FakeTranscribeClient and FakeS3Client registered in place of the boto3
+    clients, with no state store and the settings read afresh from the
+    environment on first use.
+    """
+    for name in ('STATE_STORE', 'HEALTHSCRIBE_MAX_CONCURRENT_JOBS', 'SILENCE_TRIM', 'CHUNKING_ENABLED'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('OUTPUT_BUCKET_NAME', 'output')
+    monkeypatch.setenv('HEALTHSCRIBE_ROLE_ARN', 'arn:aws:iam::123456789012:role/healthscribe')
+    monkeypatch.setenv('METRICS_SINK', 'off')
+    clients.reset()
+    store.set_store(None)
+    aws = SimpleNamespace(transcribe=FakeTranscribeClient(), s3=FakeS3Client())
+    clients.register_client('transcribe', aws.transcribe)
+    clients.register_client('s3', aws.s3)
+    yield aws
+    clients.reset()
+    store.set_store(None)
@@ -0,0 +1,190 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+import store
+from admission import AdmissionController
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    connected = store.connect(f"sqlite:{tmp_path / 'state.db'}")
+    yield connected
+    connected.close()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def admission(sqlite_store, clock):
+    return AdmissionController(sqlite_store, quota=2, aging_seconds=600, job_timeout_seconds=3600, clock=clock)
+
+
+def request(job_name):
+    return {'MedicalScribeJobName': job_name, 'Media': {'MediaFileUri': f"s3://input/{job_name}/a.wav"}}
+
+
+def running(sqlite_store):
+    rows, _ = sqlite_store.execute("SELECT running FROM healthscribe_admission_budget WHERE id = 1")
+    jobs, _ = sqlite_store.execute("SELECT job_name FROM healthscribe_admission_running ORDER BY job_name")
+    return rows[0][0], [job_name for job_name, in jobs]
+
+
+def backlog(sqlite_store):
+    rows, _ = sqlite_store.execute("SELECT job_name FROM healthscribe_admission_backlog ORDER BY job_name")
+    return [job_name for job_name, in rows]
+
+
+def throttled(request):
+    raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'StartMedicalScribeJob')
+
+
+def test_jobs_beyond_the_quota_are_queued(admission, sqlite_store):
+    assert admission.admit('visit-1', request('visit-1'))
+    assert admission.admit('visit-2', request('visit-2'))
+
+    assert not admission.admit('visit-3', request('visit-3'))
+
+    assert running(sqlite_store) == (2, ['visit-1', 'visit-2'])
+    assert backlog(sqlite_store) == ['visit-3']
+
+
+def test_quota_is_shared_by_controllers_on_the_same_store(admission, sqlite_store, clock):
+    other = AdmissionController(sqlite_store, quota=2, clock=clock)
+    admission.admit('visit-1', request('visit-1'))
+    other.admit('visit-2', request('visit-2'))
+
+    assert not other.admit('visit-3', request('visit-3'))
+    assert not admission.admit('visit-4', request('visit-4'))
+
+
+def test_job_already_holding_a_slot_is_queued_not_admitted_twice(admission, sqlite_store):
+    assert admission.admit('visit-1', request('visit-1'))
+
+    assert not admission.admit('visit-1', request('visit-1'))
+
+    # The second slot was handed back
+    assert running(sqlite_store) == (1, ['visit-1'])
+    assert backlog(sqlite_store) == ['visit-1']
+
+
+def test_release_frees_one_slot_however_often_it_is_called(admission, sqlite_store):
+    admission.admit('visit-1', request('visit-1'))
+    admission.admit('visit-2', request('visit-2'))
+
+    assert admission.release('visit-1')
+    assert not admission.release('visit-1')
+
+    assert running(sqlite_store) == (1, ['visit-2'])
+
+
+def test_drain_submits_queued_jobs_in_priority_order_as_slots_free_up(admission, sqlite_store, clock):
+    admission.admit('visit-1', request('visit-1'))
+    admission.admit('visit-2', request('visit-2'))
+    admission.admit('visit-3', request('visit-3'), priority='routine')
+    clock.now += 1
+    admission.admit('visit-4', request('visit-4'), priority='standard')
+    clock.now += 1
+    admission.admit('visit-5', request('visit-5'), priority='urgent')
+    submitted = []
+
+    # No slot free yet
+    assert admission.drain(submitted.append) == []
+
+    admission.release('visit-1')
+    assert admission.drain(submitted.append) == ['visit-5']
+    admission.release('visit-2')
+    admission.release('visit-5')
+    assert admission.drain(submitted.append) == ['visit-4', 'visit-3']
+
+    assert submitted == [request('visit-5'), request('visit-4'), request('visit-3')]
+    assert running(sqlite_store) == (2, ['visit-3', 'visit-4'])
+    assert backlog(sqlite_store) == []
+
+
+def test_drain_keeps_a_throttled_job_queued_with_its_queue_time(admission, sqlite_store, clock):
+    admission.admit('visit-1', request('visit-1'))
+    admission.admit('visit-2', request('visit-2'))
+    admission.admit('visit-3', request('visit-3'))
+    admission.release('visit-1')
+    clock.now += 120
+
+    assert admission.drain(throttled) == []
+
+    assert running(sqlite_store) == (1, ['visit-2'])
+    rows, _ = sqlite_store.execute("SELECT job_name, request, enqueued_at FROM healthscribe_admission_backlog")
+    assert [(job_name, json.loads(queued), enqueued_at) for job_name, queued, enqueued_at in rows] == [
+        ('visit-3', request('visit-3'), 1000.0)
+    ]
+
+
+def test_drain_drops_rejected_jobs_and_carries_on(admission, sqlite_store, clock):
+    admission.admit('visit-1', request('visit-1'))
+    admission.admit('visit-2', request('visit-2'))
+    admission.admit('visit-3', request('visit-3'))
+    clock.now += 1
+    admission.admit('visit-4', request('visit-4'))
+    admission.release('visit-1')
+    admission.release('visit-2')
+
+    def submit(queued):
+        if queued['MedicalScribeJobName'] == 'visit-3':
+            raise ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Bad media'}},
+                              'StartMedicalScribeJob')
+
+    assert admission.drain(submit) == ['visit-4']
+
+    assert running(sqlite_store) == (1, ['visit-4'])
+    assert backlog(sqlite_store) == []
+
+
+def test_drain_drops_a_queued_job_that_already_holds_a_slot(admission, sqlite_store):
+    admission.admit('visit-1', request('visit-1'))
+    admission.admit('visit-1', request('visit-1'))
+    submitted = []
+
+    assert admission.drain(submitted.append) == []
+
+    assert submitted == []
+    assert running(sqlite_store) == (1, ['visit-1'])
+    assert backlog(sqlite_store) == []
+
+
+def test_slots_past_the_job_timeout_are_expired_before_draining(admission, sqlite_store, clock):
+    admission.admit('visit-1', request('visit-1'))
+    clock.now += 1800
+    admission.admit('visit-2', request('visit-2'))
+    admission.admit('visit-3', request('visit-3'))
+    clock.now += 1801
+
+    assert admission.drain(lambda queued: None) == ['visit-3']
+
+    # visit-1's completion never arrived; visit-2 is within the timeout
+    assert running(sqlite_store) == (2, ['visit-2', 'visit-3'])
+    assert not admission.release('visit-1')
+
+
+def test_metrics_report_running_jobs_and_backlog(admission, clock):
+    admission.admit('visit-1', request('visit-1'))
+    admission.admit('visit-2', request('visit-2'))
+    admission.admit('visit-3', request('visit-3'), priority='urgent')
+    clock.now += 30
+
+    metrics = admission.metrics()
+
+    assert metrics['running'] == 2
+    assert metrics['queueDepth'] == 1
+    assert metrics['queueDepthByPriority'] == {'urgent': 1, 'standard': 0, 'routine': 0}
+    assert metrics['oldestQueuedSeconds'] == 30
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+import backfill
+import store
+from backfill import RateLimiter, submit_key
+
+
+@pytest.fixture
+def aws(fake_aws, monkeypatch):
+    """
+    Fake AWS with a SQLite ledger and the pre-flight checks turned off.
+    """
+    monkeypatch.setenv('AUDIO_PREFLIGHT', 'false')
+    monkeypatch.setenv('CONTENT_DEDUPE', 'false')
+    store.set_store(store.connect('sqlite::memory:'))
+    for visit in ('visit-1', 'visit-2'):
+        fake_aws.s3.put_object(Bucket='input', Key=f"{visit}/recording.wav", Body=visit.encode('utf-8'))
+    return fake_aws
+
+
+def run(objects, **kwargs):
+    return backfill.backfill(objects, 'output', workers=2, rate=0, report_every=0, **kwargs)
+
+
+def read_progress(path):
+    with open(path) as progress:
+        return [json.loads(line) for line in progress]
+
+
+def test_failed_job_is_only_resubmitted_with_resubmit(aws, tmp_path):
+    objects = [('input', 'visit-1/recording.wav', None)]
+    assert run(objects)['outcomes'] == {'resumed': 0, 'submitted': 1}
+    aws.transcribe.finish_job('visit-1', 'FAILED', 'Service outage')
+
+    # The ledger has the upload, so a plain rerun reports it as a duplicate
+    progress = tmp_path / 'progress.jsonl'
+    assert run(objects, progress_path=str(progress))['outcomes'] == {'resumed': 0, 'skipped': 1}
+    assert read_progress(progress)[-1]['reason'] == 'Duplicate S3 notification'
+
+    report = run(objects, progress_path=str(progress), resubmit=True)
+
+    assert report['outcomes'] == {'resumed': 0, 'submitted': 1}
+    assert read_progress(progress)[-1] == {'bucket': 'input', 'key': 'visit-1/recording.wav',
+                                           'outcome': 'submitted', 'jobName': 'visit-1'}
+    assert aws.transcribe.calls['DeleteMedicalScribeJob'] == 1
+    assert aws.transcribe.jobs['visit-1']['MedicalScribeJobStatus'] == 'IN_PROGRESS'
+
+
+def test_resubmit_skips_jobs_that_did_not_fail(aws):
+    objects = [('input', 'visit-1/recording.wav', None), ('input', 'visit-2/recording.wav', None)]
+    run(objects)
+    aws.transcribe.finish_job('visit-1')
+
+    entries = [submit_key(bucket, key, etag, 'output', RateLimiter(0), resubmit=True)
+               for bucket, key, etag in objects]
+
+    assert [(entry['outcome'], entry['reason']) for entry in entries] == [
+        ('skipped', 'Job already exists (COMPLETED)'), ('skipped', 'Job already exists (IN_PROGRESS)')
+    ]
+    assert 'DeleteMedicalScribeJob' not in aws.transcribe.calls
+
+
+def test_conflict_with_a_failed_job_is_a_failure_not_a_skip(aws):
+    store.set_store(None)
+    for visit, status in (('visit-1', 'FAILED'), ('visit-2', 'COMPLETED')):
+        aws.transcribe.start_medical_scribe_job(MedicalScribeJobName=visit,
+                                                Media={'MediaFileUri': f"s3://input/{visit}/recording.wav"},
+                                                OutputBucketName='output', DataAccessRoleArn='role', Settings={})
+        aws.transcribe.finish_job(visit, status)
+
+    failed = submit_key('input', 'visit-1/recording.wav', None, 'output', RateLimiter(0))
+    completed = submit_key('input', 'visit-2/recording.wav', None, 'output', RateLimiter(0))
+
+    assert failed['outcome'] == 'failed'
+    assert 'rerun with --resubmit' in failed['reason']
+    assert (completed['outcome'], completed['reason']) == ('skipped', 'Job already exists (COMPLETED)')
+
+
+def test_rerun_resumes_after_the_keys_already_done(aws, tmp_path):
+    progress, failures = tmp_path / 'progress.jsonl', tmp_path / 'failures.tsv'
+    objects = [('input', 'visit-1/recording.wav', None), ('input', 'visit-3/recording.wav', None)]
+
+    first = run(objects, progress_path=str(progress), failures_path=str(failures))
+
+    # visit-3 was never uploaded, so its key fails
+    assert first['outcomes'] == {'resumed': 0, 'submitted': 1, 'failed': 1}
+    assert failures.read_text().startswith('s3://input/visit-3/recording.wav\tfailed\t')
+
+    aws.s3.put_object(Bucket='input', Key='visit-3/recording.wav', Body=b'visit-3')
+    second = run(objects, progress_path=str(progress))
+
+    assert second['outcomes'] == {'resumed': 1, 'submitted': 1}
+    assert aws.transcribe.calls['StartMedicalScribeJob'] == 2
+    assert sorted(aws.transcribe.jobs) == ['visit-1', 'visit-3']
+
+
+def test_throttled_submission_is_retried_with_backoff(aws):
+    start_job = aws.transcribe.start_medical_scribe_job
+    attempts = []
+
+    def throttled_twice(**request):
+        attempts.append(request['MedicalScribeJobName'])
+        if len(attempts) <= 2:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                              'StartMedicalScribeJob')
+        return start_job(**request)
+
+    aws.transcribe.start_medical_scribe_job = throttled_twice
+    sleeps = []
+
+    entry = submit_key('input', 'visit-1/recording.wav', None, 'output', RateLimiter(0), sleep=sleeps.append)
+
+    assert entry == {'bucket': 'input', 'key': 'visit-1/recording.wav', 'outcome': 'submitted', 'jobName': 'visit-1'}
+    assert attempts == ['visit-1'] * 3
+    assert len(sleeps) == 2 and 1 <= sleeps[0] <= 2 and 2 <= sleeps[1] <= 4
+
+
+def test_submission_throttled_past_the_attempt_limit_fails(aws):
+    def throttled(**request):
+        raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                          'StartMedicalScribeJob')
+
+    aws.transcribe.start_medical_scribe_job = throttled
+    sleeps = []
+
+    entry = submit_key('input', 'visit-1/recording.wav', None, 'output', RateLimiter(0), max_attempts=3,
+                       sleep=sleeps.append)
+
+    assert entry['outcome'] == 'failed'
+    assert len(sleeps) == 2
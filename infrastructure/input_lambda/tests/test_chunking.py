@@ -0,0 +1,289 @@
+import io
+import json
+import os
+import struct
+import wave
+from array import array
+
+import pytest
+
+from chunking import (merge_summaries, merge_transcripts, read_transcript, rebase_items, split_wav_object,
+                      write_transcript)
+from fakes import FakeS3Client
+
+# Two chunks of the demo visit, overlapping between 290 s and 310 s and cut
+# at 300 s: each part of the overlap is kept from one chunk only
+CHUNKS = [
+    {'index': 0, 'start': 0.0, 'end': 310.0, 'keepStart': 0.0, 'keepEnd': 300.0},
+    {'index': 1, 'start': 290.0, 'end': 600.0, 'keepStart': 300.0, 'keepEnd': None},
+]
+
+
+@pytest.fixture
+def demo(demo_dir):
+    with open(os.path.join(demo_dir, 'transcript.json')) as transcript_file:
+        transcript = json.load(transcript_file)
+    with open(os.path.join(demo_dir, 'summary.json')) as summary_file:
+        summary = json.load(summary_file)
+    return transcript, summary
+
+
+def chunk_id(chunk, segment_id):
+    return f"{chunk['index']}-{segment_id}"
+
+
+def chunk_transcript(transcript, chunk):
+    """
+    The transcript.json HealthScribe would write for the chunk's audio: the
+    entries starting inside it, timed from the chunk start, with the chunk's
+    own segment IDs.
+    """
+    conversation = transcript['Conversation']
+
+    def inside(entry):
+        return chunk['start'] <= entry['BeginAudioTime'] < chunk['end']
+
+    def shifted(entry):
+        return dict(entry, BeginAudioTime=round(entry['BeginAudioTime'] - chunk['start'], 3),
+                    EndAudioTime=round(entry['EndAudioTime'] - chunk['start'], 3))
+
+    segments = [dict(shifted(segment), SegmentId=chunk_id(chunk, segment['SegmentId']))
+                for segment in conversation['TranscriptSegments'] if inside(segment)]
+    items = []
+    keep_punctuation = False
+    for item in conversation['TranscriptItems']:
+        if item['Type'] == 'PUNCTUATION':
+            if keep_punctuation:
+                items.append(item)
+            continue
+        keep_punctuation = inside(item)
+        if keep_punctuation:
+            items.append(shifted(item))
+    segment_ids = {segment['SegmentId'] for segment in segments}
+    insights = []
+    for insight in conversation['ClinicalInsights']:
+        spans = [dict(span, SegmentId=chunk_id(chunk, span['SegmentId'])) for span in insight['Spans']]
+        if any(span['SegmentId'] in segment_ids for span in spans):
+            insights.append(dict(insight, Spans=spans))
+    return {'Conversation': dict(conversation, ClinicalInsights=insights, TranscriptItems=items,
+                                 TranscriptSegments=segments)}
+
+
+def chunk_summary(summary, transcript, chunk):
+    """
+    The demo summary as the chunk's summary.json, citing the chunk's segments.
+    """
+    segment_ids = {segment['SegmentId'] for segment in transcript['Conversation']['TranscriptSegments']}
+    sections = []
+    for section in summary['ClinicalDocumentation']['Sections']:
+        section = dict(section)
+        if 'Summary' in section:
+            section['Summary'] = [
+                dict(entry, EvidenceLinks=[
+                    {'SegmentId': chunk_id(chunk, link['SegmentId'])} for link in entry['EvidenceLinks']
+                    if chunk_id(chunk, link['SegmentId']) in segment_ids
+                ])
+                for entry in section['Summary']
+            ]
+        sections.append(section)
+    return {'ClinicalDocumentation': {'Sections': sections}}
+
+
+@pytest.fixture
+def parts(demo):
+    transcript, _ = demo
+    return [(chunk, chunk_transcript(transcript, chunk)) for chunk in CHUNKS]
+
+
+def kept_chunk(entry):
+    """
+    Chunk an entry of the original recording is kept from in the merge.
+    """
+    return CHUNKS[0] if entry['BeginAudioTime'] < CHUNKS[0]['keepEnd'] else CHUNKS[1]
+
+
+def test_chunks_of_the_demo_overlap(parts):
+    first, second = (transcript['Conversation']['TranscriptSegments'] for _, transcript in parts)
+    # The fixture is only meaningful if some segments are in both chunks
+    assert {segment['SegmentId'][2:] for segment in first} & {segment['SegmentId'][2:] for segment in second}
+
+
+def test_merged_segments_are_rebased_and_kept_once(demo, parts):
+    transcript, _ = demo
+    merged = merge_transcripts(parts, 'visit-1')['Conversation']
+
+    expected = [
+        (chunk_id(kept_chunk(segment), segment['SegmentId']), segment['BeginAudioTime'], segment['EndAudioTime'],
+         segment['Content'])
+        for segment in transcript['Conversation']['TranscriptSegments']
+    ]
+    assert [
+        (segment['SegmentId'], segment['BeginAudioTime'], segment['EndAudioTime'], segment['Content'])
+        for segment in merged['TranscriptSegments']
+    ] == expected
+
+
+def test_merged_items_are_rebased_and_kept_once(demo, parts):
+    transcript, _ = demo
+    merged = merge_transcripts(parts, 'visit-1')['Conversation']
+
+    assert list(merged['TranscriptItems'].dicts()) == transcript['Conversation']['TranscriptItems']
+
+
+def test_merged_insights_follow_their_kept_segments(demo, parts):
+    transcript, _ = demo
+    merged = merge_transcripts(parts, 'visit-1')['Conversation']
+
+    segment_ids = {segment['SegmentId'] for segment in merged['TranscriptSegments']}
+    for insight in merged['ClinicalInsights']:
+        assert any(span['SegmentId'] in segment_ids for span in insight['Spans'])
+    assert sorted(insight['InsightId'] for insight in merged['ClinicalInsights']) == sorted(
+        insight['InsightId'] for insight in transcript['Conversation']['ClinicalInsights']
+    )
+
+
+def test_merged_transcript_takes_metadata_from_the_first_chunk(demo, parts):
+    transcript, _ = demo
+    merged = merge_transcripts(parts, 'visit-1')['Conversation']
+
+    assert merged['JobName'] == 'visit-1'
+    assert merged['ConversationId'] == transcript['Conversation']['ConversationId']
+    assert merged['LanguageCode'] == transcript['Conversation']['LanguageCode']
+
+
+def test_merge_of_streamed_chunks_matches_merge_of_loaded_chunks(parts):
+    streamed = [(chunk, read_transcript(io.BytesIO(json.dumps(transcript).encode('utf-8'))))
+                for chunk, transcript in parts]
+
+    out = io.StringIO()
+    write_transcript(merge_transcripts(streamed, 'visit-1'), out)
+    loaded = io.StringIO()
+    write_transcript(merge_transcripts(parts, 'visit-1'), loaded)
+
+    assert json.loads(out.getvalue()) == json.loads(loaded.getvalue())
+
+
+def test_rebase_items_keeps_punctuation_with_the_word_before():
+    items = [
+        {'Type': 'PRONUNCIATION', 'BeginAudioTime': 9.5, 'EndAudioTime': 9.9},
+        {'Type': 'PUNCTUATION', 'BeginAudioTime': 0, 'EndAudioTime': 0},
+        {'Type': 'PRONUNCIATION', 'BeginAudioTime': 10.2, 'EndAudioTime': 10.6},
+        {'Type': 'PUNCTUATION', 'BeginAudioTime': 0, 'EndAudioTime': 0},
+    ]
+
+    rebased = rebase_items(items, 290.0, keep_start=300.0)
+
+    assert rebased == [
+        {'Type': 'PRONUNCIATION', 'BeginAudioTime': 300.2, 'EndAudioTime': 300.6},
+        {'Type': 'PUNCTUATION', 'BeginAudioTime': 0, 'EndAudioTime': 0},
+    ]
+
+
+def test_merged_summary_keeps_section_order_and_every_entry(demo, parts):
+    _, summary = demo
+    summaries = [chunk_summary(summary, transcript, chunk) for chunk, transcript in parts]
+
+    merged = merge_summaries(summaries)['ClinicalDocumentation']['Sections']
+
+    original = summary['ClinicalDocumentation']['Sections']
+    assert [section['SectionName'] for section in merged] == [section['SectionName'] for section in original]
+    for section, original_section in zip(merged, original):
+        assert len(section['Summary']) == 2 * len(original_section.get('Summary', []))
+
+
+def test_merged_summary_drops_links_to_segments_cut_from_the_overlap(demo, parts):
+    _, summary = demo
+    summaries = [chunk_summary(summary, transcript, chunk) for chunk, transcript in parts]
+    transcript = merge_transcripts(parts, 'visit-1')
+
+    merged = merge_summaries(summaries, transcript)['ClinicalDocumentation']['Sections']
+
+    segment_ids = {segment['SegmentId'] for segment in transcript['Conversation']['TranscriptSegments']}
+    links = [link['SegmentId'] for section in merged for entry in section['Summary']
+             for link in entry['EvidenceLinks']]
+    unfiltered = [link['SegmentId'] for section in merge_summaries(summaries)['ClinicalDocumentation']['Sections']
+                  for entry in section['Summary'] for link in entry['EvidenceLinks']]
+    assert links and set(links) <= segment_ids
+    assert len(links) < len(unfiltered)
+    assert [link for link in unfiltered if link in segment_ids] == links
+
+
+def test_sections_first_seen_in_a_later_chunk_come_last():
+    summaries = [
+        {'ClinicalDocumentation': {'Sections': [
+            {'SectionName': 'CHIEF_COMPLAINT', 'Summary': [{'SummarizedSegment': 'Tired', 'EvidenceLinks': []}]},
+        ]}},
+        {'ClinicalDocumentation': {'Sections': [
+            {'SectionName': 'PLAN', 'Summary': [{'SummarizedSegment': 'Labs', 'EvidenceLinks': []}]},
+            {'SectionName': 'CHIEF_COMPLAINT', 'Summary': [{'SummarizedSegment': 'Dizzy', 'EvidenceLinks': []}]},
+        ]}},
+    ]
+
+    merged = merge_summaries(summaries)['ClinicalDocumentation']['Sections']
+
+    assert [(section['SectionName'], [entry['SummarizedSegment'] for entry in section['Summary']])
+            for section in merged] == [('CHIEF_COMPLAINT', ['Tired', 'Dizzy']), ('PLAN', ['Labs'])]
+
+
+def wav_bytes(seconds, rate=8000, channels=2, quiet_every=None):
+    """
+    16-bit WAV whose samples count up, loud except for the last 0.5 s of
+    every `quiet_every` seconds. A LIST chunk sits before the frames, so
+    they do not start at the usual byte 44.
+    """
+    samples = array('h')
+    for frame in range(int(seconds * rate)):
+        quiet = quiet_every is not None and (frame / rate) % quiet_every >= quiet_every - 0.5
+        samples.extend([frame % 1000 + (0 if quiet else 10000)] * channels)
+    fmt = struct.pack('<HHIIHH', 1, channels, rate, rate * channels * 2, channels * 2, 16)
+    chunks = [(b'fmt ', fmt), (b'LIST', b'INFOtest'), (b'data', samples.tobytes())]
+    body = b'WAVE' + b''.join(chunk_id + struct.pack('<I', len(data)) + data for chunk_id, data in chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def test_split_streams_the_upload_and_cuts_chunks_with_ranged_reads():
+    s3 = FakeS3Client()
+    source = wav_bytes(95, quiet_every=30)
+    s3.put_object(Bucket='input', Key='visit-1/recording.wav', Body=source)
+    s3.download_file = lambda *args, **kwargs: pytest.fail("The upload must not be downloaded whole")
+    ranges = []
+    get_object = s3.get_object
+    s3.get_object = lambda **request: ranges.append(request.get('Range')) or get_object(**request)
+
+    chunks = split_wav_object(s3, 'input', 'visit-1/recording.wav', target_seconds=30, overlap_seconds=2)
+
+    assert [chunk['key'] for chunk in chunks] == [f"visit-1/_chunks/{index:03d}.wav" for index in range(3)]
+    # One streamed GET to plan the cuts, then one ranged GET per chunk
+    assert ranges[0] is None and all(byte_range for byte_range in ranges[1:])
+    assert len(ranges) == 1 + len(chunks)
+    with wave.open(io.BytesIO(source)) as original:
+        frames = original.readframes(original.getnframes())
+    for chunk in chunks:
+        with wave.open(io.BytesIO(s3.objects[('input', chunk['key'])]['Body'])) as part:
+            assert (part.getnchannels(), part.getsampwidth(), part.getframerate()) == (2, 2, 8000)
+            expected = frames[int(chunk['start'] * 8000) * 4:int(chunk['end'] * 8000) * 4]
+            assert part.readframes(part.getnframes()) == expected
+
+
+def test_split_cuts_at_quiet_points():
+    s3 = FakeS3Client()
+    s3.put_object(Bucket='input', Key='visit-1/recording.wav', Body=wav_bytes(95, quiet_every=30))
+
+    chunks = split_wav_object(s3, 'input', 'visit-1/recording.wav', target_seconds=30, overlap_seconds=2)
+
+    assert [chunk['keepStart'] for chunk in chunks[1:]] == [pytest.approx(29.5, abs=0.5),
+                                                              pytest.approx(59.5, abs=0.5)]
+
+
+def test_split_refuses_wav_files_that_are_not_16_bit():
+    s3 = FakeS3Client()
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(1)
+        wav_file.setframerate(8000)
+        wav_file.writeframes(bytes(8000 * 60))
+    s3.put_object(Bucket='input', Key='recording.wav', Body=out.getvalue())
+
+    assert split_wav_object(s3, 'input', 'recording.wav', target_seconds=30, overlap_seconds=2) is None
+    assert list(s3.objects) == [('input', 'recording.wav')]
@@ -0,0 +1,131 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import clients
+import lambda_metrics
+from fakes import FakeTranscribeClient
+
+
+@pytest.fixture
+def sink(tmp_path, monkeypatch):
+    """
+    Path the EMF documents are written to, with the metric buffer emptied.
+    """
+    monkeypatch.setenv('METRICS_SINK', 'off')
+    lambda_metrics.flush('leftovers')
+    path = tmp_path / 'metrics.jsonl'
+    monkeypatch.setenv('METRICS_SINK', f"file:{path}")
+    return path
+
+
+def read_documents(path):
+    if not path.exists():
+        return []
+    with open(path) as sink_file:
+        return [json.loads(line) for line in sink_file]
+
+
+def metric_units(document):
+    directive, = document['_aws']['CloudWatchMetrics']
+    assert directive['Namespace'] == 'MediSync/Pipeline'
+    assert directive['Dimensions'] == [['Function']]
+    return {metric['Name']: metric['Unit'] for metric in directive['Metrics']}
+
+
+def test_flush_writes_one_emf_document_per_invocation(sink):
+    lambda_metrics.put('SubmitLatency', 120.5)
+    lambda_metrics.put('SubmitLatency', 80.0)
+    lambda_metrics.put('QueueWait', 42, 'Seconds')
+
+    assert lambda_metrics.flush('medisync_healthscribe_processor') == 1
+
+    document, = read_documents(sink)
+    assert document['Function'] == 'medisync_healthscribe_processor'
+    assert document['SubmitLatency'] == [120.5, 80.0]
+    assert document['QueueWait'] == 42
+    assert metric_units(document) == {'SubmitLatency': 'Milliseconds', 'QueueWait': 'Seconds'}
+    assert isinstance(document['_aws']['Timestamp'], int)
+
+
+def test_flush_empties_the_buffer(sink):
+    lambda_metrics.put('SubmitLatency', 1.0)
+    lambda_metrics.flush('handler')
+
+    assert lambda_metrics.flush('handler') == 0
+    assert len(read_documents(sink)) == 1
+
+
+def test_documents_are_split_at_cloudwatch_limits(sink):
+    for index in range(lambda_metrics.MAX_METRICS_PER_DOCUMENT + 5):
+        lambda_metrics.put(f"Metric{index}", index, 'Count')
+    for value in range(lambda_metrics.MAX_VALUES_PER_METRIC + 1):
+        lambda_metrics.put('SubmitLatency', value)
+
+    written = lambda_metrics.flush('handler')
+
+    documents = read_documents(sink)
+    assert written == len(documents) == 3
+    for document in documents:
+        units = metric_units(document)
+        assert len(units) <= lambda_metrics.MAX_METRICS_PER_DOCUMENT
+        assert all(len(document[name]) <= lambda_metrics.MAX_VALUES_PER_METRIC
+                   for name in units if isinstance(document[name], list))
+    latencies = []
+    for document in documents:
+        value = document.get('SubmitLatency', [])
+        latencies.extend(value if isinstance(value, list) else [value])
+    assert latencies == list(range(lambda_metrics.MAX_VALUES_PER_METRIC + 1))
+    assert sum(len(metric_units(document)) for document in documents) == lambda_metrics.MAX_METRICS_PER_DOCUMENT + 7
+
+
+def test_off_sink_writes_nothing(sink, monkeypatch):
+    monkeypatch.setenv('METRICS_SINK', 'off')
+    lambda_metrics.put('SubmitLatency', 1.0)
+
+    assert lambda_metrics.flush('handler') == 0
+    assert read_documents(sink) == []
+
+
+def test_emit_metrics_flushes_under_the_function_name_also_on_error(sink):
+    @lambda_metrics.emit_metrics
+    def handler(event, context):
+        lambda_metrics.put('Rejected', 1, 'Count')
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        handler({}, SimpleNamespace(function_name='medisync_healthscribe_completion'))
+
+    document, = read_documents(sink)
+    assert document['Function'] == 'medisync_healthscribe_completion'
+    assert document['Rejected'] == 1
+
+
+def test_seconds_since_reads_s3_event_times():
+    assert lambda_metrics.seconds_since('2025-04-15T10:00:00.000Z') > 0
+    assert lambda_metrics.seconds_since('not a time') is None
+    assert lambda_metrics.seconds_since(None) is None
+
+
+def test_job_completion_records_pipeline_metrics(sink, monkeypatch):
+    monkeypatch.delenv('STATE_STORE', raising=False)
+    import lambda_function
+
+    healthscribe = FakeTranscribeClient()
+    monkeypatch.setitem(clients._clients, 'transcribe', healthscribe)
+    healthscribe.start_medical_scribe_job(MedicalScribeJobName='visit-1', Media={'MediaFileUri': 's3://in/a.wav'},
+                                          OutputBucketName='out', DataAccessRoleArn='role', Settings={})
+    healthscribe.finish_job('visit-1')
+    event = {'detail': {'MedicalScribeJobName': 'visit-1', 'MedicalScribeJobStatus': 'COMPLETED'}}
+
+    lambda_function.job_state_change_handler(event, SimpleNamespace(function_name='medisync_healthscribe_completion'),
+                                             healthscribe=healthscribe)
+
+    document, = read_documents(sink)
+    assert document['Function'] == 'medisync_healthscribe_completion'
+    assert document['JobsCompleted'] == 1
+    assert metric_units(document) == {
+        'JobsCompleted': 'Count', 'JobDuration': 'Seconds', 'CompletionDetectionDelay': 'Seconds'
+    }
+    assert document['JobDuration'] >= 0
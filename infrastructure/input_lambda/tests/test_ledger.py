@@ -0,0 +1,132 @@
+import pytest
+
+import store
+from ledger import ClaimInProgress, JobLedger
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    connected = store.connect(f"sqlite:{tmp_path / 'state.db'}")
+    yield connected
+    connected.close()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def ledger(sqlite_store, clock):
+    return JobLedger(sqlite_store, claim_timeout_seconds=900, clock=clock)
+
+
+def ledger_rows(sqlite_store):
+    rows, _ = sqlite_store.execute("SELECT object_key, etag, job_name, state, claimed_at FROM healthscribe_job_ledger")
+    return rows
+
+
+def test_first_claim_wins_and_is_recorded(ledger, sqlite_store):
+    assert ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+    assert ledger_rows(sqlite_store) == [('visit-1/a.wav', 'etag-1', 'visit-1', 'claimed', 1000.0)]
+
+
+def test_duplicate_of_a_submitted_upload_is_refused(ledger, clock):
+    ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+    ledger.complete('input', 'visit-1/a.wav', 'etag-1')
+
+    assert not ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+    # A finished claim never goes stale
+    clock.now += 10 * 900
+    assert not ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+
+def test_duplicate_during_submission_is_retried_not_dropped(ledger, clock):
+    ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+    clock.now += 899
+
+    with pytest.raises(ClaimInProgress):
+        ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+
+def test_stale_claim_is_taken_over_after_the_timeout(ledger, sqlite_store, clock):
+    ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+    clock.now += 901
+
+    assert ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1-retry')
+
+    assert ledger_rows(sqlite_store) == [('visit-1/a.wav', 'etag-1', 'visit-1-retry', 'claimed', 1901.0)]
+    # The takeover restarts the timeout
+    with pytest.raises(ClaimInProgress):
+        ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+
+def test_stale_claim_is_taken_over_by_one_invocation_only(sqlite_store, clock):
+    first = JobLedger(sqlite_store, claim_timeout_seconds=900, clock=clock)
+    second = JobLedger(sqlite_store, claim_timeout_seconds=900, clock=clock)
+    first.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+    clock.now += 901
+
+    assert first.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+    with pytest.raises(ClaimInProgress):
+        second.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+
+def test_released_claim_can_be_claimed_again(ledger, sqlite_store):
+    ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+    # The submission failed: the redelivered notification must get through
+    ledger.release('input', 'visit-1/a.wav', 'etag-1')
+
+    assert ledger_rows(sqlite_store) == []
+    assert ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+
+def test_new_version_of_an_upload_is_claimed_separately(ledger):
+    ledger.claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+    ledger.complete('input', 'visit-1/a.wav', 'etag-1')
+
+    assert ledger.claim('input', 'visit-1/a.wav', 'etag-2', 'visit-1')
+    assert ledger.claim('other-input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+
+def test_table_survives_a_second_ledger_on_the_same_store(sqlite_store, clock):
+    JobLedger(sqlite_store, clock=clock).claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+    with pytest.raises(ClaimInProgress):
+        JobLedger(sqlite_store, clock=clock).claim('input', 'visit-1/a.wav', 'etag-1', 'visit-1')
+
+
+def s3_record(key, etag='etag-1'):
+    return {'s3': {'bucket': {'name': 'input'}, 'object': {'key': key, 'eTag': etag}}}
+
+
+def test_process_record_releases_the_claim_when_submission_fails(fake_aws, monkeypatch, sqlite_store):
+    import lambda_function
+
+    monkeypatch.setenv('AUDIO_PREFLIGHT', 'false')
+    monkeypatch.setenv('CONTENT_DEDUPE', 'false')
+    store.set_store(sqlite_store)
+    start_job = fake_aws.transcribe.start_medical_scribe_job
+
+    def unavailable(**request):
+        raise RuntimeError('HealthScribe unavailable')
+
+    fake_aws.transcribe.start_medical_scribe_job = unavailable
+    with pytest.raises(RuntimeError):
+        lambda_function.process_record(s3_record('visit-1/a.wav'), 'output')
+    assert ledger_rows(sqlite_store) == []
+
+    fake_aws.transcribe.start_medical_scribe_job = start_job
+    assert lambda_function.process_record(s3_record('visit-1/a.wav'), 'output')['jobName'] == 'visit-1'
+    assert [row[3] for row in ledger_rows(sqlite_store)] == ['done']
+    assert lambda_function.process_record(s3_record('visit-1/a.wav'), 'output')['skipped'] == 'Duplicate S3 notification'
@@ -0,0 +1,226 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+
+from fakes import FakeTranscribeClient
+from poller import TIMED_OUT, JobPoller
+
+
+class FakeClock:
+    """
+    Clock and sleep for a JobPoller: sleeping moves the clock on and runs
+    whatever was scheduled for that time.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.scheduled = []
+
+    def __call__(self):
+        return self.now
+
+    def at(self, moment, action):
+        self.scheduled.append((moment, action))
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        for moment, action in list(self.scheduled):
+            if moment <= self.now:
+                self.scheduled.remove((moment, action))
+                action()
+
+
+def make_poller(client, clock, **kwargs):
+    return JobPoller(client, sleep=clock.sleep, clock=clock, rng=lambda: 0.0, **kwargs)
+
+
+def start_jobs(client, count):
+    names = [f"visit-{index}" for index in range(count)]
+    for name in names:
+        client.start_medical_scribe_job(MedicalScribeJobName=name, Media={'MediaFileUri': f"s3://in/{name}.wav"},
+                                        OutputBucketName='out', DataAccessRoleArn='role', Settings={})
+    return names
+
+
+def test_wait_returns_every_job_once_finished():
+    client, clock = FakeTranscribeClient(), FakeClock()
+    names = start_jobs(client, 3)
+    clock.at(15, lambda: client.finish_job(names[0]))
+    clock.at(40, lambda: client.finish_job(names[1], 'FAILED', 'Bad audio'))
+    clock.at(70, lambda: client.finish_job(names[2]))
+
+    poller = make_poller(client, clock)
+    for name in names:
+        poller.track(name)
+    finished_order = []
+    finished = poller.wait(lambda summary: finished_order.append(summary['MedicalScribeJobName']))
+
+    assert finished_order == names
+    assert {name: summary['MedicalScribeJobStatus'] for name, summary in finished.items()} == {
+        names[0]: 'COMPLETED', names[1]: 'FAILED', names[2]: 'COMPLETED'
+    }
+    assert finished[names[1]]['FailureReason'] == 'Bad audio'
+    assert not poller.outstanding
+
+
+def test_jobs_are_refreshed_together_not_one_call_each():
+    client, clock = FakeTranscribeClient(), FakeClock()
+    names = start_jobs(client, 20)
+    clock.at(15, lambda: [client.finish_job(name) for name in names])
+
+    poller = make_poller(client, clock)
+    for name in names:
+        poller.track(name)
+    poller.wait()
+
+    # One listing per polled status and refresh, whatever the number of jobs
+    assert client.calls == {'StartMedicalScribeJob': 20, 'ListMedicalScribeJobs': poller.api_calls}
+    assert poller.api_calls <= 2 * (len(clock.sleeps) + 1)
+    assert 'GetMedicalScribeJob' not in client.calls
+
+
+def test_single_job_is_looked_up_by_name():
+    client, clock = FakeTranscribeClient(), FakeClock()
+    names = start_jobs(client, 5)
+    client.finish_job(names[3])
+    requests = []
+    list_jobs = client.list_medical_scribe_jobs
+    client.list_medical_scribe_jobs = lambda **request: requests.append(request) or list_jobs(**request)
+
+    poller = make_poller(client, clock)
+    poller.track(names[3])
+    finished = poller.wait()
+
+    assert finished[names[3]]['MedicalScribeJobStatus'] == 'COMPLETED'
+    assert requests == [{'MaxResults': 100, 'JobNameContains': names[3]}]
+
+
+def test_listing_pages_are_followed_until_every_job_is_found():
+    client, clock = FakeTranscribeClient(), FakeClock()
+    names = start_jobs(client, 7)
+    for name in names:
+        client.finish_job(name)
+
+    poller = make_poller(client, clock, page_size=2)
+    for name in names:
+        poller.track(name)
+    finished = poller.wait()
+
+    assert set(finished) == set(names)
+    assert poller.api_calls == 4
+    assert clock.sleeps == []
+
+
+def test_pages_older_than_the_oldest_tracked_job_are_not_fetched():
+    client, clock = FakeTranscribeClient(), FakeClock()
+    old = start_jobs(client, 6)
+    for name in old:
+        client.jobs[name]['CreationTime'] -= timedelta(days=1)
+        client.finish_job(name)
+    new = ['recent-0', 'recent-1']
+    for name in new:
+        client.start_medical_scribe_job(MedicalScribeJobName=name, Media={}, OutputBucketName='out',
+                                        DataAccessRoleArn='role', Settings={})
+
+    poller = make_poller(client, clock, page_size=2)
+    for name in new:
+        poller.track(name, max_wait_seconds=5, submitted_at=datetime.now(timezone.utc))
+    poller.refresh()
+
+    # Neither new job is finished; the first page of old jobs ends the listing
+    assert poller.api_calls == 2
+
+
+def test_job_still_running_at_its_deadline_times_out():
+    client, clock = FakeTranscribeClient(), FakeClock()
+    names = start_jobs(client, 2)
+    clock.at(20, lambda: client.finish_job(names[0]))
+
+    poller = make_poller(client, clock)
+    poller.track(names[0], max_wait_seconds=300)
+    poller.track(names[1], max_wait_seconds=45)
+    finished = poller.wait()
+
+    assert finished[names[0]]['MedicalScribeJobStatus'] == 'COMPLETED'
+    assert finished[names[1]] == {'MedicalScribeJobName': names[1], 'MedicalScribeJobStatus': TIMED_OUT}
+    # The last sleep is cut short so the deadline is not overslept
+    assert clock.now == 45
+
+
+def test_backoff_grows_exponentially_up_to_the_max_delay():
+    poller = JobPoller(FakeTranscribeClient(), base_delay=10, max_delay=60, rng=lambda: 1.0)
+    poller.track('visit-0')
+
+    delays = []
+    for attempt in range(6):
+        poller.attempt = attempt
+        delays.append(poller.next_delay())
+
+    assert delays == [10, 20, 40, 60, 60, 60]
+
+
+def test_backoff_jitter_stays_between_base_and_ceiling():
+    rolls = iter([0.0, 0.5, 0.999])
+    poller = JobPoller(FakeTranscribeClient(), base_delay=10, max_delay=60, rng=lambda: next(rolls))
+    poller.track('visit-0')
+    poller.attempt = 2
+
+    assert [poller.next_delay() for _ in range(3)] == pytest.approx([10, 25, 39.97])
+
+
+def test_wait_sleeps_with_backoff_between_refreshes():
+    client, clock = FakeTranscribeClient(), FakeClock()
+    names = start_jobs(client, 2)
+    clock.at(200, lambda: [client.finish_job(name) for name in names])
+
+    poller = JobPoller(client, base_delay=10, max_delay=60, sleep=clock.sleep, clock=clock, rng=lambda: 1.0)
+    for name in names:
+        poller.track(name)
+    poller.wait()
+
+    assert clock.sleeps == [10, 20, 40, 60, 60, 60]
+
+
+def test_throttled_refresh_backs_off_instead_of_failing():
+    client, clock = FakeTranscribeClient(), FakeClock()
+    names = start_jobs(client, 2)
+    for name in names:
+        client.finish_job(name)
+    list_jobs = client.list_medical_scribe_jobs
+    calls = []
+
+    def list_once_throttled(**request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                              'ListMedicalScribeJobs')
+        return list_jobs(**request)
+
+    client.list_medical_scribe_jobs = list_once_throttled
+    poller = make_poller(client, clock)
+    for name in names:
+        poller.track(name)
+
+    assert poller.refresh() == []
+    assert poller.attempt == 1
+    assert {summary['MedicalScribeJobName'] for summary in poller.refresh()} == set(names)
+
+
+def test_other_errors_are_raised():
+    client = FakeTranscribeClient()
+    start_jobs(client, 2)
+
+    def list_denied(**request):
+        raise ClientError({'Error': {'Code': 'AccessDeniedException', 'Message': 'Denied'}},
+                          'ListMedicalScribeJobs')
+
+    client.list_medical_scribe_jobs = list_denied
+    poller = make_poller(client, FakeClock())
+    poller.track('visit-0')
+    poller.track('visit-1')
+
+    with pytest.raises(ClientError):
+        poller.refresh()
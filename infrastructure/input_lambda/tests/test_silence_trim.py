@@ -0,0 +1,110 @@
+import io
+import json
+import math
+import os
+import struct
+import wave
+from types import SimpleNamespace
+
+import pytest
+
+import clients
+import preprocess
+from fakes import job_state_change_event
+
+pytestmark = pytest.mark.skipif(preprocess.audioop is None, reason="needs the audioop module")
+
+RATE = 16000
+
+
+def wav_bytes(sections):
+    """
+    Mono 16-bit WAV made of (seconds, amplitude) sections of a 440 Hz tone.
+    """
+    frames = bytearray()
+    for seconds, amplitude in sections:
+        for index in range(int(seconds * RATE)):
+            frames += struct.pack('<h', int(amplitude * math.sin(2 * math.pi * 440 * index / RATE)))
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(RATE)
+        wav_file.writeframes(bytes(frames))
+    return out.getvalue()
+
+
+def s3_event(bucket, key):
+    return {'Records': [{
+        'eventTime': '2025-04-15T10:00:00.000Z',
+        's3': {'bucket': {'name': bucket}, 'object': {'key': key, 'eTag': 'etag-1'}}
+    }]}
+
+
+@pytest.fixture
+def demo_transcript(demo_dir):
+    with open(os.path.join(demo_dir, 'transcript.json')) as transcript_file:
+        return json.load(transcript_file)
+
+
+def segment_times(transcript):
+    return [(segment['BeginAudioTime'], segment['EndAudioTime'])
+            for segment in transcript['Conversation']['TranscriptSegments']]
+
+
+def test_trimmed_recording_gets_its_times_restored_by_the_completion_lambda(fake_aws, monkeypatch,
+                                                                           demo_transcript):
+    import lambda_function
+
+    # Processor: trims 8 s of silence off either side of 4 s of speech
+    monkeypatch.setenv('SILENCE_TRIM', 'true')
+    monkeypatch.setenv('HEALTHSCRIBE_WAIT_FOR_COMPLETION', 'false')
+    fake_aws.s3.put_object(Bucket='input', Key='visit-1/recording.wav', Body=wav_bytes([(8, 0), (4, 8000), (8, 0)]))
+
+    response = lambda_function.lambda_handler(s3_event('input', 'visit-1/recording.wav'),
+                                              SimpleNamespace(function_name='medisync_healthscribe_processor'))
+
+    result, = json.loads(response['body'])['results']
+    assert result['jobName'] == 'visit-1'
+    job = fake_aws.transcribe.jobs['visit-1']
+    assert job['Media']['MediaFileUri'] == 's3://input/visit-1/_preprocessed/recording.wav'
+    manifest = json.loads(fake_aws.s3.objects[('input', 'visit-1/_preprocessed/manifest.json')]['Body'])
+    assert manifest['offsetSeconds'] == 7.5
+
+    # HealthScribe times its transcript from the start of the derivative
+    fake_aws.s3.put_object(Bucket='output', Key='visit-1/transcript.json', Body=json.dumps(demo_transcript))
+    fake_aws.transcribe.finish_job('visit-1')
+
+    # Completion Lambda: its environment has no SILENCE_TRIM
+    monkeypatch.delenv('SILENCE_TRIM')
+    monkeypatch.setattr(clients, '_settings', None)
+    completion = SimpleNamespace(function_name='medisync_healthscribe_completion')
+    for _ in range(2):
+        # A redelivered event must not shift the times twice
+        lambda_function.job_state_change_handler(job_state_change_event('visit-1', 'COMPLETED'), completion)
+
+    stored = fake_aws.s3.objects[('output', 'visit-1/transcript.json')]
+    assert stored['Metadata'] == {'time-offset-seconds': '7.5'}
+    restored = json.loads(stored['Body'])
+    assert segment_times(restored) == [(round(begin + 7.5, 3), round(end + 7.5, 3))
+                                       for begin, end in segment_times(demo_transcript)]
+    first_word = next(item for item in restored['Conversation']['TranscriptItems'] if item['Type'] != 'PUNCTUATION')
+    original_word = next(item for item in demo_transcript['Conversation']['TranscriptItems']
+                         if item['Type'] != 'PUNCTUATION')
+    assert first_word['BeginAudioTime'] == round(original_word['BeginAudioTime'] + 7.5, 3)
+
+
+def test_completion_of_an_untrimmed_job_leaves_its_transcript_alone(fake_aws, demo_transcript):
+    import lambda_function
+
+    fake_aws.transcribe.start_medical_scribe_job(MedicalScribeJobName='visit-2',
+                                                 Media={'MediaFileUri': 's3://input/visit-2/recording.wav'},
+                                                 OutputBucketName='output', DataAccessRoleArn='role', Settings={})
+    fake_aws.s3.put_object(Bucket='output', Key='visit-2/transcript.json', Body=json.dumps(demo_transcript))
+    fake_aws.transcribe.finish_job('visit-2')
+
+    lambda_function.job_state_change_handler(job_state_change_event('visit-2', 'COMPLETED'),
+                                             SimpleNamespace(function_name='medisync_healthscribe_completion'))
+
+    assert fake_aws.s3.calls.get('PutObject', 0) == 1
+    assert fake_aws.s3.objects[('output', 'visit-2/transcript.json')]['Metadata'] == {}
@@ -0,0 +1,255 @@
+"""
+Ingestion of a visit's HealthScribe documents into the application database.
+
+The web app used to read `<uniqueID>/summary.json` from the output bucket
+on every view of a visit's analysis. Once a visit's job completes, its
+summary.json and transcript.json are parsed here into normalized rows, so
+the report is served by indexed lookups on uniqueID instead:
+
+    VisitSections            one row per clinical documentation section
+    VisitSummarySegments     summarized segments of each section
+    VisitEvidenceLinks       transcript segments each summarized segment cites
+    VisitTranscriptSegments  transcript segments with speaker and audio times
+
+Row order within a document is kept in the *Index columns. A visit is
+ingested in one transaction that first deletes its earlier rows, so a
+redelivered notification replaces them instead of adding duplicates. The
+documents in S3 stay the source of truth; a visit without rows is read from
+there.
+
+transcript.json grows with the length of the visit, so it is streamed with
+transcript_stream rather than loaded whole; only its segments are kept.
+
+A visit is only ingested once both documents are final. HealthScribe writes
+transcript.json before summary.json, but when the input Lambda trimmed
+silence off the upload it rewrites transcript.json afterwards, shifting its
+times back onto the original recording and marking it with the
+`time-offset-seconds` metadata. Until that mark is there, or while
+transcript.json is missing, ingestion raises DocumentNotReady so the
+notification is redelivered and tried again.
+"""
+import json
+
+from botocore.exceptions import ClientError
+
+import transcript_stream
+
+
+CREATE_TABLES = [
+   """
+   CREATE TABLE IF NOT EXISTS VisitSections (
+       uniqueID VARCHAR(255) NOT NULL,
+       sectionIndex INT NOT NULL,
+       sectionName VARCHAR(255) NOT NULL,
+       PRIMARY KEY (uniqueID, sectionIndex)
+   ) DEFAULT CHARSET=utf8mb4
+   """,
+   """
+   CREATE TABLE IF NOT EXISTS VisitSummarySegments (
+       uniqueID VARCHAR(255) NOT NULL,
+       sectionIndex INT NOT NULL,
+       segmentIndex INT NOT NULL,
+       summarizedSegment TEXT NOT NULL,
+       PRIMARY KEY (uniqueID, sectionIndex, segmentIndex)
+   ) DEFAULT CHARSET=utf8mb4
+   """,
+   """
+   CREATE TABLE IF NOT EXISTS VisitEvidenceLinks (
+       uniqueID VARCHAR(255) NOT NULL,
+       sectionIndex INT NOT NULL,
+       segmentIndex INT NOT NULL,
+       linkIndex INT NOT NULL,
+       segmentId VARCHAR(64) NOT NULL,
+       PRIMARY KEY (uniqueID, sectionIndex, segmentIndex, linkIndex),
+       KEY evidence_segment (uniqueID, segmentId)
+   ) DEFAULT CHARSET=utf8mb4
+   """,
+   """
+   CREATE TABLE IF NOT EXISTS VisitTranscriptSegments (
+       uniqueID VARCHAR(255) NOT NULL,
+       segmentIndex INT NOT NULL,
+       segmentId VARCHAR(64) NOT NULL,
+       participantRole VARCHAR(64),
+       sectionName VARCHAR(255),
+       beginAudioTime DOUBLE,
+       endAudioTime DOUBLE,
+       content TEXT NOT NULL,
+       PRIMARY KEY (uniqueID, segmentIndex),
+       KEY transcript_segment (uniqueID, segmentId)
+   ) DEFAULT CHARSET=utf8mb4
+   """
+]
+
+# Columns filled for each table, uniqueID first
+COLUMNS = {
+   'VisitSections': ('uniqueID', 'sectionIndex', 'sectionName'),
+   'VisitSummarySegments': ('uniqueID', 'sectionIndex', 'segmentIndex', 'summarizedSegment'),
+   'VisitEvidenceLinks': ('uniqueID', 'sectionIndex', 'segmentIndex', 'linkIndex', 'segmentId'),
+   'VisitTranscriptSegments': ('uniqueID', 'segmentIndex', 'segmentId', 'participantRole', 'sectionName',
+                               'beginAudioTime', 'endAudioTime', 'content')
+}
+
+SUMMARY_FILE = 'summary.json'
+TRANSCRIPT_FILE = 'transcript.json'
+
+# Manifest the input Lambda writes under an upload's prefix in the input
+# bucket when it submits a trimmed derivative (see input_lambda/preprocess.py)
+TRIM_MANIFEST = '_preprocessed/manifest.json'
+
+# Metadata the input Lambda sets on transcript.json once its times are restored
+TIME_OFFSET_METADATA = 'time-offset-seconds'
+
+
+class DocumentNotReady(Exception):
+   """
+   A visit's documents are not final yet; its notification should be retried.
+   """
+
+
+def open_document(s3, bucket, key):
+   """
+   Open a document in S3 for reading.
+
+   Returns:
+       dict: The GetObject response, with the streaming body in 'Body' and
+           the user metadata in 'Metadata', or None if it does not exist
+   """
+   try:
+       return s3.get_object(Bucket=bucket, Key=key)
+   except ClientError as e:
+       if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+           return None
+       raise
+
+
+def load_document(s3, bucket, key):
+   """
+   Read a JSON document from S3.
+
+   Returns:
+       dict: The document, or None if the object does not exist
+   """
+   document = open_document(s3, bucket, key)
+   return None if document is None else json.loads(document['Body'].read())
+
+
+def trim_offset(s3, input_bucket, unique_id):
+   """
+   Seconds the input Lambda trimmed off the start of a visit's upload.
+
+   Returns:
+       float: The offset, 0 if the upload was submitted untrimmed
+   """
+   manifest = load_document(s3, input_bucket, f"{unique_id}/{TRIM_MANIFEST}")
+   return (manifest or {}).get('offsetSeconds') or 0
+
+
+def open_transcript(s3, bucket, unique_id, input_bucket=None):
+   """
+   Open a visit's transcript.json once it is final.
+
+   Args:
+       s3 (object): S3 client
+       bucket (str): Output bucket
+       unique_id (str): uniqueID of the visit
+       input_bucket (str): Bucket of the uploads, to look for a trim
+           manifest in; None skips the check
+
+   Returns:
+       object: The document's streaming body
+
+   Raises:
+       DocumentNotReady: If transcript.json is missing, or its times are not
+           restored yet after the upload was trimmed
+   """
+   key = f"{unique_id}/{TRANSCRIPT_FILE}"
+   document = open_document(s3, bucket, key)
+   if document is None:
+       raise DocumentNotReady(f"{key} does not exist yet")
+   if (input_bucket and TIME_OFFSET_METADATA not in document.get('Metadata', {})
+           and trim_offset(s3, input_bucket, unique_id)):
+       document['Body'].close()
+       raise DocumentNotReady(f"{key} of a trimmed upload does not have its times restored yet")
+   return document['Body']
+
+
+def summary_rows(unique_id, summary):
+   """
+   Rows of a summary.json document.
+
+   Sections without a Summary list are kept, with no segments, so the
+   report lists the same sections as the document.
+
+   Returns:
+       dict: Lists of row tuples keyed by table name
+   """
+   rows = {'VisitSections': [], 'VisitSummarySegments': [], 'VisitEvidenceLinks': []}
+   sections = (summary or {}).get('ClinicalDocumentation', {}).get('Sections', [])
+   for section_index, section in enumerate(sections):
+       rows['VisitSections'].append((unique_id, section_index, section.get('SectionName', '')))
+       for segment_index, segment in enumerate(section.get('Summary') or []):
+           rows['VisitSummarySegments'].append(
+               (unique_id, section_index, segment_index, segment.get('SummarizedSegment', ''))
+           )
+           for link_index, link in enumerate(segment.get('EvidenceLinks') or []):
+               rows['VisitEvidenceLinks'].append(
+                   (unique_id, section_index, segment_index, link_index, link['SegmentId'])
+               )
+   return rows
+
+
+def transcript_rows(unique_id, body):
+   """
+   Rows of a transcript.json document: its TranscriptSegments. The word-level
+   TranscriptItems are read past and left in S3.
+
+   Args:
+       unique_id (str): uniqueID of the visit
+       body (object): The document's streaming body
+
+   Returns:
+       dict: Lists of row tuples keyed by table name
+   """
+   segments = transcript_stream.records(body, ['TranscriptSegments'])
+   return {'VisitTranscriptSegments': [
+       (unique_id, index) + tuple(segment) for index, (_, segment) in enumerate(segments)
+   ]}
+
+
+def create_tables(connection):
+   """
+   Create the ingestion tables if they do not exist. DDL commits implicitly
+   in MySQL, so this must not run inside a transaction.
+   """
+   with connection.cursor() as cursor:
+       for statement in CREATE_TABLES:
+            cursor.execute(statement)
+
+
+def replace_rows(cursor, unique_id, rows, max_statement_bytes):
+   """
+   Replace a visit's rows with `rows`, without committing.
+
+   Inserts go through executemany, which pymysql sends as multi-row
+   INSERT ... VALUES statements of up to `max_statement_bytes` each.
+
+   Args:
+       cursor (pymysql.cursors.Cursor): Cursor of the open transaction
+       unique_id (str): uniqueID of the visit
+       rows (dict): Lists of row tuples keyed by table name
+       max_statement_bytes (int): Size budget of one statement
+
+   Returns:
+       int: Number of rows inserted
+   """
+   cursor.max_stmt_length = max_statement_bytes
+   inserted = 0
+   for table, columns in COLUMNS.items():
+       cursor.execute(f"DELETE FROM {table} WHERE uniqueID = %s", (unique_id,))
+       if rows.get(table):
+            cursor.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                rows[table]
+            )
+            inserted += len(rows[table])
+   return inserted
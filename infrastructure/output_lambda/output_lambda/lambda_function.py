@@ -1,55 +1,478 @@
 import json
+import boto3
 import pymysql
 import os
+import re
+import time
+
+import ingest
+import lambda_log
+import lambda_metrics
+from visit_stages import VisitStages
+
+# A warm connection idle for longer than this is pinged before it is used again
+PING_AFTER_IDLE_SECONDS = float(os.environ.get('DB_PING_AFTER_IDLE_SECONDS', '30'))
+
+# Errors after which the connection is thrown away and the statement retried once
+CONNECTION_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+# Output object whose arrival marks a visit's job as complete: HealthScribe
+# and the chunk merge both write it after transcript.json
+COMPLETION_FILE = 'summary.json'
+
+# Output folders of the jobs a long recording was split into; only the
+# merged job's folder completes the visit
+CHUNK_JOB_FOLDER = re.compile(r'-part-\d{3}$')
+
+# Parse each completed visit's summary.json and transcript.json into tables the
+# web app reads, instead of it fetching summary.json from S3 on every view
+INGEST_DOCUMENTS = os.environ.get('INGEST_DOCUMENTS', 'true').lower() == 'true'
+
+# Bucket of the uploads, where the trim manifests of trimmed recordings are;
+# unset, transcripts are ingested without waiting for their times to be restored
+INPUT_BUCKET_NAME = os.environ.get('INPUT_BUCKET_NAME')
+
+# Longest IN (...) list of one status UPDATE
+MAX_IDS_PER_STATEMENT = 1000
+
+# Bytes of an UPDATE/SELECT statement besides its IN (...) list
+STATEMENT_OVERHEAD_BYTES = 256
+
+_connection = None
+_last_used = 0.0
+_packet_limit = None
+_visit_stages = None
+_ingest_tables = None
+_s3 = None
+
+
+def connect():
+   """
+   Open a new connection to the application database.
+   """
+   lambda_log.count('dbConnects')
+   return pymysql.connect(
+        host=os.environ['db_string'],
+        port=3306,
+        user=os.environ['db_user'],
+        password=os.environ['db_password'],
+        database=os.environ['db_name'],
+    )
+
+
+def get_connection():
+   """
+   Return the connection kept open between invocations of a warm container.
+
+   A connection that sat idle longer than PING_AFTER_IDLE_SECONDS is checked
+   with a ping first, which reconnects if the server dropped it; within a
+   batch the connection is used without any extra round trip.
+
+   Returns:
+       pymysql.connections.Connection: Open connection
+   """
+   global _connection, _last_used
+   if _connection is None:
+       _connection = connect()
+   elif time.monotonic() - _last_used > PING_AFTER_IDLE_SECONDS:
+       _connection.ping(reconnect=True)
+   _last_used = time.monotonic()
+   return _connection
+
+
+def reset_connection():
+   """
+   Drop the warm connection, e.g. after it failed.
+   """
+   global _connection
+   if _connection is not None:
+       try:
+           _connection.close()
+       except Exception:
+           pass
+   _connection = None
+
+
+def connection_execute(connection):
+   """
+   Statement runner over a connection, in the form VisitStages expects.
+   """
+   def execute(sql, params=()):
+       with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return (cursor.fetchall() if cursor.description else []), cursor.rowcount
+   return execute
+
+
+def visit_stages(connection):
+   """
+   Stage records on the given connection. The table is created the first
+   time a connection is used, outside any transaction, as DDL commits
+   implicitly in MySQL.
+   """
+   global _visit_stages
+   if _visit_stages is None or _visit_stages[0] is not connection:
+       _visit_stages = (connection, VisitStages(connection_execute(connection)))
+   return _visit_stages[1]
+
+
+def with_connection(work):
+   """
+   Run `work(connection)` on the warm connection, retrying once on a fresh
+   connection if the warm one turns out to be broken.
+   """
+   try:
+       return work(get_connection())
+   except CONNECTION_ERRORS as e:
+       lambda_log.warning("Database connection lost, reconnecting", error=str(e))
+       reset_connection()
+       return work(get_connection())
+
+
+def s3_records(record):
+   """
+   Yield the S3 event records carried by one Lambda event record.
+
+   Args:
+       record (dict): SQS message wrapping an S3 notification, or an S3
+           event record delivered directly
+
+   Yields:
+       dict: Every S3 event record of the notification; none for messages
+           without any, such as the s3:TestEvent S3 sends when the
+           notification is set up
+
+   Raises:
+       json.JSONDecodeError: If the SQS message body is not JSON
+   """
+   # If this is an SQS message, parse the body to get the S3 event
+   if 'body' in record:
+       sqs_body = json.loads(record['body'])
+       # One notification can carry several records
+       yield from sqs_body.get('Records', [])
+       return
+   # This is a direct S3 event record
+   yield record
+
+
+def event_records(event):
+   """
+   Yield every S3 event record of a Lambda event with the SQS message that
+   carried it.
+
+   A message whose body cannot be read yields a single entry with the
+   error instead, so it can be reported on its own.
+
+   Yields:
+       tuple: (SQS message ID or None, S3 event record or None, error or None)
+   """
+   for record in event.get('Records', []):
+       message_id = record.get('messageId')
+       try:
+           for s3_event in s3_records(record):
+               yield message_id, s3_event, None
+       except Exception as e:
+           yield message_id, None, e
+
+
+def visit_id(s3_event):
+   """
+   uniqueID of the visit whose job an output file completes.
+
+   Only `<uniqueID>/summary.json` completes a visit; transcript.json,
+   HealthScribe's temporary files and the outputs of chunk jobs are
+   intermediate objects and leave the database alone.
+
+   Returns:
+       str: First folder of the object key, or None for records that carry
+           no S3 object or are not a completion marker
+   """
+   if 's3' not in s3_event:
+       return None
+   bucket = s3_event['s3']['bucket']['name']
+   key = s3_event['s3']['object']['key']
+   file_path = f"s3://{bucket}/{key}"
+   parts = key.split('/')
+   if len(parts) != 2 or parts[1] != COMPLETION_FILE or CHUNK_JOB_FOLDER.search(parts[0]):
+       lambda_log.debug("Ignoring intermediate output file", file=file_path)
+       return None
+   prefix = parts[0]  # Gets everything before the first '/'
+   lambda_log.debug("Processing output file", file=file_path, prefix=prefix)
+   return prefix
+
+
+def max_statement_bytes(connection):
+   """
+   Size budget for one statement: half the server's max_allowed_packet,
+   read once per connection.
+   """
+   global _packet_limit
+   if _packet_limit is None or _packet_limit[0] is not connection:
+       with connection.cursor() as cursor:
+            cursor.execute("SELECT @@max_allowed_packet")
+            _packet_limit = (connection, int(cursor.fetchone()[0]))
+   return _packet_limit[1] // 2
+
+
+def id_batches(unique_ids, max_bytes, max_ids=MAX_IDS_PER_STATEMENT):
+   """
+   Split uniqueIDs into IN (...) lists that keep each statement below
+   `max_bytes` and `max_ids`.
+
+   Returns:
+       list: Lists of uniqueIDs
+   """
+   batches = []
+   batch = []
+   size = STATEMENT_OVERHEAD_BYTES
+   for unique_id in unique_ids:
+       # Quotes, separator and worst-case escaping of every byte
+       cost = 2 * len(unique_id.encode('utf-8')) + 4
+       if batch and (len(batch) >= max_ids or size + cost > max_bytes):
+           batches.append(batch)
+           batch = []
+           size = STATEMENT_OVERHEAD_BYTES
+       batch.append(unique_id)
+       size += cost
+   if batch:
+       batches.append(batch)
+   return batches
+
+
+def mark_processed(unique_ids):
+   """
+   Mark visits as processed with one UPDATE ... IN (...) per batch of IDs,
+   all in a single transaction.
+
+   Args:
+       unique_ids (list): Distinct uniqueIDs of the visits
+
+   Returns:
+       dict: (matched rows, createdAt) keyed by uniqueID, for the IDs that
+           have a visit
+   """
+   def update(connection):
+       try:
+            stages = visit_stages(connection)
+       except Exception as e:
+            lambda_log.warning("Could not set up visit stages", error=str(e))
+            stages = None
+       update_started = time.perf_counter()
+       matched = {}
+       changed = 0
+       try:
+            batches = id_batches(unique_ids, max_statement_bytes(connection))
+            with connection.cursor() as cursor:
+                for batch in batches:
+                    placeholders = ', '.join(['%s'] * len(batch))
+                    # Per-ID row counts, and the upload time for the end-to-end metric
+                    cursor.execute(
+                        f"SELECT uniqueID, COUNT(*), MIN(createdAt) FROM Visits WHERE uniqueID IN ({placeholders}) "
+                        "GROUP BY uniqueID",
+                        batch
+                    )
+                    for unique_id, count, created_at in cursor.fetchall():
+                        matched[unique_id] = (count, created_at)
+                    cursor.execute(f"UPDATE Visits SET status = 'Processed' WHERE uniqueID IN ({placeholders})", batch)
+                    changed += cursor.rowcount
+                    if stages is not None:
+                        try:
+                            stages.advance(batch, 'summarized')
+                        except CONNECTION_ERRORS:
+                            raise
+                        except Exception as e:
+                            lambda_log.warning("Could not record visit stage", stage='summarized', error=str(e))
+            connection.commit()
+       except Exception:
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            raise
+       lambda_metrics.put('StatusUpdateLatency', (time.perf_counter() - update_started) * 1000)
+       lambda_log.info("Updated visit status", visits=len(unique_ids), statements=len(batches),
+                       rowsChanged=changed, matchedRows={unique_id: matched[unique_id][0] for unique_id in matched})
+       return matched
+
+   matched = with_connection(update)
+   missing = [unique_id for unique_id in unique_ids if unique_id not in matched]
+   if missing:
+       lambda_log.warning("No visit found for output files", uniqueIDs=missing)
+   lambda_log.count('visitsUpdated', len(matched))
+   return matched
+
+
+def s3_client():
+   """
+   S3 client kept between invocations of a warm container.
+   """
+   global _s3
+   if _s3 is None:
+       _s3 = boto3.client('s3')
+   return _s3
+
+
+def ingest_visit(unique_id, bucket):
+   """
+   Store the rows of a visit's summary.json and transcript.json, replacing
+   any stored before, and record the visit as ingested.
+
+   The documents are read before the transaction starts, so no S3 request
+   runs while it is open.
+
+   Args:
+       unique_id (str): uniqueID of the visit; its output prefix
+       bucket (str): Output bucket
+
+   Returns:
+       int: Number of rows stored, or None if the visit has no summary.json
+
+   Raises:
+       ingest.DocumentNotReady: If transcript.json is missing or not final yet
+   """
+   summary = ingest.load_document(s3_client(), bucket, f"{unique_id}/{ingest.SUMMARY_FILE}")
+   if summary is None:
+       return None
+   rows = ingest.summary_rows(unique_id, summary)
+   transcript = ingest.open_transcript(s3_client(), bucket, unique_id, INPUT_BUCKET_NAME)
+   rows.update(ingest.transcript_rows(unique_id, transcript))
+
+   def store(connection):
+       global _ingest_tables
+       if _ingest_tables is not connection:
+            ingest.create_tables(connection)
+            _ingest_tables = connection
+       try:
+            stages = visit_stages(connection)
+       except CONNECTION_ERRORS:
+            raise
+       except Exception as e:
+            lambda_log.warning("Could not set up visit stages", error=str(e))
+            stages = None
+       ingest_started = time.perf_counter()
+       try:
+            with connection.cursor() as cursor:
+                inserted = ingest.replace_rows(cursor, unique_id, rows, max_statement_bytes(connection))
+            if stages is not None:
+                try:
+                    stages.advance([unique_id], 'ingested')
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    lambda_log.warning("Could not record visit stage", stage='ingested', error=str(e))
+            connection.commit()
+       except Exception:
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            raise
+       lambda_metrics.put('IngestLatency', (time.perf_counter() - ingest_started) * 1000)
+       return inserted
+
+   inserted = with_connection(store)
+   lambda_log.debug("Ingested visit documents", uniqueID=unique_id, rows=inserted,
+                    sections=len(rows['VisitSections']), transcriptSegments=len(rows['VisitTranscriptSegments']))
+   lambda_log.count('rowsIngested', inserted)
+   return inserted
+
+
+@lambda_metrics.emit_metrics
+@lambda_log.log_invocation
 def lambda_handler(event, context):
+   """
+   Handle a batch of output notifications.
+
+   Every S3 record of every message is read, and the records of completion
+   markers are coalesced per uniqueID: each visit is updated once, all of
+   them together in one transaction. Each record ends with an outcome
+   (processed, coalesced, noVisit, ignored, skipped or failed), counted in
+   the invocation summary. The documents of every processed visit are then
+   ingested into the database (see ingest); a visit whose ingestion fails,
+   or whose documents are not final yet, has its records marked failed, so
+   they are redelivered. A message with a failed record is reported in
+   batchItemFailures by its SQS message ID, so SQS redelivers only those
+   messages instead of the whole batch (the event source mapping has
+   ReportBatchItemFailures enabled).
+   """
+   updates = []
+   outcomes = []
+   failed_messages = []
+
+   def fail(message_id):
+       if message_id is None:
+           # Direct S3 invocation: fail it so Lambda retries the event
+           return True
+       if message_id not in failed_messages:
+           failed_messages.append(message_id)
+       return False
+
    # Check if this is an SQS event or direct S3 event
-   if 'Records' in event and len(event['Records']) > 0:
-       # Process each record (could be from SQS or directly from S3)
-       for record in event['Records']:
-           # If this is an SQS message, parse the body to get the S3 event
-           if 'body' in record:
-               try:
-                   sqs_body = json.loads(record['body'])
-                   if 'Records' in sqs_body and len(sqs_body['Records']) > 0:
-                       s3_event = sqs_body['Records'][0]
-                   else:
+   for message_id, s3_event, error in event_records(event):
+       if error is not None:
+           lambda_log.error("Failed to process message", messageId=message_id, error=str(error))
+           outcomes.append('failed')
+           if fail(message_id):
+               raise error
+           continue
+       unique_id = visit_id(s3_event)
+       if not unique_id:
+           outcomes.append('skipped' if 's3' not in s3_event else 'ignored')
+           continue
+       updates.append({'messageId': message_id, 'uniqueId': unique_id, 'eventTime': s3_event.get('eventTime'),
+                       'bucket': s3_event['s3']['bucket']['name'], 'key': s3_event['s3']['object']['key']})
+
+   unique_ids = list(dict.fromkeys(update['uniqueId'] for update in updates))
+   if unique_ids:
+       try:
+           matched = mark_processed(unique_ids)
+       except Exception as e:
+           lambda_log.error("Failed to update visit status", visits=len(unique_ids), error=str(e))
+           outcomes.extend('failed' for _ in updates)
+           if any([fail(update['messageId']) for update in updates]):
+               raise
+       else:
+           for _, created_at in matched.values():
+               if created_at is not None:
+                   lambda_metrics.put('UploadToProcessed', lambda_metrics.seconds_since(created_at), 'Seconds')
+           seen = set()
+           for update in updates:
+               if update['uniqueId'] in seen:
+                   update['outcome'] = 'coalesced'
+               else:
+                   update['outcome'] = 'processed' if update['uniqueId'] in matched else 'noVisit'
+               seen.add(update['uniqueId'])
+               output_age = lambda_metrics.seconds_since(update['eventTime'])
+               if output_age is not None:
+                   lambda_metrics.put('OutputToProcessed', output_age, 'Seconds')
+           if INGEST_DOCUMENTS:
+               ingested = set()
+               for update in updates:
+                   if update['outcome'] != 'processed' or update['uniqueId'] in ingested:
                        continue
-               except json.JSONDecodeError:
-                   continue
-           else:
-               # This is a direct S3 event record
-               s3_event = record
-          
-           # Process the S3 event
-           if 's3' in s3_event:
-               bucket = s3_event['s3']['bucket']['name']
-               key = s3_event['s3']['object']['key']
-               file_path = f"s3://{bucket}/{key}"
-               prefix = key.split('/')[0]  # Gets everything before the first '/'
-               print("Prefix before first slash:", prefix)
-               print("File Path:", key)
-              
-               db_endpoint = os.environ['db_string'] 
-               host = db_endpoint 
-               port = 3306  # Default to 3306 if no port specified
-
-               connection = pymysql.connect(
-                    host=host,
-                    port=port,
-                    user=os.environ['db_user'],
-                    password=os.environ['db_password'],
-                    database=os.environ['db_name'],
-                )
-                            
-               try:
-                   with connection.cursor() as cursor:
-                      # sql = "SELECT * FROM patient;"
-                        sql = "UPDATE Visits SET status = 'Processed' WHERE uniqueID = %s"
-                        cursor.execute(sql, (prefix))
-                      # cursor.execute(sql)
-                       
-                   connection.commit()
-               finally:
-                   connection.close()
-  
-   return {"status": "success"}
+                   ingested.add(update['uniqueId'])
+                   try:
+                       ingest_visit(update['uniqueId'], update['bucket'])
+                   except Exception as e:
+                       if isinstance(e, ingest.DocumentNotReady):
+                           lambda_log.info("Visit documents not final yet, retrying later",
+                                           uniqueID=update['uniqueId'], reason=str(e))
+                           lambda_log.count('ingestNotReady')
+                       else:
+                           lambda_log.error("Failed to ingest visit documents", uniqueID=update['uniqueId'],
+                                            error=str(e))
+                       for same_visit in updates:
+                           if same_visit['uniqueId'] == update['uniqueId']:
+                               same_visit['outcome'] = 'failed'
+                               if fail(same_visit['messageId']):
+                                   raise
+           outcomes.extend(update['outcome'] for update in updates)
+           lambda_log.debug("Record outcomes", records=lambda: updates)
+
+   lambda_log.annotate(messages=len(event.get('Records', [])), visits=len(unique_ids),
+                       outcomes={outcome: outcomes.count(outcome) for outcome in set(outcomes)},
+                       failedMessages=len(failed_messages))
+   return {
+       "status": "success",
+       "batchItemFailures": [{'itemIdentifier': message_id} for message_id in failed_messages]
+   }
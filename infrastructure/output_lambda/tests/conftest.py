@@ -0,0 +1,210 @@
+"""
+Puts the output Lambda modules and the shared layer on the import path, as
+the Lambda runtime does, so the tests run from any directory:
+
+    python -m pytest infrastructure/output_lambda/tests
+
+The handler module is loaded as `output_lambda_function`, and the folder is
+appended rather than put first, so neither clashes with the input Lambda's
+lambda_function when both suites run together.
+"""
+import importlib.util
+import io
+import os
+import re
+import sqlite3
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+OUTPUT_LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'output_lambda')
+SHARED_LAYER_DIR = os.path.join(os.path.dirname(os.path.dirname(OUTPUT_LAMBDA_DIR)), 'shared_layer', 'python')
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(OUTPUT_LAMBDA_DIR))), 'demo response')
+
+for path in (SHARED_LAYER_DIR, OUTPUT_LAMBDA_DIR):
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+def load_handler_module():
+    if 'output_lambda_function' not in sys.modules:
+        spec = importlib.util.spec_from_file_location('output_lambda_function',
+                                                      os.path.join(OUTPUT_LAMBDA_DIR, 'lambda_function.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['output_lambda_function'] = module
+    return sys.modules['output_lambda_function']
+
+
+class FakeS3:
+    """
+    S3 client keeping objects in memory, raising NoSuchKey like S3 does for
+    a missing object. GetObject keys are recorded in `gets`.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = []
+
+    def put_object(self, Bucket, Key, Body=b'', Metadata=None):
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        self.objects[(Bucket, Key)] = (Body, dict(Metadata or {}))
+
+    def get_object(self, Bucket, Key):
+        self.gets.append(Key)
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}},
+                              'GetObject')
+        body, metadata = self.objects[(Bucket, Key)]
+        return {'Body': io.BytesIO(body), 'Metadata': dict(metadata), 'ContentLength': len(body)}
+
+
+def mysql_to_sqlite(sql):
+    """
+    Rewrite the MySQL the output Lambda sends into SQLite: %s placeholders,
+    INSERT IGNORE, the table options and secondary KEYs of CREATE TABLE.
+    """
+    sql = sql.replace('%s', '?').replace('INSERT IGNORE', 'INSERT OR IGNORE')
+    sql = re.sub(r',\s*KEY \w+ \([^)]*\)', '', sql)
+    return sql.replace('DEFAULT CHARSET=utf8mb4', '')
+
+
+class SQLiteCursor:
+    """
+    pymysql-like cursor over SQLite. `max_stmt_length` is kept for the
+    tests to check, as SQLite has no statement size limit.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.sqlite.cursor()
+        self.max_stmt_length = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cursor.close()
+
+    def _run(self, sql):
+        self.connection.statements.append(' '.join(sql.split()))
+        if self.connection.fail_on and self.connection.fail_on in sql:
+            raise RuntimeError(f"Statement failed: {self.connection.fail_on}")
+
+    def execute(self, sql, params=()):
+        self._run(sql)
+        if sql.strip() == 'SELECT @@max_allowed_packet':
+            sql = f"SELECT {self.connection.max_allowed_packet}"
+        self.cursor.execute(mysql_to_sqlite(sql), tuple(params or ()))
+        return self.cursor.rowcount
+
+    def executemany(self, sql, rows):
+        self._run(sql)
+        self.connection.max_stmt_lengths.append(self.max_stmt_length)
+        self.cursor.executemany(mysql_to_sqlite(sql), rows)
+        return self.cursor.rowcount
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class SQLiteConnection:
+    """
+    pymysql-like connection over an in-memory SQLite database, holding a
+    Visits table like the web app's.
+
+    Statements are recorded in `statements`; a statement containing
+    `fail_on` raises, to simulate a database error.
+    """
+
+    def __init__(self, max_allowed_packet=64 * 1024 * 1024):
+        self.sqlite = sqlite3.connect(':memory:')
+        self.max_allowed_packet = max_allowed_packet
+        self.statements = []
+        self.max_stmt_lengths = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.fail_on = None
+        self.sqlite.execute("CREATE TABLE Visits (uniqueID VARCHAR(255), status VARCHAR(20), createdAt TEXT)")
+        self.sqlite.commit()
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    def commit(self):
+        self.commits += 1
+        self.sqlite.commit()
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.sqlite.rollback()
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.sqlite.close()
+
+    def add_visit(self, unique_id, status='Processing', created_at=None):
+        self.sqlite.execute("INSERT INTO Visits (uniqueID, status, createdAt) VALUES (?, ?, ?)",
+                            (unique_id, status, created_at))
+        self.sqlite.commit()
+
+    def query(self, sql, params=()):
+        return self.sqlite.execute(sql, params).fetchall()
+
+
+@pytest.fixture
+def demo_documents():
+    """
+    The demo HealthScribe outputs, (summary.json, transcript.json) as bytes.
+    """
+    documents = []
+    for name in ('summary.json', 'transcript.json'):
+        with open(os.path.join(DEMO_DIR, name), 'rb') as document:
+            documents.append(document.read())
+    return tuple(documents)
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def connection():
+    connected = SQLiteConnection()
+    yield connected
+    connected.close()
+
+
+@pytest.fixture
+def output(monkeypatch, s3, connection):
+    """
+    The output Lambda's handler module with the fake S3 client and the
+    SQLite connection in place of its warm clients, ingesting documents and
+    checking trim manifests in the 'input' bucket.
+    """
+    module = load_handler_module()
+    monkeypatch.setenv('METRICS_SINK', 'off')
+    monkeypatch.setattr(module, '_s3', s3)
+    monkeypatch.setattr(module, '_connection', connection)
+    monkeypatch.setattr(module, '_last_used', float('inf'))
+    for name in ('_packet_limit', '_visit_stages', '_ingest_tables'):
+        monkeypatch.setattr(module, name, None)
+    monkeypatch.setattr(module, 'INGEST_DOCUMENTS', True)
+    monkeypatch.setattr(module, 'INPUT_BUCKET_NAME', 'input')
+    return module
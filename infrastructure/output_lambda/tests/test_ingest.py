@@ -0,0 +1,108 @@
+import io
+import json
+
+import pytest
+
+import ingest
+
+
+@pytest.fixture
+def tables(connection):
+    ingest.create_tables(connection)
+    return connection
+
+
+def test_summary_rows_keep_sections_without_segments():
+    summary = {'ClinicalDocumentation': {'Sections': [
+        {'SectionName': 'CHIEF_COMPLAINT', 'Summary': [
+            {'SummarizedSegment': 'Cough', 'EvidenceLinks': [{'SegmentId': 's1'}, {'SegmentId': 's2'}]},
+            {'SummarizedSegment': 'Fever'}
+        ]},
+        {'SectionName': 'PLAN'}
+    ]}}
+
+    rows = ingest.summary_rows('visit-1', summary)
+
+    assert rows == {
+        'VisitSections': [('visit-1', 0, 'CHIEF_COMPLAINT'), ('visit-1', 1, 'PLAN')],
+        'VisitSummarySegments': [('visit-1', 0, 0, 'Cough'), ('visit-1', 0, 1, 'Fever')],
+        'VisitEvidenceLinks': [('visit-1', 0, 0, 0, 's1'), ('visit-1', 0, 0, 1, 's2')]
+    }
+
+
+def test_transcript_rows_come_from_the_segments_only():
+    transcript = {'Conversation': {
+        'TranscriptItems': [{'Type': 'pronunciation', 'Content': 'Hello', 'BeginAudioTime': 0.1}],
+        'TranscriptSegments': [
+            {'SegmentId': 's1', 'BeginAudioTime': 0.1, 'EndAudioTime': 1.2, 'Content': 'Hello there.',
+             'ParticipantDetails': {'ParticipantRole': 'CLINICIAN_0'},
+             'SectionDetails': {'SectionName': 'SUBJECTIVE'}}
+        ]
+    }}
+
+    rows = ingest.transcript_rows('visit-1', io.BytesIO(json.dumps(transcript).encode('utf-8')))
+
+    assert rows == {'VisitTranscriptSegments': [
+        ('visit-1', 0, 's1', 'CLINICIAN_0', 'SUBJECTIVE', 0.1, 1.2, 'Hello there.')
+    ]}
+
+
+def test_open_transcript_waits_for_a_missing_transcript(s3):
+    with pytest.raises(ingest.DocumentNotReady):
+        ingest.open_transcript(s3, 'output', 'visit-1', 'input')
+
+
+def test_open_transcript_of_a_trimmed_upload_waits_for_the_time_offset(s3):
+    s3.put_object(Bucket='input', Key='visit-1/_preprocessed/manifest.json', Body=json.dumps({'offsetSeconds': 7.5}))
+    s3.put_object(Bucket='output', Key='visit-1/transcript.json', Body=b'{}')
+
+    with pytest.raises(ingest.DocumentNotReady):
+        ingest.open_transcript(s3, 'output', 'visit-1', 'input')
+    # Without an input bucket the manifest is not looked for
+    assert ingest.open_transcript(s3, 'output', 'visit-1').read() == b'{}'
+
+    s3.put_object(Bucket='output', Key='visit-1/transcript.json', Body=b'{}',
+                  Metadata={ingest.TIME_OFFSET_METADATA: '7.5'})
+    assert ingest.open_transcript(s3, 'output', 'visit-1', 'input').read() == b'{}'
+
+
+def test_open_transcript_of_an_untrimmed_upload_does_not_wait(s3):
+    s3.put_object(Bucket='output', Key='visit-1/transcript.json', Body=b'{}')
+
+    assert ingest.open_transcript(s3, 'output', 'visit-1', 'input').read() == b'{}'
+    assert s3.gets == ['visit-1/transcript.json', 'visit-1/_preprocessed/manifest.json']
+
+
+def test_replace_rows_replaces_only_the_visits_own_rows(tables):
+    first = {'VisitSections': [('visit-1', 0, 'PLAN'), ('visit-1', 1, 'ASSESSMENT')],
+             'VisitTranscriptSegments': [('visit-1', 0, 's1', 'PATIENT', None, 0.0, 1.0, 'Hi')]}
+    other = {'VisitSections': [('visit-2', 0, 'PLAN')]}
+    second = {'VisitSections': [('visit-1', 0, 'CHIEF_COMPLAINT')]}
+
+    with tables.cursor() as cursor:
+        assert ingest.replace_rows(cursor, 'visit-1', first, 4096) == 3
+        assert ingest.replace_rows(cursor, 'visit-2', other, 4096) == 1
+        assert ingest.replace_rows(cursor, 'visit-1', second, 4096) == 1
+
+    assert tables.query("SELECT uniqueID, sectionIndex, sectionName FROM VisitSections ORDER BY uniqueID") == [
+        ('visit-1', 0, 'CHIEF_COMPLAINT'), ('visit-2', 0, 'PLAN')
+    ]
+    assert tables.query("SELECT COUNT(*) FROM VisitTranscriptSegments") == [(0,)]
+
+
+def test_replace_rows_inserts_each_table_in_one_batch_of_the_given_size(tables):
+    rows = {'VisitSections': [('visit-1', index, f"SECTION_{index}") for index in range(50)],
+            'VisitEvidenceLinks': [('visit-1', 0, 0, 0, 's1')]}
+
+    with tables.cursor() as cursor:
+        ingest.replace_rows(cursor, 'visit-1', rows, 1024)
+
+    inserts = [statement for statement in tables.statements if statement.startswith('INSERT')]
+    assert inserts == [
+        'INSERT INTO VisitSections (uniqueID, sectionIndex, sectionName) VALUES (%s, %s, %s)',
+        'INSERT INTO VisitEvidenceLinks (uniqueID, sectionIndex, segmentIndex, linkIndex, segmentId) '
+        'VALUES (%s, %s, %s, %s, %s)'
+    ]
+    assert tables.max_stmt_lengths == [1024, 1024]
+    deletes = [statement for statement in tables.statements if statement.startswith('DELETE')]
+    assert len(deletes) == len(ingest.COLUMNS)
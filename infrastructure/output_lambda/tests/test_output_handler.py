@@ -0,0 +1,208 @@
+import json
+
+import pytest
+
+
+def message(message_id, *keys, bucket='output'):
+    records = [{'eventTime': '2026-01-01T10:00:00.000Z', 's3': {'bucket': {'name': bucket}, 'object': {'key': key}}}
+               for key in keys]
+    return {'messageId': message_id, 'body': json.dumps({'Records': records})}
+
+
+def put_documents(s3, unique_id, demo_documents, transcript=True, metadata=None):
+    summary, transcript_json = demo_documents
+    s3.put_object(Bucket='output', Key=f"{unique_id}/summary.json", Body=summary)
+    if transcript:
+        s3.put_object(Bucket='output', Key=f"{unique_id}/transcript.json", Body=transcript_json, Metadata=metadata)
+
+
+def failures(response):
+    return [failure['itemIdentifier'] for failure in response['batchItemFailures']]
+
+
+def status(connection, unique_id):
+    return connection.query("SELECT status FROM Visits WHERE uniqueID = ?", (unique_id,))[0][0]
+
+
+def row_counts(connection, unique_id):
+    return {table: connection.query(f"SELECT COUNT(*) FROM {table} WHERE uniqueID = ?", (unique_id,))[0][0]
+            for table in ('VisitSections', 'VisitSummarySegments', 'VisitEvidenceLinks', 'VisitTranscriptSegments')}
+
+
+def expected_counts(demo_documents):
+    summary, transcript = (json.loads(document) for document in demo_documents)
+    sections = summary['ClinicalDocumentation']['Sections']
+    segments = [segment for section in sections for segment in section.get('Summary') or []]
+    return {
+        'VisitSections': len(sections),
+        'VisitSummarySegments': len(segments),
+        'VisitEvidenceLinks': sum(len(segment.get('EvidenceLinks') or []) for segment in segments),
+        'VisitTranscriptSegments': len(transcript['Conversation']['TranscriptSegments'])
+    }
+
+
+@pytest.mark.parametrize('key, unique_id', [
+    ('visit-1/summary.json', 'visit-1'),
+    ('visit-1/transcript.json', None),
+    ('visit-1-part-001/summary.json', None),
+    ('visit-1/nested/summary.json', None),
+    ('.write_access_check_file.temp', None),
+    # Only a three-digit suffix marks a chunk job
+    ('visit-part-1/summary.json', 'visit-part-1')
+])
+def test_visit_id_only_accepts_the_summary_of_a_visit_folder(output, key, unique_id):
+    assert output.visit_id({'s3': {'bucket': {'name': 'output'}, 'object': {'key': key}}}) == unique_id
+
+
+def test_completed_visit_is_marked_processed_and_ingested(output, s3, connection, demo_documents):
+    connection.add_visit('visit-1')
+    put_documents(s3, 'visit-1', demo_documents)
+
+    response = output.lambda_handler({'Records': [message('m1', 'visit-1/summary.json')]}, None)
+
+    assert response == {'status': 'success', 'batchItemFailures': []}
+    assert status(connection, 'visit-1') == 'Processed'
+    assert row_counts(connection, 'visit-1') == expected_counts(demo_documents)
+    assert connection.query("SELECT stage FROM visit_stages WHERE unique_id = 'visit-1'") == [('ingested',)]
+
+
+def test_intermediate_outputs_leave_the_database_alone(output, s3, connection):
+    connection.add_visit('visit-1')
+    event = {'Records': [
+        message('m1', 'visit-1/transcript.json'),
+        message('m2', 'visit-1-part-001/summary.json', 'visit-1-part-002/summary.json'),
+        {'messageId': 'm3', 'body': json.dumps({'Event': 's3:TestEvent'})}
+    ]}
+
+    response = output.lambda_handler(event, None)
+
+    assert failures(response) == []
+    assert status(connection, 'visit-1') == 'Processing'
+    assert connection.statements == []
+    assert s3.gets == []
+
+
+def test_unreadable_message_is_the_only_one_reported(output, s3, connection, demo_documents):
+    connection.add_visit('visit-1')
+    put_documents(s3, 'visit-1', demo_documents)
+    event = {'Records': [{'messageId': 'm1', 'body': 'not json'}, message('m2', 'visit-1/summary.json')]}
+
+    response = output.lambda_handler(event, None)
+
+    assert failures(response) == ['m1']
+    assert status(connection, 'visit-1') == 'Processed'
+
+
+def test_duplicate_notifications_are_coalesced_into_one_update(output, s3, connection, demo_documents):
+    connection.add_visit('visit-1')
+    put_documents(s3, 'visit-1', demo_documents)
+    event = {'Records': [
+        message('m1', 'visit-1/summary.json'),
+        message('m2', 'visit-1/summary.json', 'visit-2/summary.json')
+    ]}
+
+    response = output.lambda_handler(event, None)
+
+    assert failures(response) == []
+    updates = [statement for statement in connection.statements if statement.startswith('UPDATE Visits')]
+    assert updates == ["UPDATE Visits SET status = 'Processed' WHERE uniqueID IN (%s, %s)"]
+    # visit-2 has no row in Visits, so its documents are not read
+    assert s3.gets.count('visit-1/summary.json') == 1
+    assert not any(key.startswith('visit-2/') for key in s3.gets)
+
+
+def test_visit_without_its_transcript_is_retried_alone(output, s3, connection, demo_documents):
+    for unique_id in ('visit-1', 'visit-2'):
+        connection.add_visit(unique_id)
+    put_documents(s3, 'visit-1', demo_documents, transcript=False)
+    put_documents(s3, 'visit-2', demo_documents)
+    event = {'Records': [
+        message('m1', 'visit-1/summary.json'),
+        message('m2', 'visit-2/summary.json'),
+        message('m3', 'visit-1/summary.json')
+    ]}
+
+    response = output.lambda_handler(event, None)
+
+    assert failures(response) == ['m1', 'm3']
+    assert row_counts(connection, 'visit-2') == expected_counts(demo_documents)
+    assert set(row_counts(connection, 'visit-1').values()) == {0}
+
+    put_documents(s3, 'visit-1', demo_documents)
+    assert failures(output.lambda_handler({'Records': [message('m1', 'visit-1/summary.json')]}, None)) == []
+    assert row_counts(connection, 'visit-1') == expected_counts(demo_documents)
+
+
+def test_trimmed_visit_waits_for_its_transcript_times_to_be_restored(output, s3, connection, demo_documents):
+    connection.add_visit('visit-1')
+    s3.put_object(Bucket='input', Key='visit-1/_preprocessed/manifest.json', Body=json.dumps({'offsetSeconds': 7.5}))
+    put_documents(s3, 'visit-1', demo_documents)
+    event = {'Records': [message('m1', 'visit-1/summary.json')]}
+
+    assert failures(output.lambda_handler(event, None)) == ['m1']
+    # Nothing was stored before the documents were final
+    assert not any(statement.startswith('INSERT INTO Visit') for statement in connection.statements)
+
+    put_documents(s3, 'visit-1', demo_documents, metadata={'time-offset-seconds': '7.5'})
+    assert failures(output.lambda_handler(event, None)) == []
+    assert row_counts(connection, 'visit-1') == expected_counts(demo_documents)
+
+
+def test_redelivered_visit_replaces_its_rows(output, s3, connection, demo_documents):
+    connection.add_visit('visit-1')
+    put_documents(s3, 'visit-1', demo_documents)
+    event = {'Records': [message('m1', 'visit-1/summary.json')]}
+
+    output.lambda_handler(event, None)
+    output.lambda_handler(event, None)
+
+    assert row_counts(connection, 'visit-1') == expected_counts(demo_documents)
+
+
+def test_failed_ingestion_is_rolled_back_and_retried(output, s3, connection, demo_documents):
+    connection.add_visit('visit-1')
+    put_documents(s3, 'visit-1', demo_documents)
+    connection.fail_on = 'INSERT INTO VisitTranscriptSegments'
+
+    response = output.lambda_handler({'Records': [message('m1', 'visit-1/summary.json')]}, None)
+
+    assert failures(response) == ['m1']
+    assert connection.rollbacks == 1
+    assert set(row_counts(connection, 'visit-1').values()) == {0}
+
+
+def test_failed_status_update_fails_every_message(output, connection):
+    connection.add_visit('visit-1')
+    connection.fail_on = 'UPDATE Visits'
+    event = {'Records': [message('m1', 'visit-1/summary.json'), message('m2', 'visit-2/summary.json')]}
+
+    response = output.lambda_handler(event, None)
+
+    assert failures(response) == ['m1', 'm2']
+    assert connection.rollbacks == 1
+    assert status(connection, 'visit-1') == 'Processing'
+
+
+def test_failed_direct_s3_invocation_raises_for_lambda_to_retry(output, connection):
+    connection.fail_on = 'UPDATE Visits'
+    record = {'s3': {'bucket': {'name': 'output'}, 'object': {'key': 'visit-1/summary.json'}}}
+
+    with pytest.raises(RuntimeError):
+        output.lambda_handler({'Records': [record]}, None)
+
+
+def test_mark_processed_splits_the_update_to_fit_the_packet_limit(output, connection):
+    connection.max_allowed_packet = 2 * (output.STATEMENT_OVERHEAD_BYTES + 3 * 20)
+    unique_ids = [f"visit-{index}" for index in range(7)]
+    for unique_id in unique_ids[:5]:
+        connection.add_visit(unique_id, created_at='2026-01-01T10:00:00')
+    connection.add_visit('visit-0')
+
+    matched = output.mark_processed(unique_ids)
+
+    assert matched == dict({'visit-0': (2, '2026-01-01T10:00:00')},
+                           **{unique_id: (1, '2026-01-01T10:00:00') for unique_id in unique_ids[1:5]})
+    updates = [statement for statement in connection.statements if statement.startswith('UPDATE Visits')]
+    assert len(updates) == 3
+    assert connection.commits == 1
+    assert connection.query("SELECT DISTINCT status FROM Visits") == [('Processed',)]
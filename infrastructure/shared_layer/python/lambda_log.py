@@ -0,0 +1,222 @@
+"""
+Compact structured logging for the MediSync Lambda handlers.
+
+Shipped in the shared Lambda layer, so the input and output Lambdas log the
+same way. Every log line is a single JSON object with a level, a message and
+any extra fields. Field values can be callables, which are only called when
+the line is actually written, so expensive payloads cost nothing when they
+are filtered out.
+
+Handlers wrapped with @log_invocation also write one summary line per
+invocation, carrying its duration, the timers and counters collected with
+timer() and count(), and any fields set with annotate().
+
+Configuration:
+
+    LOG_LEVEL          DEBUG, INFO (default), WARNING or ERROR
+    LOG_SAMPLE_RATE    Share of invocations that log their DEBUG lines even
+                       above DEBUG level (default 0.01)
+"""
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+_invocation = None
+_lock = threading.Lock()
+
+
+def _level():
+    return LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), LEVELS['INFO'])
+
+
+def _sample_rate():
+    return float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+
+
+class Invocation:
+    """
+    Timers, counters and fields collected over one handler invocation.
+
+    Args:
+        handler (str): Name of the handler
+        request_id (str): Lambda request ID, if known
+        sampled (bool): Whether DEBUG lines of this invocation are written
+    """
+
+    def __init__(self, handler, request_id=None, sampled=False):
+        self.handler = handler
+        self.request_id = request_id
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.counts = {}
+        self.fields = {}
+        self.lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def annotate(self, **fields):
+        with self.lock:
+            self.fields.update(fields)
+
+    def summary(self):
+        """
+        Returns:
+            dict: Summary line fields of the invocation so far
+        """
+        with self.lock:
+            line = {
+                'handler': self.handler,
+                'durationMs': round((time.perf_counter() - self.started) * 1000, 1),
+                'timingsMs': {name: round(seconds * 1000, 1) for name, seconds in self.timings.items()},
+                'counts': dict(self.counts)
+            }
+            line.update(self.fields)
+        return line
+
+
+def _emit(level, message, fields):
+    line = {'level': level, 'message': message}
+    invocation = _invocation
+    if invocation is not None and invocation.request_id:
+        line['requestId'] = invocation.request_id
+    for name, value in fields.items():
+        line[name] = value() if callable(value) else value
+    print(json.dumps(line, default=str, separators=(',', ':')))
+
+
+def log(level, message, **fields):
+    """
+    Write one log line if `level` is enabled.
+
+    Args:
+        level (str): DEBUG, INFO, WARNING or ERROR
+        message (str): Short constant description of the event
+        **fields: Extra fields; callables are resolved only when written
+    """
+    if LEVELS[level] >= _level():
+        _emit(level, message, fields)
+
+
+def debug(message, **fields):
+    """
+    Write a DEBUG line; above DEBUG level only in sampled invocations.
+    """
+    invocation = _invocation
+    if _level() <= LEVELS['DEBUG'] or (invocation is not None and invocation.sampled):
+        _emit('DEBUG', message, fields)
+
+
+def info(message, **fields):
+    log('INFO', message, **fields)
+
+
+def warning(message, **fields):
+    log('WARNING', message, **fields)
+
+
+def error(message, **fields):
+    log('ERROR', message, **fields)
+
+
+def count(name, n=1):
+    """
+    Add to a counter of the current invocation's summary.
+    """
+    invocation = _invocation
+    if invocation is not None:
+        invocation.count(name, n)
+
+
+def annotate(**fields):
+    """
+    Set fields of the current invocation's summary.
+    """
+    invocation = _invocation
+    if invocation is not None:
+        invocation.annotate(**fields)
+
+
+@contextmanager
+def timer(name):
+    """
+    Time a block and add it to the current invocation's summary under
+    `name`. Blocks timed under the same name, also from several threads,
+    are added up.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        invocation = _invocation
+        if invocation is not None:
+            invocation.add_time(name, time.perf_counter() - started)
+
+
+def start_invocation(handler, context=None):
+    """
+    Begin collecting the summary of a new invocation.
+
+    Args:
+        handler (str): Name of the handler
+        context (object): Lambda context, for the request ID
+
+    Returns:
+        Invocation: The current invocation
+    """
+    global _invocation
+    invocation = Invocation(
+        handler,
+        request_id=getattr(context, 'aws_request_id', None),
+        sampled=random.random() < _sample_rate()
+    )
+    with _lock:
+        _invocation = invocation
+    return invocation
+
+
+def finish_invocation(**fields):
+    """
+    Write the summary line of the current invocation and stop collecting.
+    """
+    global _invocation
+    invocation = _invocation
+    if invocation is None:
+        return
+    invocation.annotate(**fields)
+    _emit('INFO', 'Invocation summary', invocation.summary())
+    with _lock:
+        _invocation = None
+
+
+def log_invocation(handler):
+    """
+    Decorator for Lambda handlers: starts an invocation summary, and writes
+    it with the response's statusCode (or the exception) when the handler
+    returns.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context, *args, **kwargs):
+        start_invocation(handler.__name__, context)
+        try:
+            response = handler(event, context, *args, **kwargs)
+        except Exception as e:
+            finish_invocation(error=str(e))
+            raise
+        status = response.get('statusCode') if isinstance(response, dict) else None
+        finish_invocation(statusCode=status)
+        return response
+    return wrapper
@@ -0,0 +1,157 @@
+"""
+CloudWatch embedded metric format (EMF) records for the pipeline stages.
+
+Handlers record values with put() while they run; nothing is written until
+flush(), which handlers wrapped with @emit_metrics call once at the end of
+every invocation. The buffered values are written as EMF JSON documents,
+which CloudWatch Logs turns into metrics in the MediSync/Pipeline namespace
+with the function name as dimension.
+
+Configuration:
+
+    METRICS_SINK    stdout (default, for CloudWatch Logs), file:<path> to
+                    append the documents to a local file, or off
+"""
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+
+NAMESPACE = 'MediSync/Pipeline'
+
+# CloudWatch accepts at most this many metrics per document and values per metric
+MAX_METRICS_PER_DOCUMENT = 100
+MAX_VALUES_PER_METRIC = 100
+
+_lock = threading.Lock()
+_buffer = {}
+_units = {}
+
+
+def put(name, value, unit='Milliseconds'):
+    """
+    Buffer one value of a metric.
+
+    Args:
+        name (str): Metric name
+        value (float): Value to record
+        unit (str): CloudWatch unit of the metric
+    """
+    with _lock:
+        _buffer.setdefault(name, []).append(value)
+        _units[name] = unit
+
+
+def seconds_since(moment):
+    """
+    Seconds from a moment until now.
+
+    Args:
+        moment (object): Aware datetime, or an ISO 8601 timestamp such as an
+            S3 event's eventTime ('2025-04-15T10:00:00.000Z')
+
+    Returns:
+        float: Elapsed seconds, or None if the moment cannot be read
+    """
+    if isinstance(moment, str):
+        try:
+            moment = datetime.fromisoformat(moment.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(moment, datetime):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - moment).total_seconds()
+
+
+def documents(function_name, values, units, timestamp_ms):
+    """
+    EMF documents carrying the given metric values, split to stay within
+    CloudWatch's per-document limits.
+
+    Args:
+        function_name (str): Value of the Function dimension
+        values (dict): Lists of values keyed by metric name
+        units (dict): Units keyed by metric name
+        timestamp_ms (int): Timestamp of the documents
+
+    Returns:
+        list: EMF documents as dicts
+    """
+    batches = []
+    for name, metric_values in values.items():
+        for start in range(0, len(metric_values), MAX_VALUES_PER_METRIC):
+            batches.append((name, metric_values[start:start + MAX_VALUES_PER_METRIC]))
+
+    docs = []
+    while batches:
+        document = {'Function': function_name}
+        metrics = []
+        remaining = []
+        for name, metric_values in batches:
+            if name in document or len(metrics) == MAX_METRICS_PER_DOCUMENT:
+                remaining.append((name, metric_values))
+                continue
+            document[name] = metric_values if len(metric_values) > 1 else metric_values[0]
+            metrics.append({'Name': name, 'Unit': units[name]})
+        document['_aws'] = {
+            'Timestamp': timestamp_ms,
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['Function']],
+                'Metrics': metrics
+            }]
+        }
+        docs.append(document)
+        batches = remaining
+    return docs
+
+
+def flush(function_name):
+    """
+    Write every buffered value and empty the buffer.
+
+    Args:
+        function_name (str): Value of the Function dimension
+
+    Returns:
+        int: Number of EMF documents written
+    """
+    with _lock:
+        values = dict(_buffer)
+        units = dict(_units)
+        _buffer.clear()
+        _units.clear()
+    if not values:
+        return 0
+
+    sink = os.environ.get('METRICS_SINK', 'stdout')
+    if sink == 'off':
+        return 0
+    lines = [json.dumps(document, separators=(',', ':'))
+             for document in documents(function_name, values, units, int(time.time() * 1000))]
+    if sink.startswith('file:'):
+        with open(sink[len('file:'):], 'a') as sink_file:
+            sink_file.write(''.join(line + '\n' for line in lines))
+    else:
+        for line in lines:
+            print(line)
+    return len(lines)
+
+
+def emit_metrics(handler):
+    """
+    Decorator for Lambda handlers: flushes the metrics recorded during the
+    invocation once it ends, also when the handler raises.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context, *args, **kwargs):
+        try:
+            return handler(event, context, *args, **kwargs)
+        finally:
+            flush(getattr(context, 'function_name', None) or handler.__name__)
+    return wrapper
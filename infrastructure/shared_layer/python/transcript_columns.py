@@ -0,0 +1,270 @@
+"""
+Columnar in-memory model of HealthScribe TranscriptItems.
+
+transcript.json has one TranscriptItems entry per word or punctuation mark,
+each a dict holding a list holding another dict: around 600 bytes of Python
+objects per word, so an hour-long visit's items take hundreds of megabytes
+once loaded. ItemColumns keeps them as parallel `array` columns instead
+(begin and end time, confidence, a token number and a type number), with
+each distinct word stored once in a token table: about 30 bytes per item.
+
+The columns can be saved to a file and mapped back without copying, e.g.
+to hand a merged transcript's items to another process or to keep them in
+/tmp across invocations. Items are turned back into HealthScribe's dicts
+one at a time, when a document is written.
+
+The arrays are in the machine's byte order; a saved file is only read on
+the same kind of machine.
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from transcript_stream import TranscriptItem, transcript_item
+
+
+# Item types, numbered by position; types not listed are added per instance
+ITEM_TYPES = ['PRONUNCIATION', 'PUNCTUATION']
+
+PUNCTUATION = ITEM_TYPES.index('PUNCTUATION')
+
+# Column name and array typecode. Confidence is kept as a double so values
+# come back exactly as HealthScribe wrote them.
+COLUMNS = [('begin', 'd'), ('end', 'd'), ('confidence', 'd'), ('token', 'I'), ('type', 'B')]
+
+FILE_MAGIC = b'MSITEMS1'
+
+_ALIGNMENT = 8
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class ItemColumns:
+    """
+    TranscriptItems of one transcript as parallel columns.
+
+    Columns are `array.array`s, or read-only memoryviews for columns mapped
+    from a file with load(); both index and iterate the same way.
+    """
+
+    def __init__(self):
+        self.begin = array('d')
+        self.end = array('d')
+        self.confidence = array('d')
+        self.token = array('I')
+        self.type = array('B')
+        self.tokens = []
+        self.types = list(ITEM_TYPES)
+        self._token_numbers = {}
+        self._type_numbers = {name: number for number, name in enumerate(self.types)}
+        self._mapping = None
+
+    @classmethod
+    def from_dicts(cls, items):
+        """
+        Columns of TranscriptItems entries as they appear in transcript.json.
+        """
+        columns = cls()
+        for item in items:
+            columns.append(transcript_item(item))
+        return columns
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Columns of transcript_stream.TranscriptItem records.
+        """
+        columns = cls()
+        for record in records:
+            columns.append(record)
+        return columns
+
+    def __len__(self):
+        return len(self.begin)
+
+    def __getitem__(self, index):
+        return TranscriptItem(
+            self.types[self.type[index]], self.tokens[self.token[index]], self.confidence[index],
+            self.begin[index], self.end[index]
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def _number(self, table, numbers, value):
+        number = numbers.get(value)
+        if number is None:
+            number = numbers[value] = len(table)
+            table.append(value)
+        return number
+
+    def append(self, record):
+        """
+        Add an item.
+
+        Args:
+            record (transcript_stream.TranscriptItem): The item
+        """
+        self.begin.append(record.begin_audio_time or 0.0)
+        self.end.append(record.end_audio_time or 0.0)
+        self.confidence.append(record.confidence or 0.0)
+        self.token.append(self._number(self.tokens, self._token_numbers, record.content))
+        self.type.append(self._number(self.types, self._type_numbers, record.type))
+
+    def extend(self, other):
+        """
+        Add the items of another ItemColumns, renumbering its tokens and types.
+        """
+        tokens = array('I', (self._number(self.tokens, self._token_numbers, token) for token in other.tokens))
+        types = [self._number(self.types, self._type_numbers, name) for name in other.types]
+        self.begin.extend(other.begin)
+        self.end.extend(other.end)
+        self.confidence.extend(other.confidence)
+        self.token.extend(tokens[number] for number in other.token)
+        self.type.extend(types[number] for number in other.type)
+
+    def rebased(self, offset, keep_start=None, keep_end=None):
+        """
+        Items shifted by `offset` seconds, keeping only items that start
+        inside [keep_start, keep_end); the columnar form of
+        chunking.rebase_items.
+
+        Punctuation items carry no timing (both times are 0), so they are
+        left as they are and follow the item before them in or out.
+
+        Returns:
+            ItemColumns: The kept items; token and type tables are shared
+                with this instance's
+        """
+        rebased = ItemColumns()
+        rebased.tokens = self.tokens
+        rebased.types = self.types
+        rebased._token_numbers = self._token_numbers
+        rebased._type_numbers = self._type_numbers
+
+        keep_previous = False
+        begin, end, kinds = self.begin, self.end, self.type
+        for index in range(len(self)):
+            if kinds[index] == PUNCTUATION:
+                if keep_previous:
+                    rebased._take(self, index, begin[index], end[index])
+                continue
+            shifted = round(begin[index] + offset, 3)
+            keep_previous = (
+                (keep_start is None or shifted >= keep_start)
+                and (keep_end is None or shifted < keep_end)
+            )
+            if keep_previous:
+                rebased._take(self, index, shifted, round(end[index] + offset, 3))
+        return rebased
+
+    def _take(self, source, index, begin, end):
+        self.begin.append(begin)
+        self.end.append(end)
+        self.confidence.append(source.confidence[index])
+        self.token.append(source.token[index])
+        self.type.append(source.type[index])
+
+    def dicts(self):
+        """
+        Yield the items as transcript.json entries, one at a time.
+        """
+        for index in range(len(self)):
+            yield {
+                'Alternatives': [{'Confidence': self.confidence[index], 'Content': self.tokens[self.token[index]]}],
+                'BeginAudioTime': self.begin[index],
+                'EndAudioTime': self.end[index],
+                'Type': self.types[self.type[index]]
+            }
+
+    def text(self):
+        """
+        Words of the items joined into text, punctuation attached to the word before.
+        """
+        parts = []
+        for index in range(len(self)):
+            if parts and self.type[index] != PUNCTUATION:
+                parts.append(' ')
+            parts.append(self.tokens[self.token[index]])
+        return ''.join(parts)
+
+    def nbytes(self):
+        """
+        Bytes held by the columns, excluding the token table.
+        """
+        return sum(len(getattr(self, name)) * array(typecode).itemsize for name, typecode in COLUMNS)
+
+    def save(self, path):
+        """
+        Write the columns to a file that load() maps back without copying.
+
+        Layout: FILE_MAGIC, the length of a JSON header as an unsigned 64-bit
+        integer, the header (item count, token and type tables, byte order),
+        then the columns in COLUMNS order, each starting at an 8-byte
+        aligned offset.
+        """
+        header = {'count': len(self), 'tokens': self.tokens, 'types': self.types, 'byteorder': sys.byteorder}
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        with open(path, 'wb') as out:
+            out.write(FILE_MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+            for name, _ in COLUMNS:
+                out.write(bytes(_aligned(out.tell()) - out.tell()))
+                column = getattr(self, name)
+                out.write(column.tobytes() if isinstance(column, array) else bytes(column))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map columns saved with save(). The columns are read-only views of
+        the file; close() releases it.
+
+        Raises:
+            ValueError: If the file is not a columns file of this byte order
+        """
+        with open(path, 'rb') as source:
+            mapping = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapping[:len(FILE_MAGIC)] != FILE_MAGIC:
+            mapping.close()
+            raise ValueError(f"{path} is not a transcript items file")
+        header_length, = struct.unpack_from('<Q', mapping, len(FILE_MAGIC))
+        start = len(FILE_MAGIC) + 8
+        header = json.loads(bytes(mapping[start:start + header_length]))
+        if header['byteorder'] != sys.byteorder:
+            mapping.close()
+            raise ValueError(f"{path} was saved on a {header['byteorder']}-endian machine")
+
+        columns = cls()
+        columns.tokens = header['tokens']
+        columns.types = header['types']
+        columns._token_numbers = {token: number for number, token in enumerate(columns.tokens)}
+        columns._type_numbers = {name: number for number, name in enumerate(columns.types)}
+        view = memoryview(mapping)
+        offset = start + header_length
+        for name, typecode in COLUMNS:
+            offset = _aligned(offset)
+            size = header['count'] * array(typecode).itemsize
+            setattr(columns, name, view[offset:offset + size].cast(typecode))
+            offset += size
+        columns._mapping = (mapping, view)
+        return columns
+
+    def close(self):
+        """
+        Release the file mapped by load().
+        """
+        if self._mapping is None:
+            return
+        mapping, view = self._mapping
+        for name, typecode in COLUMNS:
+            column = getattr(self, name)
+            if isinstance(column, memoryview):
+                column.release()
+            setattr(self, name, array(typecode))
+        view.release()
+        mapping.close()
+        self._mapping = None
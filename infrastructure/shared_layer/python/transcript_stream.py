@@ -0,0 +1,224 @@
+"""
+Streaming reader for HealthScribe transcript.json documents.
+
+transcript.json holds one Conversation object whose TranscriptItems (one
+per word), TranscriptSegments and ClinicalInsights lists grow with the
+length of the visit: the demo document of a few minutes is 380 KB, an
+hour-long visit is tens of megabytes. json.load builds the whole tree, which
+takes several times the document's size in memory.
+
+This reader pulls the document from a file-like body a block at a time and
+decodes one list element at a time, so memory stays bounded by the block
+size and the largest single element, whatever the length of the visit.
+Elements are returned as namedtuples; fields a consumer does not ask for
+are still read past but never kept.
+"""
+import codecs
+import json
+from collections import namedtuple
+
+
+TranscriptSegment = namedtuple('TranscriptSegment', [
+    'segment_id', 'participant_role', 'section_name', 'begin_audio_time', 'end_audio_time', 'content'
+])
+
+TranscriptItem = namedtuple('TranscriptItem', [
+    'type', 'content', 'confidence', 'begin_audio_time', 'end_audio_time'
+])
+
+ClinicalInsight = namedtuple('ClinicalInsight', [
+    'insight_id', 'insight_type', 'category', 'type', 'spans', 'attributes'
+])
+
+# Bytes read from the body at a time
+BLOCK_BYTES = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+def transcript_segment(segment):
+    return TranscriptSegment(
+        segment['SegmentId'],
+        segment.get('ParticipantDetails', {}).get('ParticipantRole'),
+        segment.get('SectionDetails', {}).get('SectionName'),
+        segment.get('BeginAudioTime'),
+        segment.get('EndAudioTime'),
+        segment.get('Content', '')
+    )
+
+
+def transcript_item(item):
+    alternative = (item.get('Alternatives') or [{}])[0]
+    return TranscriptItem(
+        item.get('Type'),
+        alternative.get('Content', ''),
+        alternative.get('Confidence'),
+        item.get('BeginAudioTime'),
+        item.get('EndAudioTime')
+    )
+
+
+def clinical_insight(insight):
+    return ClinicalInsight(
+        insight.get('InsightId'),
+        insight.get('InsightType'),
+        insight.get('Category'),
+        insight.get('Type'),
+        insight.get('Spans', []),
+        insight.get('Attributes', [])
+    )
+
+
+# Record type of the elements of each Conversation list
+RECORDS = {
+    'TranscriptSegments': transcript_segment,
+    'TranscriptItems': transcript_item,
+    'ClinicalInsights': clinical_insight
+}
+
+
+class _Reader:
+    """
+    JSON text of a byte stream, decoded incrementally and buffered only
+    from the current position on.
+    """
+
+    def __init__(self, body, block_bytes=BLOCK_BYTES):
+        self.body = body
+        self.block_bytes = block_bytes
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Read another block onto the buffer.
+
+        Returns:
+            bool: False once the body is exhausted
+        """
+        if self.eof:
+            return False
+        block = self.body.read(self.block_bytes)
+        if not block:
+            self.eof = True
+            self.buffer = self.buffer[self.pos:] + self.decoder.decode(b'', final=True)
+        else:
+            self.buffer = self.buffer[self.pos:] + self.decoder.decode(block)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Next character that is not whitespace, left unread; '' at the end.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, characters):
+        character = self.peek()
+        if character not in characters or not character:
+            raise ValueError(f"Expected {characters!r} at {character!r} in transcript")
+        self.pos += 1
+        return character
+
+    def value(self):
+        """
+        Decode the next complete JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next block
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """
+        Yield the keys of the object that starts here, leaving the reader at
+        each member's value.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """
+        Yield the elements of the list that starts here, decoded one at a time.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def conversation(body, block_bytes=BLOCK_BYTES):
+    """
+    Yield the members of a transcript's Conversation, streaming its lists.
+
+    Args:
+        body (object): File-like object with read(size), such as an S3
+            StreamingBody or a file opened in binary mode
+        block_bytes (int): Bytes read at a time
+
+    Yields:
+        tuple: (field, value) for each plain member such as JobName, and
+            (field, element) for each element of a list member such as
+            TranscriptItems, in document order
+    """
+    reader = _Reader(body, block_bytes)
+    for key in reader.members():
+        if key != 'Conversation':
+            reader.value()
+            continue
+        for field in reader.members():
+            if reader.peek() == '[':
+                for element in reader.elements():
+                    yield field, element
+            else:
+                yield field, reader.value()
+
+
+def records(body, fields=tuple(RECORDS), block_bytes=BLOCK_BYTES):
+    """
+    Yield the elements of a transcript's lists as typed records.
+
+    Args:
+        body (object): File-like object with read(size)
+        fields (iterable): Conversation lists to return, from RECORDS; the
+            others are read past
+        block_bytes (int): Bytes read at a time
+
+    Yields:
+        tuple: (field, record), e.g. ('TranscriptItems', TranscriptItem(...)),
+            in document order
+    """
+    fields = set(fields)
+    for field, value in conversation(body, block_bytes):
+        if field in fields:
+            yield field, RECORDS[field](value)
@@ -0,0 +1,129 @@
+"""
+Pipeline stages of a visit, recorded with a timestamp per stage.
+
+A visit moves through the stages below in order. The input Lambda records
+uploaded, submitted and transcribed; the output Lambda records summarized
+and ingested. Visits.status, which the web app shows, is left to the
+existing Processing/Processed flow.
+
+Transitions only ever move a visit forward: every UPDATE is guarded by the
+stage's rank, so an event that arrives late or twice changes nothing. The
+time spent between a visit's previous recorded stage and the new one is
+put as a <Previous>To<Stage> metric (e.g. SubmittedToTranscribed), which
+gives a latency histogram per stage.
+
+Works on MySQL and on SQLite stores; statements use %s placeholders.
+"""
+import time
+
+import lambda_metrics
+
+
+STAGES = ['uploaded', 'submitted', 'transcribed', 'summarized', 'ingested']
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS visit_stages (
+    unique_id VARCHAR(255) NOT NULL PRIMARY KEY,
+    stage VARCHAR(20) NOT NULL,
+    stage_rank INT NOT NULL,
+    uploaded_at DOUBLE,
+    submitted_at DOUBLE,
+    transcribed_at DOUBLE,
+    summarized_at DOUBLE,
+    ingested_at DOUBLE,
+    updated_at DOUBLE NOT NULL
+)
+"""
+
+
+class VisitStages:
+    """
+    Stage records of visits.
+
+    Args:
+        execute (callable): Runs one statement, `execute(sql, params)`, and
+            returns (rows fetched, affected row count), like store.Store.execute
+        dialect (str): 'mysql' or 'sqlite'
+        clock (callable): Wall clock in seconds
+    """
+
+    def __init__(self, execute, dialect='mysql', clock=time.time):
+        self.execute = execute
+        self.dialect = dialect
+        self.clock = clock
+        self.execute(CREATE_TABLE, ())
+
+    def advance(self, unique_ids, stage, at=None):
+        """
+        Move visits forward to `stage`.
+
+        Visits without a record get one at `stage`; visits already at or
+        past it are left as they are.
+
+        Args:
+            unique_ids (list): uniqueIDs of the visits
+            stage (str): One of STAGES
+            at (float): When the stage was reached, epoch seconds; now if not given
+
+        Returns:
+            int: Number of visits that moved
+        """
+        unique_ids = list(dict.fromkeys(unique_ids))
+        if not unique_ids:
+            return 0
+        rank = STAGES.index(stage)
+        at = self.clock() if at is None else at
+        now = self.clock()
+        placeholders = ', '.join(['%s'] * len(unique_ids))
+
+        rows, _ = self.execute(
+            f"SELECT unique_id, stage_rank, {', '.join(f'{name}_at' for name in STAGES)} "
+            f"FROM visit_stages WHERE unique_id IN ({placeholders})",
+            tuple(unique_ids)
+        )
+        existing = {row[0]: row for row in rows}
+
+        new = [unique_id for unique_id in unique_ids if unique_id not in existing]
+        inserted = 0
+        if new:
+            insert = 'INSERT OR IGNORE' if self.dialect == 'sqlite' else 'INSERT IGNORE'
+            _, inserted = self.execute(
+                f"{insert} INTO visit_stages (unique_id, stage, stage_rank, {stage}_at, updated_at) VALUES "
+                + ', '.join(['(%s, %s, %s, %s, %s)'] * len(new)),
+                tuple(value for unique_id in new for value in (unique_id, stage, rank, at, now))
+            )
+
+        moved = inserted
+        behind = [unique_id for unique_id in unique_ids if unique_id in existing and existing[unique_id][1] < rank]
+        if behind:
+            # Guarded by the rank, in case another invocation moved a visit in the meantime
+            _, moved_on = self.execute(
+                f"UPDATE visit_stages SET stage = %s, stage_rank = %s, {stage}_at = %s, updated_at = %s "
+                f"WHERE unique_id IN ({', '.join(['%s'] * len(behind))}) AND stage_rank < %s",
+                (stage, rank, at, now) + tuple(behind) + (rank,)
+            )
+            moved += moved_on
+
+        for unique_id in behind:
+            previous = latest_stage(existing[unique_id][2:], rank)
+            if previous is not None:
+                name, reached_at = previous
+                lambda_metrics.put(f"{name.capitalize()}To{stage.capitalize()}", max(0.0, at - reached_at), 'Seconds')
+        return moved
+
+
+def latest_stage(timestamps, before_rank):
+    """
+    Latest stage recorded before a given rank.
+
+    Args:
+        timestamps (tuple): Timestamps of a visit in STAGES order, None where unrecorded
+        before_rank (int): Only stages of a lower rank are considered
+
+    Returns:
+        tuple: (stage name, timestamp), or None if no earlier stage was recorded
+    """
+    for rank in range(before_rank - 1, -1, -1):
+        if timestamps[rank] is not None:
+            return STAGES[rank], timestamps[rank]
+    return None